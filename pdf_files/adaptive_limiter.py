@@ -0,0 +1,133 @@
+"""
+AIMD concurrency control for Document AI calls.
+
+The controller keeps a window of allowed in-flight requests. Every healthy,
+fast response grows the window additively; a quota or deadline error halves
+it and the request is retried after a backoff instead of dropping the
+document. A burst of errors counts once: only requests sent after the last
+decrease can shrink the window again. The current window and throttle counts are exposed through stats().
+"""
+import random
+import threading
+import time
+
+from google.api_core import exceptions
+
+# Errors that mean "slow down", as opposed to a broken request.
+THROTTLE_ERRORS = (
+    exceptions.TooManyRequests,  # includes ResourceExhausted (quota)
+    exceptions.DeadlineExceeded,
+    exceptions.GatewayTimeout,  # DeadlineExceeded over REST
+    exceptions.ServiceUnavailable,
+)
+
+
+class AdaptiveConcurrency:
+    """Additive-increase / multiplicative-decrease limit on concurrent calls."""
+
+    def __init__(
+        self,
+        initial_window: float = 4,
+        min_window: float = 1,
+        max_window: float = 64,
+        decrease_factor: float = 0.5,
+        latency_target: float = 30.0,
+        max_retries: int = 5,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.window = float(initial_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.in_flight = 0
+        self.successes = 0
+        self.throttle_events = 0
+        self.retries = 0
+        self.failures = 0
+        self.decreases = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> int:
+        """
+        Blocks until a slot is free under the current window. Returns the
+        number of decreases so far, to hand back to release().
+        """
+        with self._cond:
+            while self.in_flight >= max(1, int(self.window)):
+                self._cond.wait()
+            self.in_flight += 1
+            return self.decreases
+
+    def release(self, latency: float = None, throttled: bool = False, decreases: int = None):
+        """
+        Frees a slot and adjusts the window from the outcome of the call.
+        decreases is what acquire() returned: a throttled request sent before
+        the latest decrease is counted but does not shrink the window again.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttle_events += 1
+                if decreases is None or decreases == self.decreases:
+                    self.decreases += 1
+                    self.window = max(self.min_window, self.window * self.decrease_factor)
+            elif latency is not None:
+                self.successes += 1
+                # Only grow while responses are coming back quickly
+                if latency <= self.latency_target:
+                    self.window = min(self.max_window, self.window + 1.0 / self.window)
+            self._cond.notify_all()
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given retry attempt."""
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    def call(self, func, *args, pace=None, **kwargs):
+        """
+        Runs func under the window. Throttling errors shrink the window and
+        are retried up to max_retries times before being raised. pace (e.g.
+        a RateLimiter's acquire) is called before each attempt takes a slot,
+        so waiting for the rate limit never holds one.
+        """
+        for attempt in range(self.max_retries + 1):
+            if pace is not None:
+                pace()
+            decreases = self.acquire()
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except THROTTLE_ERRORS as e:
+                self.release(throttled=True, decreases=decreases)
+                if attempt == self.max_retries:
+                    with self._cond:
+                        self.failures += 1
+                    raise
+                with self._cond:
+                    self.retries += 1
+                delay = self.backoff(attempt)
+                print(f"Document AI throttled ({type(e).__name__}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.release()
+                raise
+            self.release(latency=time.monotonic() - start)
+            return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "successes": self.successes,
+                "throttle_events": self.throttle_events,
+                "decreases": self.decreases,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
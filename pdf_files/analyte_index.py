@@ -0,0 +1,227 @@
+"""
+Test-name canonicalization against the curated list in analytes.py.
+
+The same analyte shows up as "Total Protein", "Protein, Total", "TOTAL
+PROTEIN" or an OCR slip like "Tota1 Protien". Comparing every raw name with
+every known name is O(n*m), so the known names are indexed once:
+
+1. a name is normalized to lower-case words in sorted order, which makes
+   case, punctuation and word order irrelevant; an exact hit is a dict
+   lookup. Failing that, common OCR confusions ("0" -> "o", "rn" -> "m",
+   ...) are folded, and both the sorted words and the name with its
+   separators dropped ("TotalBilirubin") are looked up.
+2. otherwise the character trigrams of those two forms are looked up in an
+   inverted index, and only the few names sharing the most trigrams are
+   scored by edit similarity. A near tie between two analytes
+   ("Cholesterol" vs HDL and LDL Cholesterol) is left unmatched rather
+   than guessed. A fuzzy hit must also keep every distinguishing word:
+   the same qualifiers (specimen, absolute, %, nucleated, direct /
+   indirect, non-) and the same short words such as "B12" or "T4", so
+   "nRBC %" is never taken for "RBC", "Bilirubin, Indirect" for
+   "Bilirubin Direct" nor "Vitamin B1" for "Vitamin B12". A name that
+   only spelling could tell apart from a known one stays as printed.
+
+Results are memoized, since the same raw names repeat in every report.
+
+    index = get_index()
+    index.canonicalize("PROTEIN, TOTAL")         # "Total Protein"
+    rows = canonicalize_rows(parse_output(...))  # same rows, canonical names
+"""
+import functools
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from itertools import chain, islice
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analytes import ANALYTES
+
+DEFAULT_THRESHOLD = float(os.environ.get("DOCAI_ANALYTE_THRESHOLD", 0.8))
+DEFAULT_CACHE_SIZE = 1 << 16
+# Candidates (by shared trigrams) scored with SequenceMatcher, and the
+# score gap needed to pick one analyte over another
+SHORTLIST = 3
+AMBIGUITY_MARGIN = 0.03
+NON_WORD = re.compile(r"[^0-9a-z]+")
+OCR_CONFUSIONS = [("rn", "m"), ("vv", "w"), ("0", "o"), ("1", "l"), ("5", "s"), ("8", "b")]
+# Words that turn a name into a different test: specimen, absolute count vs
+# percentage, nucleated cells, direct vs indirect. Words starting with
+# "non" count as well.
+QUALIFIERS = {
+    "absolute": {"absolute", "abs"},
+    "percent": {"percent", "pct"},
+    "urine": {"urine", "ur", "urinary", "urinalysis"},
+    "serum": {"serum", "plasma"},
+    "rbc": {"rbc", "erythrocyte", "erythrocytes"},
+    "nucleated": {"nucleated", "nrbc"},
+    "direct": {"direct"},
+    "indirect": {"indirect"},
+}
+# In short words with a digit ("b12", "t4", "co2") one character is a
+# different test rather than a spelling slip
+SHORT_WORD = 4
+
+
+def normalize(name: str) -> str:
+    """Lower-case words in sorted order, "%" as a word: "Protein, Total" -> "protein total"."""
+    return " ".join(sorted(NON_WORD.sub(" ", name.lower().replace("%", " percent ")).split()))
+
+
+def ocr_fold(name: str) -> str:
+    """Folds characters OCR mixes up into one spelling, for both sides of a comparison."""
+    name = name.lower()
+    for seen, meant in OCR_CONFUSIONS:
+        name = name.replace(seen, meant)
+    return name
+
+
+def fuzzy_forms(name: str) -> Tuple[str, str]:
+    """The OCR-folded sorted words, and the folded name with separators dropped."""
+    folded = ocr_fold(name.replace("%", " percent "))
+    return normalize(folded), NON_WORD.sub("", folded)
+
+
+@functools.lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def _qualifier(word: str) -> Optional[str]:
+    """The qualifier a word spells, allowing an OCR slip in the longer spellings ("absolutc")."""
+    for qualifier, spellings in QUALIFIERS.items():
+        if word in spellings:
+            return qualifier
+        for spelling in spellings:
+            if len(spelling) >= 5 and abs(len(word) - len(spelling)) <= 1 \
+                    and SequenceMatcher(None, word, spelling).ratio() >= 0.8:
+                return qualifier
+    return "non" if word.startswith("non") else None
+
+
+def qualifiers(name: str) -> frozenset:
+    """The QUALIFIERS a name carries (plus "non"), which a fuzzy match must share."""
+    words = set(normalize(name).split()) | set(fuzzy_forms(name)[0].split())
+    return frozenset(filter(None, map(_qualifier, words)))
+
+
+def distinguishing(name: str) -> frozenset:
+    """What a fuzzy match must keep: the name's qualifiers and its short words with digits, OCR-folded."""
+    numbered = {
+        fuzzy_forms(word)[0]
+        for word in normalize(name).split()
+        if len(word) <= SHORT_WORD and any(char.isdigit() for char in word)
+    }
+    return qualifiers(name) | numbered
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class AnalyteIndex:
+    """Exact and trigram lookups over canonical analyte names and their aliases."""
+
+    def __init__(self, analytes: Dict[str, List[str]] = ANALYTES, threshold: float = DEFAULT_THRESHOLD,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        self.threshold = threshold
+        self.exact = {}
+        for canonical, aliases in analytes.items():
+            for alias in [canonical, *aliases]:
+                # The first analyte to claim a wording keeps it
+                self.exact.setdefault(normalize(alias), canonical)
+
+        self.folded = {}
+        self.distinguishing = {}
+        for canonical, aliases in analytes.items():
+            for alias in [canonical, *aliases]:
+                for form in fuzzy_forms(alias):
+                    if form not in self.folded:
+                        self.folded[form] = canonical
+                        self.distinguishing[form] = distinguishing(alias)
+
+        self.keys = list(self.folded)
+        self.postings = defaultdict(list)
+        for key_id, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                self.postings[gram].append(key_id)
+
+        self.canonical = functools.lru_cache(maxsize=cache_size)(self._canonical)
+
+    def match(self, name: str) -> Tuple[Optional[str], float]:
+        """(canonical name, score) for the best match, or (None, best score) when unsure."""
+        key = normalize(name)
+        if key in self.exact:
+            return self.exact[key], 1.0
+        forms = [form for form in fuzzy_forms(name) if form]
+        for form in forms:
+            if form in self.folded:
+                return self.folded[form], 1.0
+
+        # Best score per analyte over both forms and their shortlisted names
+        scores = {}
+        threshold = self.threshold - AMBIGUITY_MARGIN
+        wanted = distinguishing(name)
+        for form in forms:
+            postings = self.postings
+            shared = Counter(chain.from_iterable(postings[gram] for gram in trigrams(form) if gram in postings))
+            # Names with other qualifiers or short words are different tests, however similar they look
+            shortlist = islice(
+                (key_id for key_id, _ in shared.most_common() if self.distinguishing[self.keys[key_id]] == wanted),
+                SHORTLIST,
+            )
+            # SequenceMatcher indexes its second sequence, so the query goes there once
+            matcher = SequenceMatcher(None, "", form)
+            for key_id in shortlist:
+                matcher.set_seq1(self.keys[key_id])
+                # quick_ratio is a cheap upper bound on ratio
+                if matcher.quick_ratio() >= threshold:
+                    canonical = self.folded[self.keys[key_id]]
+                    scores[canonical] = max(scores.get(canonical, 0.0), matcher.ratio())
+        if not scores:
+            return None, 0.0
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        canonical, best = ranked[0]
+        if best < self.threshold:
+            return None, best
+        if len(ranked) > 1 and best - ranked[1][1] < AMBIGUITY_MARGIN:
+            return None, best
+        return canonical, best
+
+    def _canonical(self, name: str) -> Optional[str]:
+        return self.match(name)[0]
+
+    def canonicalize(self, name: str) -> str:
+        """The canonical name, or the name unchanged when nothing is close enough."""
+        if not isinstance(name, str):
+            return name
+        return self.canonical(name) or name
+
+    def canonicalize_series(self, names: pd.Series) -> pd.Series:
+        """canonicalize() for a column; each distinct name is looked up once."""
+        codes, uniques = pd.factorize(names)
+        # factorize gives -1 for missing names, which picks the trailing None
+        mapped = np.array([self.canonicalize(name) for name in uniques] + [None], dtype=object)
+        return pd.Series(mapped[codes], index=names.index, name=names.name)
+
+
+def canonicalize_rows(rows: List[Tuple[str, str, Optional[str]]], index: Optional[AnalyteIndex] = None):
+    """parse_output rows with canonical test names."""
+    index = index or get_index()
+    canonicalize = index.canonicalize
+    return [(canonicalize(test_type), result, date) for test_type, result, date in rows]
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_index() -> AnalyteIndex:
+    """Process-wide index over analytes.ANALYTES, built on first use."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = AnalyteIndex()
+        return _default_index
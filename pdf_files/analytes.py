@@ -0,0 +1,106 @@
+"""
+Curated analyte names and the aliases labs print for them.
+
+Plain data, indexed by analyte_index. Keys are the canonical names written
+to the CSVs; aliases only need to cover different wordings ("Protein,
+Total", "SGPT"), since case, punctuation, word order and OCR slips are
+handled by the index.
+
+Absolute counts and percentages, urine and blood tests, and the eGFR race
+variants are different results and get names of their own; the index
+never fuzzy-matches across those qualifiers.
+"""
+
+ANALYTES = {
+    # Basic / comprehensive metabolic panel
+    "Sodium": ["Na", "Sodium, Serum"],
+    "Potassium": ["K", "Potassium, Serum"],
+    "Chloride": ["Cl", "Chloride, Serum"],
+    "Carbon Dioxide": ["CO2", "Bicarbonate", "Total CO2", "Carbon Dioxide, Total"],
+    "Anion Gap": [],
+    "Glucose": ["Glucose, Serum", "Glucose, Fasting", "Fasting Glucose"],
+    "BUN": ["Blood Urea Nitrogen", "Urea Nitrogen", "Urea Nitrogen (BUN)"],
+    "Creatinine": ["Creatinine, Serum"],
+    "BUN/Creatinine Ratio": ["BUN Creatinine Ratio"],
+    "eGFR": ["Estimated GFR", "GFR Estimated"],
+    "eGFR If African Am": ["eGFR If Africn Am", "eGFR African American"],
+    "eGFR If Non-African Am": ["eGFR If NonAfricn Am", "eGFR Non-African American"],
+    "Calcium": ["Calcium, Serum", "Ca"],
+    "Total Protein": ["Protein, Total", "Protein, Total, Serum"],
+    "Albumin": ["Albumin, Serum"],
+    "Globulin": ["Globulin, Total"],
+    "A/G Ratio": ["Albumin/Globulin Ratio"],
+    "Bilirubin Total": ["Total Bilirubin", "Bilirubin, Total"],
+    "Bilirubin Direct": ["Direct Bilirubin", "Bilirubin, Direct"],
+    "Alkaline Phosphatase": ["ALP", "Alk Phos"],
+    "AST": ["SGOT", "Aspartate Aminotransferase", "AST (SGOT)"],
+    "ALT": ["SGPT", "Alanine Aminotransferase", "ALT (SGPT)"],
+    "Magnesium": ["Mg"],
+    "Phosphorus": ["Phosphate"],
+    "Uric Acid": [],
+    # Lipids
+    "Cholesterol Total": ["Total Cholesterol", "Cholesterol, Total"],
+    "Triglycerides": [],
+    "HDL Cholesterol": ["HDL", "HDL-C"],
+    "LDL Cholesterol": ["LDL", "LDL-C", "LDL Chol Calc (NIH)", "LDL Cholesterol Calc"],
+    "VLDL Cholesterol": ["VLDL", "VLDL Cholesterol Cal"],
+    "Non-HDL Cholesterol": ["Non HDL Cholesterol"],
+    # Complete blood count
+    "WBC": ["WBC Count", "White Blood Cell Count", "White Blood Cells", "Leukocytes"],
+    "RBC": ["RBC Count", "Red Blood Cell Count", "Red Blood Cells", "Erythrocytes"],
+    "Hemoglobin": ["Hgb", "Hb"],
+    "Hematocrit": ["Hct"],
+    "MCV": ["Mean Corpuscular Volume"],
+    "MCH": ["Mean Corpuscular Hemoglobin"],
+    "MCHC": ["Mean Corpuscular Hemoglobin Concentration"],
+    "RDW": ["Red Cell Distribution Width", "RDW-CV"],
+    "Platelets": ["Platelet Count", "PLT"],
+    "MPV": ["Mean Platelet Volume"],
+    # Differential: labs print the percentage under the bare name
+    "Neutrophils %": ["Neutrophils", "Neutrophils Percent"],
+    "Neutrophils (Absolute)": ["Absolute Neutrophils", "Neutrophils Abs", "ANC"],
+    "Lymphocytes %": ["Lymphocytes", "Lymphs", "Lymphs %"],
+    "Lymphocytes (Absolute)": ["Lymphs (Absolute)", "Lymphs Abs"],
+    "Monocytes %": ["Monocytes", "Monos"],
+    "Monocytes (Absolute)": ["Monos (Absolute)", "Monocytes Abs"],
+    "Eosinophils %": ["Eosinophils", "Eos", "Eos %"],
+    "Eosinophils (Absolute)": ["Eos (Absolute)", "Eos Abs"],
+    "Basophils %": ["Basophils", "Basos", "Basos %"],
+    "Basophils (Absolute)": ["Baso (Absolute)", "Basos (Absolute)", "Baso Abs"],
+    "nRBC %": ["nRBC", "Nucleated RBC", "Nucleated RBC %"],
+    "nRBC (Absolute)": ["Absolute nRBC", "Nucleated RBC (Absolute)"],
+    # Coagulation
+    "Prothrombin Time": ["PT", "Protime"],
+    "INR": ["International Normalized Ratio"],
+    "Partial Thromboplastin Time": ["PTT", "aPTT", "Activated Partial Thromboplastin Time"],
+    # Endocrine and others
+    "Hemoglobin A1c": ["HbA1c", "A1c", "Glycated Hemoglobin", "Glycohemoglobin"],
+    "TSH": ["Thyroid Stimulating Hormone"],
+    "Free T4": ["T4, Free", "Free Thyroxine", "T4 Free (Direct)"],
+    "Free T3": ["T3, Free", "Free Triiodothyronine"],
+    "Vitamin D, 25-Hydroxy": ["Vitamin D", "25-Hydroxy Vitamin D", "Vitamin D 25 Hydroxy"],
+    "Vitamin B12": ["B12", "Cobalamin"],
+    "Folate": ["Folic Acid", "Folate, Serum"],
+    "Ferritin": ["Ferritin, Serum"],
+    "Iron": ["Iron, Serum", "Iron, Total"],
+    "TIBC": ["Total Iron Binding Capacity", "Iron Bind.Cap.(TIBC)"],
+    "Iron Saturation": ["Transferrin Saturation", "Iron Saturation %"],
+    "PSA": ["Prostate Specific Antigen", "PSA, Total"],
+    "C-Reactive Protein": ["CRP", "hs-CRP", "High Sensitivity CRP"],
+    "Sedimentation Rate": ["ESR", "Sed Rate", "Erythrocyte Sedimentation Rate"],
+    "Creatine Kinase": ["CK", "CPK", "Creatine Kinase, Total"],
+    "Lactate Dehydrogenase": ["LDH", "LD"],
+    "Gamma-Glutamyl Transferase": ["GGT", "Gamma GT"],
+    "Lipase": [],
+    "Amylase": [],
+    # Urinalysis
+    "Urine Specific Gravity": ["Specific Gravity"],
+    "Urine pH": ["pH, Urine"],
+    "Urine Protein": ["Protein, Urine", "Urine Protein, Qual"],
+    "Urine Glucose": ["Glucose, Urine"],
+    "Microalbumin": ["Microalbumin, Urine", "Microalb"],
+    "Urine Albumin": ["Albumin, Random Urine"],
+    "Creatinine, Urine": ["Creatinine, Random Urine", "Creatinine, Urine, Random"],
+    "Urine Blood": ["Hemoglobin, Urine", "Occult Blood, Urine"],
+    "Albumin/Creatinine Ratio": ["Microalb/Creat Ratio", "Urine Albumin/Creatinine Ratio"],
+}
@@ -1,11 +1,17 @@
 import streamlit as st
 import pandas as pd
 import base64
+import io
 import os
-import re
 from typing import Optional, List
 from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
+from docai_cache import cache_key, get_cache
+from docai_entities import EntityRecord, extract_entities, write_debug_output
+from lab_parser import parse_output
+from lab_records import NO_DATE_LABEL, to_records
+from xlsx_export import SHEET_LAYOUTS, XLSX_MIMETYPE, write_xlsx
+from results_store import file_hash, get_store
 
 # ✅ MUST be the first Streamlit command
 st.set_page_config(
@@ -57,36 +63,33 @@ def process_document_sample(
     mime_type: str = "application/pdf",
     field_mask: str = "entities",
     target_entities=None,
-    output_file: str = "output.txt",
-) -> Optional[str]:
+    output_file: Optional[str] = None,
+) -> Optional[List[EntityRecord]]:
     try:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"The file '{file_path}' does not exist.")
 
-        opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-        client = documentai.DocumentProcessorServiceClient(client_options=opts)
+        client = get_client(location)
         name = client.processor_path(project_id, location, processor_id)
 
         with open(file_path, "rb") as f:
             content = f.read()
 
-        raw_document = documentai.RawDocument(content=content, mime_type=mime_type)
-        request = documentai.ProcessRequest(name=name, raw_document=raw_document, field_mask=field_mask)
-        result = client.process_document(request=request)
-        document = result.document
-
-        with open(output_file, "w") as output:
-            if document.text:
-                output.write("Extracted Text:\n")
-                output.write(document.text + "\n\n")
-            if document.entities:
-                output.write("Extracted Entities:\n")
-                for entity in document.entities:
-                    if not target_entities or entity.type_ in target_entities:
-                        output.write(f"{entity.type_}: {entity.mention_text}\n")
-            else:
-                output.write("No entities found.\n")
-        return output_file
+        # Re-uploads of the same PDF are served from the local cache
+        cache = get_cache()
+        key = cache_key(content, name, field_mask=field_mask)
+        document = cache.get(key)
+        if document is None:
+            raw_document = documentai.RawDocument(content=content, mime_type=mime_type)
+            request = documentai.ProcessRequest(name=name, raw_document=raw_document, field_mask=field_mask)
+            result = client.process_document(request=request)
+            document = result.document
+            cache.put(key, document)
+
+        # Optional debug dump; parsing works on the returned records
+        if output_file:
+            write_debug_output(document, output_file, target_entities)
+        return extract_entities(document, target_entities)
     except Exception as e:
         st.error(f"Document AI error: {str(e)}")
         return None
@@ -94,53 +97,62 @@ def process_document_sample(
 # -----------------------------
 # Text to CSV Parsing
 # -----------------------------
-def parse_output(file_path: str):
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-
-    data = []
-    current_date = None
-
-    for line in reversed(lines):
-        if line.startswith("dateoftest:"):
-            current_date = line.split(":", 1)[1].strip()
-            break
-
-    for i, line in enumerate(lines):
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":", 1)[1].strip()
-            result = ""
-
-            embedded = re.search(r"(\d+(?:\.\d+)?\s*(?:High|Low))", test_type)
-            if embedded:
-                result = embedded.group(0)
-                test_type = test_type.replace(result, "").strip()
-
-            for j in range(i + 1, len(lines)):
-                next_line = lines[j].strip()
-                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
-                    break
-                if re.match(r"High|Low", next_line):
-                    if re.search(r"\d+", next_line):
-                        result = next_line
-                    elif j + 1 < len(lines) and re.match(r"^[<>]?\d+(\.\d+)?", lines[j + 1].strip()):
-                        result = f"{next_line} {lines[j + 1].strip()}"
-                    break
-                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
-                    result = next_line
-                    break
-
-            data.append((test_type, result, current_date))
-    return data
-
-def convert_to_csv(output_text_file: str, output_csv_file: str):
-    data = parse_output(output_text_file)
+def convert_to_csv(source, output_csv_file: str):
+    data = parse_output(source)
     df = pd.DataFrame([{"TestType": t, "Result": r} for t, r, d in data])
     if data:
         df.columns = ["TestType", data[0][2]]
     df.to_csv(output_csv_file, index=False)
     return df
 
+def to_typed_records(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """lab_records rows for the edited results (TestType plus a result column headed by the date)."""
+    label = df.columns[1]
+    results = df.iloc[:, 1]
+    long = pd.DataFrame({
+        "DocId": source,
+        "TestType": df.iloc[:, 0].where(df.iloc[:, 0].notna(), None),
+        "Result": results.astype(str).where(results.notna(), None),
+        "Date": None if label == NO_DATE_LABEL else label,
+    })
+    return to_records(long)
+
+def to_xlsx(df: pd.DataFrame, source: str, sheets: str) -> bytes:
+    """The edited results as XLSX."""
+    output = io.BytesIO()
+    write_xlsx(to_typed_records(df, source), output, sheets=sheets)
+    return output.getvalue()
+
+def report_source(file_name: str, patient: str) -> str:
+    """The report's doc id: "<patient>/<file>" when a patient id was entered, else the file name."""
+    patient = patient.strip().replace("/", "-")
+    return f"{patient}/{file_name}" if patient else file_name
+
+def save_to_history(df: pd.DataFrame, source: str, pdf_file_path: str):
+    """Stores the results in the SQLite results store, replacing earlier copies of this PDF."""
+    store = get_store()
+    if store is not None and len(df.columns) > 1:
+        store.add_records(to_typed_records(df, source), {source: file_hash(pdf_file_path)})
+
+# -----------------------------
+# Results History
+# -----------------------------
+def results_history():
+    st.subheader("Results History")
+    store = get_store()
+    if store is None:
+        st.caption("The results store is turned off (DOCAI_RESULTS_DB).")
+        return
+    patients = store.patients()
+    if not patients:
+        st.caption("No stored results yet.")
+        return
+    patient = st.selectbox("Patient", patients)
+    analyte = st.selectbox("Test", ["All tests"] + store.analytes(patient))
+    since = st.date_input("Since", value=None)
+    history = store.query(patient=patient, analyte=None if analyte == "All tests" else analyte, since=since)
+    st.dataframe(history, use_container_width=True, hide_index=True)
+
 # -----------------------------
 # PDF Viewer Utility
 # -----------------------------
@@ -181,11 +193,13 @@ def main_app():
     st.title("PDF to Sheet Converter")
     st.sidebar.title("Instructions")
     st.sidebar.markdown("""
-    1. Upload a PDF file.
+    1. Upload a PDF file and enter the patient's ID.
     2. Click 'Process Document'.
     3. Edit the results below.
-    4. Download your updated CSV.
+    4. Download your updated CSV or XLSX.
     """)
+    cache_stats = get_cache().stats()
+    st.sidebar.caption(f"Document AI cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
 
     if not setup_google_credentials():
         return
@@ -198,6 +212,8 @@ def main_app():
     with col1:
         st.subheader("PDF Viewer")
         uploaded_file = st.file_uploader("Upload PDF", type=["pdf"])
+        # Results History lists reports by this id; without one they are stored but not listed
+        patient = st.text_input("Patient ID")
         pdf_file_path = None
 
         if uploaded_file:
@@ -209,22 +225,21 @@ def main_app():
     with col2:
         st.subheader("Extracted & Editable Data")
         if uploaded_file and st.button("Process Document"):
-            output_txt = "output.txt"
             output_csv = "output.csv"
 
-            result_file = process_document_sample(
+            entities = process_document_sample(
                 project_id=PROJECT_ID,
                 location=LOCATION,
                 processor_id=PROCESSOR_ID,
                 file_path=pdf_file_path,
                 mime_type="application/pdf",
-                output_file=output_txt,
                 target_entities=["dateoftest", "TestTypeandResult"]
             )
 
-            if result_file:
-                df = convert_to_csv(output_txt, output_csv)
+            if entities is not None:
+                df = convert_to_csv(entities, output_csv)
                 st.session_state["df"] = df
+                save_to_history(df, report_source(uploaded_file.name, patient), pdf_file_path)
 
         if st.session_state["df"] is not None:
             if st.button("Add Row"):
@@ -242,6 +257,18 @@ def main_app():
             csv_data = edited_df.to_csv(index=False).encode("utf-8")
             st.download_button("Download Edited CSV", csv_data, "edited_results.csv", "text/csv")
 
+            if len(edited_df.columns) > 1:
+                sheets = st.selectbox("XLSX sheets", SHEET_LAYOUTS)
+                source = report_source(uploaded_file.name if uploaded_file else "uploaded.pdf", patient)
+                xlsx_data = to_xlsx(edited_df, source, sheets)
+                st.download_button("Download Edited XLSX", xlsx_data, "edited_results.xlsx", XLSX_MIMETYPE)
+
+                if uploaded_file and st.button("Save Edits to History"):
+                    save_to_history(edited_df, report_source(uploaded_file.name, patient), pdf_file_path)
+                    st.success("Saved.")
+
+    results_history()
+
 # -----------------------------
 # Entry Point
 # -----------------------------
@@ -1,12 +1,13 @@
 import streamlit as st
 import pandas as pd
 import base64
-import re
 import os
 
 # Google Cloud Document AI
 from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
+from docai_cache import cache_key, get_cache
+from lab_parser import parse_output
 
 # -----------------------------
 #  Configuration
@@ -42,12 +43,8 @@ def process_document_sample(
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"The file '{file_path}' does not exist.")
 
-    # Configure the API endpoint and pass the API key
-    client_options = ClientOptions(
-        api_endpoint=f"{location}-documentai.googleapis.com",
-        api_key=API_KEY
-    )
-    client = documentai.DocumentProcessorServiceClient(client_options=client_options)
+    # Shared client for this endpoint and API key
+    client = get_client(location, api_key=API_KEY)
 
     # Construct the resource name of the processor
     name = client.processor_path(project_id, location, processor_id)
@@ -56,20 +53,27 @@ def process_document_sample(
     with open(file_path, "rb") as f:
         doc_content = f.read()
 
-    raw_document = documentai.RawDocument(
-        content=doc_content,
-        mime_type=mime_type
-    )
+    # Serve repeat uploads of the same PDF from the local cache
+    cache = get_cache()
+    key = cache_key(doc_content, name, field_mask=field_mask)
+    document = cache.get(key)
 
-    request = documentai.ProcessRequest(
-        name=name,
-        raw_document=raw_document,
-        field_mask=field_mask,
-    )
+    if document is None:
+        raw_document = documentai.RawDocument(
+            content=doc_content,
+            mime_type=mime_type
+        )
 
-    # Attempt to process the document
-    result = client.process_document(request=request)
-    document = result.document
+        request = documentai.ProcessRequest(
+            name=name,
+            raw_document=raw_document,
+            field_mask=field_mask,
+        )
+
+        # Attempt to process the document
+        result = client.process_document(request=request)
+        document = result.document
+        cache.put(key, document)
 
     # Write output to text file
     with open(output_file, "w") as output:
@@ -88,55 +92,6 @@ def process_document_sample(
     print(f"Document AI output saved to: {output_file}")
     return output_file
 
-def parse_output(file_path: str):
-    """
-    Parse the text file output by process_document_sample to extract 'dateoftest'
-    and 'TestTypeandResult' lines.
-    """
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-
-    data = []
-    current_date = None
-
-    # Find date from reversed lines
-    for line in reversed(lines):
-        if line.startswith("dateoftest:"):
-            current_date = line.split(":", 1)[1].strip()
-            break
-
-    # Collect test info
-    for i, line in enumerate(lines):
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":", 1)[1].strip()
-            result = ""
-
-            # Check if there's an embedded numeric + High/Low
-            embedded_result = re.search(r"(\d+(?:\.\d+)?\s*(?:High|Low))", test_type)
-            if embedded_result:
-                result = embedded_result.group(0)
-                test_type = test_type.replace(result, "").strip()
-
-            # Look ahead for additional result lines
-            for j in range(i + 1, len(lines)):
-                next_line = lines[j].strip()
-                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
-                    break
-
-                if re.match(r"High|Low", next_line):
-                    if re.search(r"\d+", next_line):
-                        result = next_line
-                    elif j + 1 < len(lines) and re.match(r"^[<>]?\d+(\.\d+)?", lines[j + 1].strip()):
-                        result = f"{next_line} {lines[j + 1].strip()}"
-                    break
-                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
-                    result = next_line
-                    break
-
-            data.append((test_type, result, current_date))
-
-    return data
-
 def convert_to_csv(output_text_file: str, output_csv_file: str):
     """
     Convert the parsed data to CSV format.
@@ -0,0 +1,149 @@
+"""
+asyncio version of the combined.py pipeline.
+
+Runs process_document_sample -> parse_output -> convert_to_csv with the
+DocumentProcessorServiceAsyncClient, so a single process can keep hundreds
+of documents in flight without a thread per request. File reads, parsing
+and CSV writing are moved off the event loop.
+
+From an async web handler:
+
+    pipeline = AsyncPipeline(PROJECT_ID, LOCATION, PROCESSOR_ID)
+    csv_path = await pipeline.process_pdf(pdf_path, "processed/report.csv")
+
+From the command line:
+
+    python async_pipeline.py pdfs/ --output-dir processed --max-in-flight 200
+"""
+import argparse
+import asyncio
+import os
+from typing import List, Optional
+
+from google.cloud import documentai
+
+from combined import convert_to_csv
+from docai_entities import extract_entities, write_debug_output
+from docai_client import create_async_client
+
+PROJECT_ID = "80285593679"
+LOCATION = "us"
+PROCESSOR_ID = "dc982698f289d9e4"
+TARGET_ENTITIES = ["dateoftest", "TestTypeandResult"]
+DEFAULT_MAX_IN_FLIGHT = 100
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class AsyncPipeline:
+    """One async Document AI client plus an in-flight limit, bound to the running loop."""
+
+    def __init__(
+        self,
+        project_id: str,
+        location: str,
+        processor_id: str,
+        endpoint: Optional[str] = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        target_entities: Optional[List[str]] = TARGET_ENTITIES,
+    ):
+        self.project_id = project_id
+        self.location = location
+        self.processor_id = processor_id
+        self.endpoint = endpoint
+        self.target_entities = target_entities
+        self.max_in_flight = max_in_flight
+        self._client = None
+        self._semaphore = None
+
+    def _ensure_client(self):
+        # Created lazily so the channel and semaphore belong to the caller's loop.
+        if self._client is None:
+            self._client = create_async_client(self.location, endpoint=self.endpoint)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._client
+
+    async def process_document(self, file_path: str, mime_type: str = "application/pdf") -> documentai.Document:
+        """Async equivalent of the Document AI call in process_document_sample."""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"The file '{file_path}' does not exist.")
+
+        client = self._ensure_client()
+        name = client.processor_path(self.project_id, self.location, self.processor_id)
+        content = await asyncio.to_thread(_read_bytes, file_path)
+
+        raw_document = documentai.RawDocument(content=content, mime_type=mime_type)
+        request = documentai.ProcessRequest(name=name, raw_document=raw_document, field_mask="entities")
+
+        async with self._semaphore:
+            result = await client.process_document(request=request)
+        return result.document
+
+    async def process_pdf(self, file_path: str, output_csv_file: str, output_text_file: Optional[str] = None) -> str:
+        """
+        Full pipeline for one PDF: Document AI, parse, CSV. The text dump is
+        only written when output_text_file is given.
+
+        :return: Path to the CSV file.
+        """
+        document = await self.process_document(file_path)
+        entities = extract_entities(document, self.target_entities)
+
+        if output_text_file:
+            await asyncio.to_thread(write_debug_output, document, output_text_file, self.target_entities)
+        await asyncio.to_thread(convert_to_csv, entities, output_csv_file)
+        return output_csv_file
+
+    async def run_batch(self, pdf_paths: List[str], output_dir: str) -> List[Optional[str]]:
+        """
+        Processes every PDF concurrently (bounded by max_in_flight) and
+        returns the CSV paths in input order; failed documents give None.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+
+        async def one(path):
+            output_csv = os.path.join(output_dir, f"{os.path.basename(path)}.csv")
+            try:
+                return await self.process_pdf(path, output_csv)
+            except Exception as e:
+                print(f"Error processing document {path}: {e}")
+                return None
+
+        return await asyncio.gather(*(one(path) for path in pdf_paths))
+
+
+def collect_pdfs(paths: List[str]) -> List[str]:
+    """Expands directories into their PDF files, keeping argument order."""
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            pdfs.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(".pdf")
+            )
+        else:
+            pdfs.append(path)
+    return pdfs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-convert lab PDFs to CSV with async Document AI calls")
+    parser.add_argument("paths", nargs="+", help="PDF files or folders of PDFs")
+    parser.add_argument("--output-dir", default="processed")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("--endpoint", default=None, help="Override the Document AI endpoint (e.g. localhost:50051)")
+    args = parser.parse_args()
+
+    pipeline = AsyncPipeline(
+        PROJECT_ID, LOCATION, PROCESSOR_ID, endpoint=args.endpoint, max_in_flight=args.max_in_flight
+    )
+    results = asyncio.run(pipeline.run_batch(collect_pdfs(args.paths), args.output_dir))
+
+    done = [path for path in results if path]
+    print(f"Converted {len(done)} of {len(results)} PDFs into {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Parsing of entity batches from many documents at once, in one frame.
+
+A ZIP of a few hundred reports used to go through parse_output one file at
+a time and build a dict per row for convert_to_csv. Here every entity of
+every document goes into one pandas frame. The lab_parser rules then run
+in a plain loop over the test mentions, one precompiled search per mention
+rather than a regex per line; the result splitting is vectorized:
+
+    long = parse_batch([(name, entities) for name, entities in results])
+
+The result is one long table tagged by document id, with the same
+TestType / Result / Date values parse_output gives for each file, plus the
+result split into Comparator, Value, Unit and Flag.
+"""
+import functools
+import re
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import lab_parser
+from docai_entities import NEWLINE, EntityRecord
+
+TEST_TYPE = lab_parser.TEST_PREFIX.rstrip(":")
+DATE_TYPE = lab_parser.DATE_PREFIX.rstrip(":")
+# A line inside a mention that the sequential parser would read as a new entity
+EMBEDDED_PREFIX = rf"\n(?:{re.escape(lab_parser.TEST_PREFIX)}|{re.escape(lab_parser.DATE_PREFIX)})"
+
+LONG_COLUMNS = ["DocId", "TestType", "Result", "Date", "Comparator", "Value", "Unit", "Flag"]
+
+# "Low 133", "<5", "133 mmol/L Low", "7.2 H", "Normal"
+RESULT_PARTS = re.compile(
+    r"^(?P<pre_flag>High|Low)?\s*(?P<comparator>[<>])?\s*(?P<value>\d+(?:\.\d+)?)?"
+    r"(?:\s+(?!(?:High|Low|H|L)\s*$)(?P<unit>.*?))?(?:\s+(?P<post_flag>High|Low|H|L))?\s*$"
+)
+
+
+def entities_frame(documents: List[Tuple[str, List[EntityRecord]]]) -> pd.DataFrame:
+    """One row per entity, in document order: DocId, Type, Mention (newlines normalized)."""
+    doc_ids, types, mentions = [], [], []
+    for doc_id, records in documents:
+        doc_ids.extend([doc_id] * len(records))
+        types.extend(record.type_ for record in records)
+        mentions.extend(record.mention_text for record in records)
+    frame = pd.DataFrame({"DocId": doc_ids, "Type": types, "Mention": mentions}, dtype=object)
+    if frame.empty:
+        return frame
+    # Document AI mentions rarely carry \r, so only those are rewritten
+    carriage = frame["Mention"].str.contains("\r", regex=False).to_numpy()
+    if carriage.any():
+        frame.loc[carriage, "Mention"] = [NEWLINE.sub("\n", mention) for mention in frame.loc[carriage, "Mention"]]
+    return frame
+
+
+def _needs_sequential(frame: pd.DataFrame, rules: lab_parser.RuleSet) -> bool:
+    """
+    The one-frame path treats each test entity as its own block. That
+    holds unless other entity types sit between them or a mention has a
+    line of its own starting with a "type:" prefix.
+    """
+    if rules.skip is not None or rules.take_last:
+        return True
+    if not frame["Type"].isin([TEST_TYPE, DATE_TYPE]).all():
+        return True
+    return bool(frame["Mention"].str.contains(EMBEDDED_PREFIX, regex=True).any())
+
+
+@functools.lru_cache(maxsize=None)
+def _decisive_pattern(rules: lab_parser.RuleSet) -> re.Pattern:
+    # The first line (after the name) where the sequential parser would stop, and the line after it
+    return re.compile(
+        rf"(?m)^[^\S\n]*(?P<line>(?:(?P<stop>{re.escape(lab_parser.TEST_PREFIX)}|{re.escape(lab_parser.DATE_PREFIX)})"
+        rf"|(?P<flag>{rules.flag.pattern})|(?:{rules.value.pattern}))[^\n]*)(?:\n(?P<next>[^\n]*))?"
+    )
+
+
+def _test_columns(mentions, rules: lab_parser.RuleSet) -> Tuple[list, list]:
+    """
+    TestType and Result for a column of test mentions, in a Python loop:
+    each mention takes one search for its decisive line instead of a regex
+    per line. (str.extract with named groups measured 4x slower.)
+    """
+    search_decisive = _decisive_pattern(rules).search
+    search_embedded, hints = rules.embedded.search, rules.hints
+    match_number, search_digit = rules.number.match, lab_parser.DIGIT.search
+
+    test_types, results = [], []
+    for mention in mentions:
+        name, _, rest = mention.partition("\n")
+        name = name.strip()
+        result = ""
+        # "12.3 High" inside the name is the result unless a later line provides one
+        if hints is None or any(hint in name for hint in hints):
+            embedded = search_embedded(name)
+            if embedded:
+                result = embedded.group(0)
+                name = name.replace(result, "").strip()
+
+        found = search_decisive(rest) if rest else None
+        if found is not None and found.group("stop") is None:
+            line = found.group("line").strip()
+            if found.group("flag") is None or search_digit(line):
+                result = line
+            else:
+                following = (found.group("next") or "").strip()
+                if match_number(following):
+                    result = f"{line} {following}"
+        test_types.append(name)
+        results.append(result)
+    return test_types, results
+
+
+def _parse_entities_frame(frame: pd.DataFrame, rules: lab_parser.RuleSet) -> pd.DataFrame:
+    """lab_parser's rules applied to every test entity of every document, in one frame."""
+    tests = frame[frame["Type"] == TEST_TYPE]
+    if tests.empty:
+        return pd.DataFrame(columns=["DocId", "TestType", "Result", "Date"])
+    test_types, results = _test_columns(tests["Mention"].to_numpy(), rules)
+
+    # Last date of each document applies to all its rows
+    dates = frame[frame["Type"] == DATE_TYPE]
+    dates = pd.Series(
+        [mention.partition("\n")[0].strip() for mention in dates["Mention"].to_numpy()],
+        index=dates["DocId"].to_numpy(),
+        dtype=object,
+    )
+    dates = dates[~dates.index.duplicated(keep="last")]
+    row_dates = dates.reindex(tests["DocId"].to_numpy()).to_numpy(dtype=object)
+    row_dates[pd.isna(row_dates)] = None
+
+    return pd.DataFrame(
+        {
+            "DocId": tests["DocId"].to_numpy(),
+            "TestType": test_types,
+            "Result": results,
+            "Date": row_dates,
+        },
+        dtype=object,
+    )
+
+
+def split_results(results: pd.Series) -> pd.DataFrame:
+    """
+    Comparator, Value, Unit and Flag columns pulled out of result strings.
+    Results repeat a lot ("Normal", "Negative", common values), so each
+    distinct string is matched once and the parts are gathered back by code.
+    """
+    codes, uniques = pd.factorize(results)
+    empty = (None,) * RESULT_PARTS.groups
+    parts = [found.groups() if found else empty for found in map(RESULT_PARTS.match, uniques)]
+    # factorize gives -1 for missing results; the extra row at the end is all None
+    parts.append(empty)
+    pre_flag, comparator, value, unit, post_flag = (np.array(column, dtype=object) for column in zip(*parts))
+
+    flag = np.where(pd.isna(pre_flag), post_flag, pre_flag)
+    is_normal = np.array([result.startswith("Normal") for result in uniques] + [False], dtype=bool)
+    flag[is_normal] = "Normal"
+    unit[pd.isna(value) | (unit == "")] = None
+    numeric = np.append(pd.to_numeric(value[:-1], errors="coerce"), np.nan)
+
+    return pd.DataFrame(
+        {
+            "Comparator": comparator[codes],
+            "Value": numeric[codes],
+            "Unit": unit[codes],
+            "Flag": flag[codes],
+        },
+        index=results.index,
+    )
+
+
+def parse_batch(documents: Iterable[Tuple[str, Iterable[EntityRecord]]], rules=None) -> pd.DataFrame:
+    """
+    Parses the entities of many documents into one long frame with the
+    LONG_COLUMNS. documents is an iterable of (doc id, EntityRecords);
+    rows keep document order, then entity order.
+
+    Rule sets that skip lines or keep the last match (e.g. "mychart"), and
+    batches with other entity types mixed in, need the sequential parser,
+    so those go through lab_parser per document; the result splitting is
+    vectorized either way.
+    """
+    rules = lab_parser.get_rules(rules)
+    documents = [(doc_id, list(records)) for doc_id, records in documents]
+    frame = entities_frame(documents)
+
+    if frame.empty:
+        return pd.DataFrame(columns=LONG_COLUMNS)
+    if not _needs_sequential(frame, rules):
+        rows = _parse_entities_frame(frame, rules)
+    else:
+        rows = pd.DataFrame(
+            [
+                (doc_id, test_type, result, date)
+                for doc_id, records in documents
+                for test_type, result, date in lab_parser.parse_entities(records, rules)
+            ],
+            columns=["DocId", "TestType", "Result", "Date"],
+        )
+
+    rows = pd.concat([rows.reset_index(drop=True), split_results(rows["Result"]).reset_index(drop=True)], axis=1)
+    return rows[LONG_COLUMNS]
+
+
+def per_file_frame(rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    The convert_to_csv layout for one document's rows: TestType plus a
+    result column named after the test date (or "Result" without a date).
+    """
+    date = rows["Date"].iloc[0]
+    column = date if isinstance(date, str) else "Result"
+    return pd.DataFrame({"TestType": rows["TestType"].to_numpy(), column: rows["Result"].to_numpy()})
+
+
+def write_per_file_csvs(long: pd.DataFrame, paths: List[Tuple[str, str]]) -> List[Optional[str]]:
+    """Writes each (doc id, csv path) in the per-file layout; None where a document has no rows."""
+    groups = dict(tuple(long.groupby("DocId", sort=False)))
+    written = []
+    for doc_id, path in paths:
+        rows = groups.get(doc_id)
+        if rows is None:
+            print(f"Warning: No data found for {path}.")
+            written.append(None)
+            continue
+        per_file_frame(rows).to_csv(path, index=False)
+        written.append(path)
+    return written
@@ -0,0 +1,97 @@
+"""
+Bounded-concurrency helpers for processing many PDFs at once.
+
+run_ordered() keeps at most max_in_flight documents in flight and returns the
+results in input order, so merged outputs stay deterministic; iter_ordered()
+yields them in that order as they finish, for writers that stream. RateLimiter
+caps the request rate per processor, shared across all worker threads.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class RateLimiter:
+    """Spaces calls at least 1/qps seconds apart across threads."""
+
+    def __init__(self, qps: Optional[float] = None):
+        self.qps = qps
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        """Blocks until the caller may send the next request."""
+        if not self.qps:
+            return
+        interval = 1.0 / self.qps
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(processor_name: str, qps: Optional[float] = None) -> RateLimiter:
+    """
+    Returns the shared limiter for a processor, created on first use. A qps
+    given on any call becomes the limiter's rate for every thread; None
+    leaves the current rate as it is.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(processor_name)
+        if limiter is None:
+            limiter = _limiters[processor_name] = RateLimiter(qps)
+        elif qps is not None:
+            limiter.qps = qps
+        return limiter
+
+
+def run_ordered(
+    items: Iterable,
+    func: Callable,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+) -> List:
+    """
+    Calls func(item) for every item with at most max_in_flight running at
+    once, and returns the results in the same order as items.
+    """
+    items = list(items)
+    if max_in_flight <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(items))) as pool:
+        return list(pool.map(func, items))
+
+
+def iter_ordered(
+    items: Iterable,
+    func: Callable,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+) -> Iterator:
+    """
+    Like run_ordered, but yields each result as soon as it and every result
+    before it are done. Only max_in_flight items are submitted ahead of the
+    one being waited for, so finished results never pile up.
+    """
+    items = iter(items)
+    if max_in_flight <= 1:
+        yield from map(func, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        pending = deque(pool.submit(func, item) for item in islice(items, max_in_flight))
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1):
+                pending.append(pool.submit(func, item))
+            yield result
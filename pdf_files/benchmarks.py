@@ -0,0 +1,1395 @@
+"""
+Benchmarks for the PDF to sheet pipeline.
+
+Everything runs offline against local stand-ins. Run from the pdf_files folder:
+
+    python benchmarks.py client_pool --docs 200
+"""
+import argparse
+import statistics
+import time
+
+from google.cloud import documentai
+
+import batch_runner
+import docai_client
+import docai_standin
+import pdf_chunker
+from adaptive_limiter import AdaptiveConcurrency
+
+PROJECT_ID = "80285593679"
+LOCATION = "us"
+PROCESSOR_ID = "dc982698f289d9e4"
+SAMPLE_PDF = "uploaded_file.pdf"
+
+
+def report(label, timings):
+    """Prints mean/p50/p95 latency in milliseconds for a list of seconds."""
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+    print(
+        f"{label:<24} n={len(timings):<6} mean={statistics.mean(timings) * 1000:8.2f} ms"
+        f"  p50={statistics.median(timings) * 1000:8.2f} ms  p95={p95 * 1000:8.2f} ms"
+    )
+
+
+def read_sample_pdf():
+    with open(SAMPLE_PDF, "rb") as f:
+        return f.read()
+
+
+def process_content(client, content):
+    """One ProcessDocument round trip, the way process_document_sample makes it."""
+    name = client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID)
+    raw_document = documentai.RawDocument(content=content, mime_type="application/pdf")
+    request = documentai.ProcessRequest(name=name, raw_document=raw_document, field_mask="entities")
+    return client.process_document(request=request).document
+
+
+# -----------------------------
+#  Client reuse
+# -----------------------------
+def bench_client_pool(args):
+    server, port, _ = docai_standin.serve(latency=args.latency)
+    endpoint = f"localhost:{port}"
+    content = read_sample_pdf()
+
+    try:
+        fresh = []
+        for _ in range(args.docs):
+            start = time.perf_counter()
+            client = docai_client.create_client(LOCATION, endpoint=endpoint)
+            process_content(client, content)
+            fresh.append(time.perf_counter() - start)
+            client.transport.close()
+
+        pooled = []
+        for _ in range(args.docs):
+            start = time.perf_counter()
+            process_content(docai_client.get_client(LOCATION, endpoint=endpoint), content)
+            pooled.append(time.perf_counter() - start)
+
+        report("new client per doc", fresh)
+        report("pooled client", pooled)
+        print(f"pool stats: {docai_client.pool_stats()}")
+    finally:
+        docai_client.close_all()
+        server.stop(None)
+
+
+# -----------------------------
+#  Parallel uploads
+# -----------------------------
+def bench_parallel_upload(args):
+    server, port, _ = docai_standin.serve(latency=args.latency or 0.2, max_workers=64)
+    client = docai_client.get_client(LOCATION, endpoint=f"localhost:{port}")
+    limiter = batch_runner.RateLimiter(args.qps)
+    content = read_sample_pdf()
+
+    def one_document(index):
+        limiter.acquire()
+        process_content(client, content)
+        return index
+
+    try:
+        for max_in_flight in (1, 4, 8, 16, 32):
+            start = time.perf_counter()
+            results = batch_runner.run_ordered(range(args.docs), one_document, max_in_flight=max_in_flight)
+            elapsed = time.perf_counter() - start
+            assert results == list(range(args.docs))
+            print(f"max_in_flight={max_in_flight:<3} {args.docs} docs in {elapsed:7.2f} s  ({args.docs / elapsed:6.1f} docs/s)")
+    finally:
+        docai_client.close_all()
+        server.stop(None)
+
+
+# -----------------------------
+#  Page chunking
+# -----------------------------
+def synthetic_pdf(pages: int) -> bytes:
+    """A PDF with one short lab-style text block per page."""
+    import fitz
+
+    with fitz.open() as doc:
+        for number in range(pages):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Sodium\n{130 + number % 10}\nLow\nPage {number + 1}")
+        return doc.tobytes()
+
+
+def bench_chunking(args):
+    server, port, _ = docai_standin.serve(latency=args.latency or 0.3, per_page_latency=0.05, max_workers=64)
+    client = docai_client.get_client(LOCATION, endpoint=f"localhost:{port}")
+    name = client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID)
+
+    try:
+        for pages in (5, 15, 30, 60, 120):
+            content = synthetic_pdf(pages)
+            start = time.perf_counter()
+            pdf_chunker.process_in_chunks(client, name, content, chunk_pages=10_000)
+            whole = time.perf_counter() - start
+
+            start = time.perf_counter()
+            document = pdf_chunker.process_in_chunks(client, name, content, chunk_pages=args.chunk_pages)
+            chunked = time.perf_counter() - start
+
+            last_page = max(ref.page for entity in document.entities for ref in entity.page_anchor.page_refs)
+            print(
+                f"{pages:>4} pages  whole={whole:6.2f} s  chunks of {args.chunk_pages}={chunked:6.2f} s"
+                f"  entities={len(document.entities):<4} last page anchor={last_page}"
+            )
+    finally:
+        docai_client.close_all()
+        server.stop(None)
+
+
+# -----------------------------
+#  Adaptive concurrency
+# -----------------------------
+def bench_adaptive(args):
+    capacity = 6
+    server, port, servicer = docai_standin.serve(latency=args.latency or 0.1, capacity=capacity, max_workers=64)
+    client = docai_client.get_client(LOCATION, endpoint=f"localhost:{port}")
+    content = read_sample_pdf()
+
+    def run(controller):
+        def one_document(index):
+            try:
+                if controller is None:
+                    return process_content(client, content)
+                return controller.call(process_content, client, content)
+            except Exception:
+                return None
+
+        start = time.perf_counter()
+        results = batch_runner.run_ordered(range(args.docs), one_document, max_in_flight=32)
+        return time.perf_counter() - start, sum(result is None for result in results)
+
+    try:
+        elapsed, dropped = run(None)
+        print(f"fixed 32 in flight   {elapsed:6.2f} s  dropped={dropped}/{args.docs}  quota errors={servicer.rejected}")
+
+        servicer.rejected = 0
+        controller = AdaptiveConcurrency(initial_window=4, max_window=32, base_backoff=0.05, max_retries=10)
+        elapsed, dropped = run(controller)
+        print(f"AIMD controller      {elapsed:6.2f} s  dropped={dropped}/{args.docs}  quota errors={servicer.rejected}")
+        print(f"controller stats: {controller.stats()} (stand-in capacity={capacity})")
+    finally:
+        docai_client.close_all()
+        server.stop(None)
+
+
+# -----------------------------
+#  In-memory entities
+# -----------------------------
+def synthetic_document(entities: int) -> documentai.Document:
+    """A Document with a long OCR text and `entities` lab result entities."""
+    pairs = [
+        ("TestTypeandResult", f"Analyte {index}\n{100 + index % 50}.{index % 10}\n{'High' if index % 7 == 0 else ''}")
+        for index in range(entities)
+    ]
+    pairs.append(("dateoftest", "07/18/2024"))
+    document = docai_standin.build_document(pairs, pages=max(1, entities // 40))
+    document.text = document.text * 3  # OCR text is much longer than the entity mentions
+    return document
+
+
+def bench_entity_io(args):
+    import os
+    import tempfile
+
+    from combined import parse_output
+    from docai_entities import extract_entities, write_debug_output
+
+    def timed(func, *func_args):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            result = func(*func_args)
+        return (time.perf_counter() - start) / args.repeat * 1000, result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dump_path = os.path.join(tmp, "output.txt")
+        for entities in (50, 500, 5000):
+            document = synthetic_document(entities)
+
+            write_ms, _ = timed(write_debug_output, document, dump_path)
+            file_parse_ms, via_file = timed(parse_output, dump_path)
+            dump_bytes = os.path.getsize(dump_path)
+
+            extract_ms, records = timed(extract_entities, document)
+            memory_parse_ms, in_memory = timed(parse_output, records)
+
+            assert via_file == in_memory
+            print(
+                f"{entities:>5} entities  output.txt: write {write_ms:7.2f} ms + read/parse {file_parse_ms:7.2f} ms"
+                f" ({dump_bytes * 2 / 1024:7.1f} KiB disk I/O)"
+                f" | in memory: extract {extract_ms:7.2f} ms + parse {memory_parse_ms:7.2f} ms (0 KiB)"
+            )
+
+
+# -----------------------------
+#  Scan compression
+# -----------------------------
+def synthetic_scan(pages: int, dpi: int = 300) -> bytes:
+    """A PDF of full-page colour scans at `dpi`, like a phone-scanned lab report."""
+    import io
+
+    import fitz
+    import numpy as np
+    from PIL import Image
+
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    rng = np.random.default_rng(0)
+    with fitz.open() as doc:
+        for _ in range(pages):
+            # Paper tint plus sensor noise, saved losslessly the way many scanners do
+            pixels = np.broadcast_to(np.array([235, 232, 220], dtype=np.int16), (height, width, 3))
+            pixels = (pixels + rng.integers(-3, 3, (height, width, 3))).clip(0, 255).astype(np.uint8)
+            buffer = io.BytesIO()
+            Image.fromarray(pixels).save(buffer, format="PNG")
+            page = doc.new_page()
+            page.insert_image(page.rect, stream=buffer.getvalue())
+        return doc.tobytes(deflate=True)
+
+
+def bench_preprocess(args):
+    from pdf_preprocess import compress_pdf
+
+    # per_mb_latency stands in for upload time on a ~40 Mbit/s link
+    server, port, _ = docai_standin.serve(latency=args.latency or 0.2, per_mb_latency=0.2)
+    client = docai_client.get_client(LOCATION, endpoint=f"localhost:{port}")
+
+    try:
+        for pages in (1, 2, 3):
+            content = synthetic_scan(pages)
+
+            start = time.perf_counter()
+            process_content(client, content)
+            raw = time.perf_counter() - start
+
+            start = time.perf_counter()
+            compressed, summary = compress_pdf(content)
+            compress = time.perf_counter() - start
+            process_content(client, compressed)
+            total = time.perf_counter() - start
+
+            print(
+                f"{pages} scanned pages  {summary.original_bytes / 1e6:6.2f} MB -> {summary.compressed_bytes / 1e6:6.2f} MB"
+                f" ({summary.bytes_saved / 1e6:6.2f} MB saved)"
+                f" | raw {raw * 1000:7.0f} ms, compressed {total * 1000:7.0f} ms"
+                f" (of which compress {compress * 1000:6.0f} ms)"
+            )
+    finally:
+        server.stop(None)
+
+
+# -----------------------------
+#  Offline load test
+# -----------------------------
+def bench_load_test(args):
+    import os
+    import tempfile
+
+    import combined
+
+    server, port, servicer = docai_standin.serve(
+        latency=args.latency or 0.2,
+        distribution="lognormal",
+        jitter=0.5,
+        quota_error_rate=0.02,
+        timeout_rate=0.01,
+        timeout_after=1.0,
+        seed=0,
+        max_workers=64,
+    )
+    # The same override a developer would export before starting any entry point
+    os.environ[docai_client.ENDPOINT_ENV] = f"localhost:{port}"
+    timings, failures = [], 0
+
+    def one(path):
+        start = time.perf_counter()
+        try:
+            combined.process_document_sample(
+                PROJECT_ID, LOCATION, PROCESSOR_ID, path, "application/pdf",
+                target_entities=["dateoftest", "TestTypeandResult"],
+            )
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for index in range(args.docs):
+                path = os.path.join(tmp, f"report_{index}.pdf")
+                with open(path, "wb") as f:
+                    f.write(synthetic_pdf(1 + index % 4))
+                paths.append(path)
+
+            start = time.perf_counter()
+            for elapsed in batch_runner.run_ordered(paths, one, max_in_flight=32):
+                if elapsed is None:
+                    failures += 1
+                else:
+                    timings.append(elapsed)
+            wall = time.perf_counter() - start
+
+        report("combined.py end to end", timings)
+        print(f"{args.docs / wall:.1f} docs/s, failed={failures}, stand-in: {servicer.stats()}")
+    finally:
+        del os.environ[docai_client.ENDPOINT_ENV]
+        server.stop(None)
+
+
+# -----------------------------
+#  Single-pass parser
+# -----------------------------
+def legacy_parse_lines(lines):
+    """The nested-lookahead parse_output that lab_parser replaced, kept as a reference."""
+    import re
+
+    lines = list(lines)
+    data = []
+    current_date = None
+    for line in reversed(lines):
+        if line.startswith("dateoftest:"):
+            current_date = line.split(":", 1)[1].strip()
+            break
+
+    for i, line in enumerate(lines):
+        if line.startswith("TestTypeandResult:"):
+            test_type = line.split(":", 1)[1].strip()
+            result = ""
+            embedded = re.search(r"(\d+(?:\.\d+)?\s*(?:High|Low))", test_type)
+            if embedded:
+                result = embedded.group(0)
+                test_type = test_type.replace(result, "").strip()
+
+            for j in range(i + 1, len(lines)):
+                next_line = lines[j].strip()
+                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
+                    break
+                if re.match(r"High|Low", next_line):
+                    if re.search(r"\d+", next_line):
+                        result = next_line
+                    elif j + 1 < len(lines) and re.match(r"^[<>]?\d+(\.\d+)?", lines[j + 1].strip()):
+                        result = f"{next_line} {lines[j + 1].strip()}"
+                    break
+                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
+                    result = next_line
+                    break
+
+            data.append((test_type, result, current_date))
+    return data
+
+
+def synthetic_entity_lines(entities: int):
+    """Entity dump lines mixing every result shape the parser handles."""
+    from docai_entities import EntityRecord, entity_lines
+
+    shapes = [
+        "Analyte {i}\n{v}",
+        "Analyte {i} {v} High",
+        "Analyte {i}\nLow\n{v}",
+        "Analyte {i}\nHigh {v}",
+        "Analyte {i}\nReference Range\n3.5-5.0\nNormal",
+        "Analyte {i}\nPending",
+    ]
+    records = [
+        EntityRecord("TestTypeandResult", shapes[i % len(shapes)].format(i=i, v=100 + i % 50), 1.0, None)
+        for i in range(entities)
+    ]
+    records.append(EntityRecord("dateoftest", "07/18/2024", 1.0, None))
+    return list(entity_lines(records))
+
+
+def bench_parser(args):
+    import lab_parser
+
+    for entities in (1_000, 10_000, 100_000):
+        lines = synthetic_entity_lines(entities)
+        repeat = max(1, args.repeat * 1_000 // entities)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            expected = legacy_parse_lines(lines)
+        legacy = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rows = lab_parser.parse_lines(iter(lines))
+        single_pass = (time.perf_counter() - start) / repeat
+
+        assert rows == expected
+        print(
+            f"{entities:>7} entities  legacy {legacy * 1000:8.1f} ms ({legacy / entities * 1e6:5.2f} us/entity)"
+            f" | single pass {single_pass * 1000:8.1f} ms ({single_pass / entities * 1e6:5.2f} us/entity)"
+        )
+
+
+def bench_rules(args):
+    import lab_parser
+
+    lines = synthetic_entity_lines(args.docs * 100)
+    entities = args.docs * 100
+    baseline = None
+    for name, rules in lab_parser.RULE_SETS.items():
+        timings = []
+        for _ in range(max(1, args.repeat // 4)):
+            start = time.perf_counter()
+            rows = lab_parser.parse_lines(iter(lines), rules)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        baseline = baseline or best
+        print(
+            f"{name:<10} {entities / best / 1000:8.0f}k entities/s  {best * 1000:7.1f} ms"
+            f"  ({best / baseline:4.2f}x default)  rows={len(rows)}"
+        )
+
+
+# -----------------------------
+#  Vectorized batch parsing
+# -----------------------------
+def iter_synthetic_batch(docs: int, entities: int = 40):
+    """(doc id, EntityRecords) pairs shaped like a ZIP of lab reports, one at a time."""
+    from docai_entities import EntityRecord
+
+    shapes = ["{v}", "{v} mmol/L Low", "Low\n{v}", "High {v}", "Normal", "<{v} mg/dL", "Reference 3-5\n{v} g/dL"]
+    for doc in range(docs):
+        records = [
+            EntityRecord("TestTypeandResult", f"Analyte {i}\n" + shapes[(doc + i) % len(shapes)].format(v=100 + i), 1.0, 0)
+            for i in range(entities)
+        ]
+        records.append(EntityRecord("dateoftest", f"0{1 + doc % 9}/18/2024", 1.0, 0))
+        yield f"report_{doc}.pdf", records
+
+
+def synthetic_batch(docs: int, entities: int = 40):
+    return list(iter_synthetic_batch(docs, entities))
+
+
+def bench_batch_parse(args):
+    import pandas as pd
+
+    import batch_parser
+    import lab_parser
+
+    for docs in (10, 100, 1000):
+        batch = synthetic_batch(docs)
+
+        # What convert_to_csv does per file: parse, then a dict per row
+        per_file = vectorized = float("inf")
+        for _ in range(3):
+            start = time.perf_counter()
+            frames = []
+            for doc_id, records in batch:
+                data = lab_parser.parse_entities(records)
+                frame = pd.DataFrame([{"TestType": test_type, "Result": result} for test_type, result, date in data])
+                frame.columns = ["TestType", data[0][2]]
+                frames.append(frame)
+            per_file = min(per_file, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            long = batch_parser.parse_batch(batch)
+            vectorized = min(vectorized, time.perf_counter() - start)
+
+        for (doc_id, _), frame in zip(batch, frames):
+            rows = long[long["DocId"] == doc_id] if docs <= 100 else None
+            if rows is not None:
+                assert batch_parser.per_file_frame(rows).equals(frame)
+        print(
+            f"{docs:>5} docs ({len(long):>6} rows)  per-file loop {per_file * 1000:8.1f} ms"
+            f" | parse_batch {vectorized * 1000:8.1f} ms (with Value/Unit/Flag columns)"
+        )
+
+
+# -----------------------------
+#  Typed result records
+# -----------------------------
+def bench_typed_records(args):
+    import os
+    import tempfile
+
+    import pandas as pd
+
+    import batch_parser
+    import lab_records
+
+    # 2,500 reports x 40 results = 100k rows
+    batch = synthetic_batch(2500)
+    long = batch_parser.parse_batch(batch)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_files = batch_parser.write_per_file_csvs(
+            long, [(doc_id, os.path.join(tmp, f"{doc_id}.csv")) for doc_id, _ in batch]
+        )
+
+        # The frame the old merge_csv_files ended up with (built with one concat
+        # here; the old loop made the same frame quadratically)
+        start = time.perf_counter()
+        frames = []
+        for csv_file in csv_files:
+            if frames:
+                frames.append(pd.DataFrame([["", ""]]))
+            frames.append(pd.read_csv(csv_file))
+        wide = pd.concat(frames, ignore_index=True)
+        wide_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        records = lab_records.load_results(csv_files)
+        typed_time = time.perf_counter() - start
+
+    wide_mb = wide.memory_usage(deep=True).sum() / 2**20
+    typed_mb = records.memory_usage(deep=True).sum() / 2**20
+    print(f"{len(records)} results from {len(csv_files)} CSVs")
+    print(f"  wide object frame  {wide_mb:7.1f} MiB  built in {wide_time * 1000:7.1f} ms")
+    print(f"  typed records      {typed_mb:7.1f} MiB  built in {typed_time * 1000:7.1f} ms")
+
+    # Abnormal-only: substring scan over every date column vs a categorical isin
+    start = time.perf_counter()
+    results = wide.drop(columns=["TestType", 0, 1]).astype(str)
+    flagged = results.apply(lambda column: column.str.contains(r"\b(?:High|Low)\b")).any(axis=1)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    abnormal = lab_records.abnormal(records)
+    typed = time.perf_counter() - start
+    print(f"  abnormal only      string scan {legacy * 1000:7.1f} ms ({int(flagged.sum())} rows)"
+          f" | typed {typed * 1000:6.1f} ms ({len(abnormal)} rows)")
+
+    start = time.perf_counter()
+    in_range = lab_records.between(records, "2024-03-01", "2024-06-30")
+    print(f"  date range         typed {(time.perf_counter() - start) * 1000:6.1f} ms ({len(in_range)} rows)")
+
+
+# -----------------------------
+#  Analyte name canonicalization
+# -----------------------------
+# Names that look alike but are different results, and what each must become
+# (None: left as printed)
+DISTINCT_ANALYTES = [
+    ("Neutrophils", "Neutrophils %"),
+    ("Neutrophils (Absolute)", "Neutrophils (Absolute)"),
+    ("Neutrophi1s (Abso1ute)", "Neutrophils (Absolute)"),
+    ("Lymphs", "Lymphocytes %"),
+    ("Lymphs (Absolute)", "Lymphocytes (Absolute)"),
+    ("Monocytes(Absolute)", "Monocytes (Absolute)"),
+    ("Eos", "Eosinophils %"),
+    ("Eos (Absolute)", "Eosinophils (Absolute)"),
+    ("Basos", "Basophils %"),
+    ("Baso (Absolute)", "Basophils (Absolute)"),
+    ("RBC", "RBC"),
+    ("nRBC %", "nRBC %"),
+    ("nRBC%", "nRBC %"),
+    ("Absolute nRBC", "nRBC (Absolute)"),
+    ("eGFR", "eGFR"),
+    ("eGFR If Africn Am", "eGFR If African Am"),
+    ("eGFR If NonAfricn Am", "eGFR If Non-African Am"),
+    ("eGFR If Non-Africn Am", "eGFR If Non-African Am"),
+    ("Creatinine", "Creatinine"),
+    ("Creatinine, Serum", "Creatinine"),
+    ("Creatinine, Urine", "Creatinine, Urine"),
+    ("Creatinlne, Urine", "Creatinine, Urine"),
+    ("Hemoglobin", "Hemoglobin"),
+    ("Hemoglobin, Urine", "Urine Blood"),
+    ("Albumin", "Albumin"),
+    ("Albumin, Urine", "Urine Albumin"),
+    ("Microalbumin, Urine", "Microalbumin"),
+    ("Bilirubin, Urine", None),
+    ("Ketones, Urine", None),
+    ("HDL Cholesterol", "HDL Cholesterol"),
+    ("Non-HDL Cholesterol", "Non-HDL Cholesterol"),
+    ("Non HDL Cholestero1", "Non-HDL Cholesterol"),
+    ("Bilirubin, Direct", "Bilirubin Direct"),
+    ("Bilirubin, Dlrect", "Bilirubin Direct"),
+    ("Bilirubin, Indirect", None),
+    ("Vitamin B12", "Vitamin B12"),
+    ("Vitamin 812", "Vitamin B12"),
+    ("Vitamin B1", None),
+    ("Magnesium", "Magnesium"),
+    ("Magnesiurn", "Magnesium"),
+    ("Magnesium, RBC", None),
+]
+
+
+def analyte_variants(rng, count: int):
+    """(raw name, canonical or None) pairs: re-cased, reordered and OCR-garbled aliases plus junk."""
+    from analytes import ANALYTES
+
+    aliases = [(alias, canonical) for canonical, names in ANALYTES.items() for alias in [canonical, *names]]
+    slips = [("m", "rn"), ("o", "0"), ("l", "1"), ("s", "5"), ("i", "l"), ("e", "c")]
+    variants = []
+    for _ in range(count):
+        if rng.random() < 0.05:
+            variants.append(("".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(12)), None))
+            continue
+        name, canonical = rng.choice(aliases)
+        words = name.split()
+        if len(words) > 1 and rng.random() < 0.3:
+            name = f"{' '.join(words[1:])}, {words[0]}"
+        if rng.random() < 0.3:
+            name = name.upper()
+        if len(name) > 6 and rng.random() < 0.4:
+            seen, meant = rng.choice(slips)
+            name = name.replace(seen, meant, 1)
+        if len(name) > 8 and rng.random() < 0.2:
+            cut = rng.randrange(1, len(name) - 1)
+            name = name[:cut] + name[cut + 1 :]
+        variants.append((name, canonical))
+    return variants
+
+
+def bench_analytes(args):
+    import difflib
+    import random
+
+    import pandas as pd
+
+    from analyte_index import AnalyteIndex, normalize
+    from analytes import ANALYTES
+
+    rng = random.Random(0)
+    pool = analyte_variants(rng, 20000)
+    names = [rng.choice(pool)[0] for _ in range(1_000_000)]
+
+    # Fuzzy matching every raw name against every known name
+    known = {normalize(alias): canonical for canonical, aliases in ANALYTES.items() for alias in [canonical, *aliases]}
+    sample = pool[:500]
+    start = time.perf_counter()
+    for name, _ in sample:
+        difflib.get_close_matches(normalize(name), known, n=1, cutoff=0.8)
+    naive = (time.perf_counter() - start) / len(sample)
+
+    start = time.perf_counter()
+    index = AnalyteIndex()
+    build = time.perf_counter() - start
+
+    distinct = list(dict.fromkeys(name for name, _ in pool))
+    start = time.perf_counter()
+    for name in distinct:
+        index.match(name)
+    cold = (time.perf_counter() - start) / len(distinct)
+
+    start = time.perf_counter()
+    canonicalize = index.canonicalize
+    for name in names:
+        canonicalize(name)
+    memoized = time.perf_counter() - start
+
+    index = AnalyteIndex()
+    series = pd.Series(names)
+    start = time.perf_counter()
+    index.canonicalize_series(series)
+    column = time.perf_counter() - start
+
+    # Both again with thousands of known names: made-up analytes from the curated words
+    words = sorted({word for canonical in ANALYTES for word in canonical.split()})
+    large = dict(ANALYTES)
+    while len(large) < 5000:
+        large.setdefault(f"{rng.choice(words)} {rng.choice(words)} {rng.choice(words)}", [])
+    large_known = {normalize(name): name for name in large}
+    start = time.perf_counter()
+    for name, _ in sample[:100]:
+        difflib.get_close_matches(normalize(name), large_known, n=1, cutoff=0.8)
+    large_naive = (time.perf_counter() - start) / 100
+    large_index = AnalyteIndex(large)
+    start = time.perf_counter()
+    for name in distinct:
+        large_index.match(name)
+    large_cold = (time.perf_counter() - start) / len(distinct)
+
+    right = wrong = unmatched = 0
+    for name, canonical in pool:
+        found = index.canonical(name)
+        if found == canonical:
+            right += 1
+        elif found is None:
+            unmatched += 1
+        else:
+            wrong += 1
+
+    print(f"index over {len(index.keys)} names built in {build * 1000:.1f} ms")
+    print(f"  naive difflib scan     {naive * 1e6:8.1f} us/name  (~{naive * 1e6 / 60:6.1f} min per 1M)")
+    print(f"  index, no memo         {cold * 1e6:8.1f} us/name  ({len(distinct)} distinct names)")
+    print(f"  1M names, memoized     {memoized:8.2f} s  ({len(names) / memoized / 1e6:.2f}M names/s)")
+    print(f"  1M names, as a column  {column:8.2f} s  ({len(names) / column / 1e6:.2f}M names/s)")
+    print(f"  5,000 known names      naive {large_naive * 1e6:8.1f} us/name | index {large_cold * 1e6:6.1f} us/name")
+    print(f"  accuracy on the pool   {right / len(pool):.1%} right, {unmatched / len(pool):.1%} unmatched,"
+          f" {wrong / len(pool):.1%} wrong (junk names count as right when unmatched)")
+
+    merged = [
+        (name, expected, index.canonicalize(name))
+        for name, expected in DISTINCT_ANALYTES
+        if index.canonicalize(name) != (expected or name)
+    ]
+    print(f"  distinct look-alikes   {len(DISTINCT_ANALYTES) - len(merged)}/{len(DISTINCT_ANALYTES)} kept apart")
+    for name, expected, found in merged:
+        print(f"    {name!r} -> {found!r}, expected {expected or name!r}")
+
+
+# -----------------------------
+#  Reference range flagging
+# -----------------------------
+def bench_ranges(args):
+    import random
+
+    import numpy as np
+    import pandas as pd
+
+    import batch_parser
+    import lab_parser
+    import lab_records
+    import reference_ranges
+
+    rng = random.Random(0)
+    # 2,500 reports x 40 results; each report prints its own range per test
+    records = lab_records.to_records(batch_parser.parse_batch(synthetic_batch(2500)))
+    pairs = records[["DocId", "TestType"]].drop_duplicates()
+    ranges = pairs.assign(
+        Range=[
+            rng.choice(["{} - {} mmol/L", "{} -{} g/dL", "<{1} mg/dL", ">{0} mL/min"]).format(90 + i % 20, 120 + i % 30)
+            for i in range(len(pairs))
+        ]
+    )
+
+    # Row at a time: look up the range, parse it, compare
+    start = time.perf_counter()
+    lookup = {(doc_id, test_type): text for doc_id, test_type, text in ranges.itertuples(index=False)}
+    flags = []
+    for doc_id, test_type, value in zip(records["DocId"], records["TestType"], records["Value"]):
+        low, high, _ = reference_ranges.parse_range(lookup.get((doc_id, test_type)))
+        if np.isnan(value) or (np.isnan(low) and np.isnan(high)):
+            flags.append(None)
+        elif value < low:
+            flags.append("Low")
+        elif value > high:
+            flags.append("High")
+        else:
+            flags.append("Normal")
+    per_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = reference_ranges.attach_ranges(records, ranges)
+    report = reference_ranges.out_of_range(table)
+    vectorized = time.perf_counter() - start
+
+    print(f"{len(records)} results, {len(ranges)} ranges from {records['DocId'].nunique()} reports")
+    print(f"  per-row parse and compare  {per_row * 1000:8.1f} ms")
+    print(f"  attach_ranges + report     {vectorized * 1000:8.1f} ms ({len(report)} out of range)")
+
+    # What the upload pipeline does: ranges read from the test mentions, flags filled in where none was printed
+    batch = [
+        (doc_id, [
+            record._replace(mention_text=f"{record.mention_text}\nNormal Range: {95 + i % 10} -\n{105 + i % 10} mmol/L")
+            if record.type_ == "TestTypeandResult" else record
+            for i, record in enumerate(records)
+        ])
+        for doc_id, records in synthetic_batch(2500)
+    ]
+    long = batch_parser.parse_batch(batch)
+    parsed = lab_records.to_records(long)
+    start = time.perf_counter()
+    tests = {doc_id: list(test_types) for doc_id, test_types in long.groupby("DocId", sort=False)["TestType"]}
+    printed, aligned = [], 0
+    for doc_id, entities in batch:
+        ranges = lab_parser.test_ranges(entities)
+        if len(ranges) == len(tests.get(doc_id, ())):
+            aligned += 1
+            printed += [(doc_id, test_type, text) for test_type, text in zip(tests[doc_id], ranges) if text]
+    flagged = reference_ranges.fill_flags(parsed, pd.DataFrame(printed, columns=["DocId", "TestType", "Range"]))
+    pipeline = time.perf_counter() - start
+    had_flag = parsed["Flag"].notna()
+    kept = (flagged["Flag"][had_flag].astype(object) == parsed["Flag"][had_flag].astype(object)).all()
+    added = int((flagged["Flag"].notna() & ~had_flag).sum())
+    print(f"  pipeline: read + fill      {pipeline * 1000:8.1f} ms ({aligned}/{len(batch)} reports line up,"
+          f" {added} results flagged from their range, printed flags kept: {kept})")
+
+
+# -----------------------------
+#  Merging per-file CSVs
+# -----------------------------
+def legacy_merge_csv_files(csv_files, output_file):
+    """The concat-per-file merge_csv_files that lab_records replaced, kept as a reference."""
+    import pandas as pd
+
+    combined_df = pd.DataFrame()
+    for csv_file in csv_files:
+        df = pd.read_csv(csv_file)
+        if not combined_df.empty:
+            blank_row = pd.DataFrame([["", ""]])
+            combined_df = pd.concat([combined_df, blank_row], ignore_index=True)
+        combined_df = pd.concat([combined_df, df], ignore_index=True)
+    combined_df.to_csv(output_file, index=False)
+    return output_file
+
+
+def bench_merge(args):
+    import os
+    import tempfile
+
+    import batch_parser
+    import lab_records
+
+    with tempfile.TemporaryDirectory() as tmp:
+        batch = synthetic_batch(10000)
+        long = batch_parser.parse_batch(batch)
+        csv_files = batch_parser.write_per_file_csvs(
+            long, [(doc_id, os.path.join(tmp, f"{doc_id}.csv")) for doc_id, _ in batch]
+        )
+        output = os.path.join(tmp, "final_combined.csv")
+
+        for files in (250, 500, 1000, 10000):
+            # The old merge is quadratic; 10,000 files would take many minutes
+            legacy = None
+            if files <= 1000:
+                start = time.perf_counter()
+                legacy_merge_csv_files(csv_files[:files], output)
+                legacy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            lab_records.write_wide_csv(lab_records.load_results(csv_files[:files]), output)
+            merged = time.perf_counter() - start
+
+            legacy_text = f"{legacy:7.2f} s ({legacy / files * 1000:5.2f} ms/file)" if legacy else " " * 25
+            print(f"{files:>6} files  concat per file {legacy_text} | single pass {merged:6.2f} s"
+                  f" ({merged / files * 1000:5.2f} ms/file)")
+
+
+# -----------------------------
+#  Streaming combined CSV
+# -----------------------------
+def bench_streaming(args):
+    import os
+    import tempfile
+    import tracemalloc
+
+    import batch_parser
+    import lab_parser
+    import lab_records
+    from combined_writer import CombinedCsvWriter
+
+    def folder_bytes(folder):
+        return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+    print("(times include tracemalloc overhead)")
+    for docs in (500, 2000, 8000):
+        with tempfile.TemporaryDirectory() as tmp:
+            staged_dir = os.path.join(tmp, "processed")
+            os.makedirs(staged_dir)
+
+            # Staged: every document parsed, a CSV per document, then all read back and merged
+            tracemalloc.start()
+            start = time.perf_counter()
+            batch = list(iter_synthetic_batch(docs))
+            long = batch_parser.parse_batch(batch)
+            csv_files = batch_parser.write_per_file_csvs(
+                long, [(doc_id, os.path.join(staged_dir, f"{doc_id}.csv")) for doc_id, _ in batch]
+            )
+            combined = os.path.join(tmp, "staged_combined.csv")
+            lab_records.write_wide_csv(lab_records.load_results(csv_files), combined)
+            staged = time.perf_counter() - start
+            staged_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del batch, long
+            per_file = folder_bytes(staged_dir)
+            # Per-file CSVs written, then read back, then the combined file written
+            staged_io = 2 * per_file + os.path.getsize(combined)
+
+            # Streaming: each document parsed and appended as it arrives
+            tracemalloc.start()
+            start = time.perf_counter()
+            streamed_file = os.path.join(tmp, "streamed_combined.csv")
+            with CombinedCsvWriter(streamed_file) as writer:
+                for doc_id, records in iter_synthetic_batch(docs):
+                    writer.add(doc_id, lab_parser.parse_entities(records))
+            streamed = time.perf_counter() - start
+            streamed_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            streamed_io = os.path.getsize(streamed_file)
+
+        print(
+            f"{docs:>5} docs  staged {staged:6.2f} s, peak {staged_peak / 2**20:6.1f} MiB, {staged_io / 2**20:6.1f} MiB I/O"
+            f" | streamed {streamed:6.2f} s, peak {streamed_peak / 2**20:5.1f} MiB, {streamed_io / 2**20:6.1f} MiB I/O"
+        )
+
+
+# -----------------------------
+#  Columnar output
+# -----------------------------
+def bench_columnar(args):
+    import os
+    import tempfile
+
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+    import batch_parser
+    import columnar_output
+    import lab_records
+    from combined_writer import CombinedCsvWriter
+
+    # 5,000 reports x 40 results for 100 patients over 2019-2024
+    long = batch_parser.parse_batch(synthetic_batch(5000))
+    doc = long["DocId"].str.extract(r"(\d+)", expand=False).astype(int)
+    long["DocId"] = "M" + (doc % 100).astype(str) + "/" + doc.astype(str) + ".pdf"
+    long["Date"] = "03/" + (1 + doc % 28).astype(str) + "/" + (2019 + doc % 6).astype(str)
+    records = lab_records.to_records(long)
+    hashes = {doc_id: f"{i:064x}" for i, doc_id in enumerate(long["DocId"].unique())}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "final_combined.csv")
+        with CombinedCsvWriter(csv_file) as writer:
+            for doc_id, rows in long.groupby("DocId", sort=False):
+                writer.add(doc_id, rows[["TestType", "Result", "Date"]].itertuples(index=False, name=None))
+        sizes = {"csv": os.path.getsize(csv_file)}
+        for output_format in columnar_output.FORMATS:
+            root = os.path.join(tmp, output_format)
+            columnar_output.write_results(records, root, hashes, output_format)
+            sizes[output_format] = sum(
+                os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(root) for name in names
+            )
+
+        print(f"{len(records)} results, {records['DocId'].nunique()} reports")
+        start = time.perf_counter()
+        frame = lab_records.read_combined_csv(csv_file)
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        frame = lab_records.add_patients(lab_records.read_combined_csv(csv_file))
+        one = frame[(frame["Patient"] == "M7") & (frame["Date"].dt.year >= 2022)]
+        query = time.perf_counter() - start
+        print(f"  csv      {sizes['csv'] / 2**20:6.1f} MiB  full load {full * 1000:7.1f} ms"
+              f" | M7 since 2022 {query * 1000:7.1f} ms ({len(one)} rows)")
+
+        patient_filter = (ds.field("Patient") == "M7") & (ds.field("Year") >= 2022)
+        for output_format in columnar_output.FORMATS:
+            root = os.path.join(tmp, output_format)
+            start = time.perf_counter()
+            columnar_output.read_results(root, output_format)
+            full = time.perf_counter() - start
+            start = time.perf_counter()
+            one = columnar_output.read_results(root, output_format, filter=patient_filter)
+            query = time.perf_counter() - start
+            print(f"  {output_format:<8} {sizes[output_format] / 2**20:6.1f} MiB  full load {full * 1000:7.1f} ms"
+                  f" | M7 since 2022 {query * 1000:7.1f} ms ({len(one)} rows)")
+
+
+# -----------------------------
+#  XLSX export
+# -----------------------------
+def legacy_write_to_sheet(rows, sheet):
+    """The cell-by-cell write_to_sheet pattern of outputconverter, for every export column."""
+    for row, values in enumerate(rows, start=1):
+        for column, value in zip("ABCDEFG", values):
+            sheet[f"{column}{row}"] = value
+
+
+def bench_xlsx(args):
+    import os
+    import tempfile
+    import tracemalloc
+
+    from openpyxl import Workbook
+
+    import batch_parser
+    import lab_records
+    import xlsx_export
+
+    # 2,500 reports x 40 results = 100k rows for 100 patients
+    long = batch_parser.parse_batch(synthetic_batch(2500))
+    doc = long["DocId"].str.extract(r"(\d+)", expand=False).astype(int)
+    long["DocId"] = "M" + (doc % 100).astype(str) + "/" + doc.astype(str) + ".pdf"
+    records = lab_records.to_records(long)
+    rows = [xlsx_export.COLUMNS] + [list(row) for row in zip(*xlsx_export.cell_columns(records))]
+
+    def per_cell(path):
+        workbook = Workbook()
+        legacy_write_to_sheet(rows, workbook.active)
+        workbook.save(path)
+
+    exports = [
+        ("per-cell", per_cell),
+        ("write-only, 1 sheet", lambda path: xlsx_export.write_xlsx(records, path, sheets="single")),
+        ("write-only, per patient", lambda path: xlsx_export.write_xlsx(records, path, sheets="patient")),
+    ]
+    print(f"{len(records)} rows")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.xlsx")
+        for name, export in exports:
+            start = time.perf_counter()
+            export(path)
+            elapsed = time.perf_counter() - start
+            # Peak Python allocations in a second run; tracemalloc slows the timing
+            tracemalloc.start()
+            export(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {name:<24} {elapsed:6.2f} s  peak {peak / 2**20:7.1f} MiB  file {os.path.getsize(path) / 2**20:5.1f} MiB")
+
+
+# -----------------------------
+#  SQLite results store
+# -----------------------------
+def bench_results_store(args):
+    import os
+    import tempfile
+
+    import batch_parser
+    import lab_records
+    import results_store
+    from combined_writer import CombinedCsvWriter
+
+    # 25,000 reports x 40 results = 1M rows for 1,000 patients over 2015-2024
+    long = batch_parser.parse_batch(synthetic_batch(25000))
+    doc = long["DocId"].str.extract(r"(\d+)", expand=False).astype(int)
+    long["DocId"] = "M" + (doc % 1000).astype(str) + "/" + doc.astype(str) + ".pdf"
+    long["Date"] = (2015 + doc // 1000 % 10).astype(str) + "-" + (1 + doc % 12).astype(str) + "-15"
+    records = lab_records.to_records(long)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "final_combined.csv")
+        with CombinedCsvWriter(csv_file) as writer:
+            for doc_id, rows in long.groupby("DocId", sort=False):
+                writer.add(doc_id, rows[["TestType", "Result", "Date"]].itertuples(index=False, name=None))
+
+        store = results_store.ResultsStore(os.path.join(tmp, "results.db"))
+        hashes = {doc_id: f"{i:064x}" for i, doc_id in enumerate(long["DocId"].unique())}
+        start = time.perf_counter()
+        store.add_records(records, hashes)
+        insert = time.perf_counter() - start
+        print(f"{len(records)} rows inserted in {insert:.1f} s ({len(records) / insert:,.0f} rows/s),"
+              f" {os.path.getsize(store.path) / 2**20:.0f} MiB")
+
+        def best(func, repeat=args.repeat):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                found = func()
+                timings.append(time.perf_counter() - start)
+            return min(timings) * 1000, len(found)
+
+        def full_scan():
+            # The same query with the index ruled out
+            with store._lock:
+                return store._conn.execute(
+                    "SELECT * FROM results NOT INDEXED WHERE patient = ? AND analyte = ? AND date >= ?",
+                    ("M122", "Analyte 7", "2020-01-01"),
+                ).fetchall()
+
+        def from_csv():
+            frame = lab_records.add_patients(lab_records.read_combined_csv(csv_file))
+            return frame[(frame["Patient"] == "M122") & (frame["TestType"] == "Analyte 7")
+                         & (frame["Date"] >= "2020-01-01")]
+
+        queries = [
+            ("indexed: patient + analyte + since", lambda: store.query("M122", "Analyte 7", since="2020-01-01")),
+            ("indexed: patient history", lambda: store.query("M122")),
+            ("full table scan", full_scan),
+        ]
+        for name, func in queries:
+            elapsed, found = best(func)
+            print(f"  {name:<36} {elapsed:9.2f} ms  ({found} rows)")
+        elapsed, found = best(from_csv, repeat=1)
+        print(f"  {'re-reading final_combined.csv':<36} {elapsed:9.2f} ms  ({found} rows)")
+        store.close()
+
+
+# -----------------------------
+#  Incremental pivot tables
+# -----------------------------
+def bench_pivot(args):
+    import os
+    import tempfile
+
+    import pandas as pd
+
+    import pivot_builder
+
+    # One patient, a report with 40 components on each new date
+    def report(doc):
+        label = (pd.Timestamp("2000-01-01") + pd.Timedelta(days=doc)).strftime("%b %d, %Y")
+        return [(f"Analyte {i}", f"{100 + (doc + i) % 50} mg/dL", label) for i in range(40)]
+
+    pivots = pivot_builder.PivotBuilder()
+    history = []
+    applied = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for dates in (10, 100, 1000, 5000):
+            while applied < dates - args.repeat:
+                rows = report(applied)
+                pivots.apply_rows(f"M1/{applied}.pdf", rows)
+                history.extend(rows)
+                applied += 1
+
+            # The last reports of this size, applied and written one at a time
+            update = write = 0.0
+            for _ in range(args.repeat):
+                rows = report(applied)
+                start = time.perf_counter()
+                pivots.apply_rows(f"M1/{applied}.pdf", rows)
+                update += time.perf_counter() - start
+                start = time.perf_counter()
+                pivots.flush(tmp)
+                write += time.perf_counter() - start
+                history.extend(rows)
+                applied += 1
+
+            # Rebuilding the table from the whole long history after each report
+            long = pd.DataFrame(history, columns=["TestType", "Result", "Date"])
+            start = time.perf_counter()
+            long["Parsed"] = pd.to_datetime(long["Date"], format="mixed")
+            wide = long.pivot_table(index="TestType", columns="Parsed", values="Result", aggfunc="first", sort=False)
+            repivot = time.perf_counter() - start
+
+            size = os.path.getsize(os.path.join(tmp, "M1.csv"))
+            print(f"{dates:5d} dates: update {update / args.repeat * 1000:7.2f} ms"
+                  f" | write CSV {write / args.repeat * 1000:7.2f} ms ({size / 2**10:.0f} KiB)"
+                  f" | full re-pivot {repivot * 1000:8.2f} ms ({wide.shape[1]} columns)")
+
+
+# -----------------------------
+#  Google Sheets export
+# -----------------------------
+def bench_sheets(args):
+    import json
+
+    import batch_parser
+    import lab_records
+    import sheets_standin
+    import sheets_writer
+    import xlsx_export
+
+    # 2,500 reports x 40 results = 100k rows for 100 patients
+    long = batch_parser.parse_batch(synthetic_batch(2500))
+    doc = long["DocId"].str.extract(r"(\d+)", expand=False).astype(int)
+    long["DocId"] = "M" + (doc % 100).astype(str) + "/" + doc.astype(str) + ".pdf"
+    records = lab_records.to_records(long)
+
+    # Round trip to Google is tens of milliseconds; default to 20 ms per request
+    latency = args.latency or 0.02
+    server, port, standin = sheets_standin.serve(latency=latency)
+    endpoint = f"http://localhost:{port}"
+    session = sheets_writer.create_session(endpoint, pool_size=8)
+    print(f"{len(records)} rows, {latency * 1000:.0f} ms per request")
+
+    # One request per row, as porting write_to_sheet to the API would do; timed on a sample
+    sample = 500
+    rows = sheets_writer.tab_rows(records.iloc[:sample], sheets="single")[xlsx_export.SINGLE_SHEET]
+    session.get(f"{endpoint}/v4/spreadsheets/rows")
+    start = time.perf_counter()
+    for number, row in enumerate(rows, start=1):
+        session.put(f"{endpoint}/v4/spreadsheets/rows/values/Sheet1!A{number}", data=json.dumps({"values": [row]}))
+    per_row = (time.perf_counter() - start) / len(rows)
+    stats = standin.stats()
+    print(f"  per-row updates        {per_row * len(records):8.1f} s projected ({len(records)} requests,"
+          f" {stats['bytes_received'] / len(rows) * len(records) / 2**20:.1f} MiB)")
+
+    writer = sheets_writer.SheetsWriter(session=session, endpoint=endpoint, max_workers=4)
+    for sheets in ("single", "patient"):
+        standin.reset_stats()
+        start = time.perf_counter()
+        writer.write(f"batched-{sheets}", records, sheets=sheets)
+        elapsed = time.perf_counter() - start
+        stats = standin.stats()
+        print(f"  batched, {sheets:<13} {elapsed:8.2f} s  ({stats['requests']} requests,"
+              f" {stats['bytes_received'] / 2**20:.1f} MiB)")
+
+    # Eight spreadsheets of 12.5k rows, one at a time and four at once over the shared session
+    jobs = {f"clinic-{i}": records.iloc[i::8] for i in range(8)}
+    for workers in (1, 4):
+        writer = sheets_writer.SheetsWriter(session=session, endpoint=endpoint, max_workers=workers)
+        standin.reset_stats()
+        start = time.perf_counter()
+        writer.write_many({f"{name}-{workers}": part for name, part in jobs.items()})
+        elapsed = time.perf_counter() - start
+        print(f"  8 spreadsheets, {workers} at once {elapsed:6.2f} s  ({standin.stats()['requests']} requests)")
+    server.shutdown()
+
+
+# -----------------------------
+#  Background upload jobs
+# -----------------------------
+def upload_app(tmp):
+    """totalprogramv2 working in tmp, sending every page to Document AI (set DOCUMENT_AI_ENDPOINT first)."""
+    import os
+
+    # The app keeps uploads, outputs, the job store and the cache under its working directory
+    os.chdir(tmp)
+    os.environ.update(DOCAI_RESULTS_DB="", DOCAI_PIVOT_FORMATS="", DOCAI_CACHE_DIR=os.path.join(tmp, "cache"))
+    import totalprogramv2
+
+    totalprogramv2.app.root_path = tmp
+    totalprogramv2.app.config["HYBRID_ROUTING"] = False
+    return totalprogramv2
+
+
+def bench_jobs(args):
+    import io
+    import os
+    import tempfile
+
+    server, port, _ = docai_standin.serve(latency=args.latency or 0.3, max_workers=64)
+    os.environ[docai_client.ENDPOINT_ENV] = f"localhost:{port}"
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            totalprogramv2 = upload_app(tmp)
+            client = totalprogramv2.app.test_client()
+            store = totalprogramv2.job_queue().store
+            pdf = synthetic_pdf(1)
+            serial = 0
+
+            print(f"Document AI stand-in at {args.latency or 0.3:.1f} s per request")
+            for files in (1, 10, 50):
+                # Distinct bytes per PDF, so nothing comes from the Document AI cache
+                contents = [pdf + b"\n%% %d\n" % (serial + i) for i in range(2 * files)]
+                serial += 2 * files
+
+                # Before: /upload ran the whole batch inside the request
+                os.makedirs("sync", exist_ok=True)
+                jobs = []
+                for i, content in enumerate(contents[:files]):
+                    path = os.path.join("sync", f"report_{i}.pdf")
+                    with open(path, "wb") as f:
+                        f.write(content)
+                    jobs.append((path, f"report_{i}.pdf"))
+                start = time.perf_counter()
+                totalprogramv2.stream_to_combined_csv(jobs, os.path.join("sync", "final_combined.csv"))
+                synchronous = time.perf_counter() - start
+
+                data = {"file": [(io.BytesIO(content), f"report_{i}.pdf") for i, content in enumerate(contents[files:])]}
+                start = time.perf_counter()
+                response = client.post("/upload", data=data, content_type="multipart/form-data")
+                accepted = time.perf_counter() - start
+                job_id = response.get_json()["job_id"]
+                while store.get(job_id)["state"] in ("queued", "running"):
+                    time.sleep(0.01)
+                finished = time.perf_counter() - start
+                print(f"  {files:>3} PDFs  synchronous /upload {synchronous * 1000:8.1f} ms"
+                      f"   queued /upload {accepted * 1000:6.1f} ms (job done after {finished * 1000:.0f} ms)")
+    finally:
+        os.chdir(cwd)
+        del os.environ[docai_client.ENDPOINT_ENV]
+        server.stop(None)
+
+
+# -----------------------------
+#  Job progress: polling vs Server-Sent Events
+# -----------------------------
+def bench_events(args):
+    import json
+    import os
+    import tempfile
+    import threading
+    from datetime import datetime
+
+    import requests
+    from werkzeug.serving import make_server
+
+    clients, interval = 20, 2.0
+    server, port, _ = docai_standin.serve(latency=args.latency or 0.3, max_workers=64)
+    os.environ[docai_client.ENDPOINT_ENV] = f"localhost:{port}"
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            totalprogramv2 = upload_app(tmp)
+            app = totalprogramv2.app
+            app.config["MAX_IN_FLIGHT"] = 4
+            served = []
+            wsgi_app = app.wsgi_app
+
+            def counting(environ, start_response):
+                served.append(environ["PATH_INFO"])
+                return wsgi_app(environ, start_response)
+
+            app.wsgi_app = counting
+            http = make_server("localhost", 0, app, threaded=True)
+            threading.Thread(target=http.serve_forever, daemon=True).start()
+            base = f"http://localhost:{http.server_port}"
+            pdf = synthetic_pdf(1)
+            store = totalprogramv2.job_queue().store
+
+            def finish_times(job_id):
+                files = store.get(job_id)["files"]
+                return [datetime.fromisoformat(file["finished"]).timestamp() for file in files]
+
+            def poll(job_id, seen):
+                # What the page did: ask every 2 s until the job is over
+                while True:
+                    job = requests.get(f"{base}/jobs/{job_id}").json()
+                    now = time.time()
+                    for position, file in enumerate(job["files"]):
+                        if file["state"] in ("done", "failed"):
+                            seen.setdefault(position, now)
+                    if job["state"] in ("done", "failed"):
+                        return
+                    time.sleep(interval)
+
+            def follow(job_id, seen):
+                with requests.get(f"{base}/jobs/{job_id}/events", stream=True) as response:
+                    event = None
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line.startswith("event: "):
+                            event = line[7:]
+                        elif line.startswith("data: ") and event == "rows":
+                            seen.setdefault(json.loads(line[6:])["position"], time.time())
+
+            print(f"{args.docs} PDFs, Document AI stand-in at {args.latency or 0.3:.1f} s, {clients} clients")
+            for label, watch in (("polling /jobs every 2 s", poll), ("/jobs/<id>/events", follow)):
+                files = [("file", (f"report_{i}.pdf", pdf + b"\n%% %s %d\n" % (label.encode(), i))) for i in range(args.docs)]
+                job_id = requests.post(f"{base}/upload", files=files).json()["job_id"]
+                served.clear()
+                seen = [{} for _ in range(clients)]
+                watchers = [threading.Thread(target=watch, args=(job_id, s)) for s in seen]
+                for watcher in watchers:
+                    watcher.start()
+                for watcher in watchers:
+                    watcher.join()
+                finished = finish_times(job_id)
+                lags = [client[position] - finished[position] for client in seen for position in client]
+                print(f"  {label:<24} {len(served):5d} requests   result shown after finish:"
+                      f" mean {statistics.mean(lags) * 1000:7.1f} ms, max {max(lags) * 1000:7.1f} ms")
+            http.shutdown()
+    finally:
+        os.chdir(cwd)
+        del os.environ[docai_client.ENDPOINT_ENV]
+        server.stop(None)
+
+
+BENCHMARKS = {
+    "client_pool": bench_client_pool,
+    "parallel_upload": bench_parallel_upload,
+    "chunking": bench_chunking,
+    "adaptive": bench_adaptive,
+    "entity_io": bench_entity_io,
+    "preprocess": bench_preprocess,
+    "load_test": bench_load_test,
+    "parser": bench_parser,
+    "rules": bench_rules,
+    "batch_parse": bench_batch_parse,
+    "typed_records": bench_typed_records,
+    "analytes": bench_analytes,
+    "ranges": bench_ranges,
+    "merge": bench_merge,
+    "streaming": bench_streaming,
+    "columnar": bench_columnar,
+    "xlsx": bench_xlsx,
+    "results_store": bench_results_store,
+    "pivot": bench_pivot,
+    "sheets": bench_sheets,
+    "jobs": bench_jobs,
+    "events": bench_events,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--docs", type=int, default=200, help="Documents per run")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stand-in latency per request (s)")
+    parser.add_argument("--qps", type=float, default=None, help="Per-processor request rate cap")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions for CPU-bound benchmarks")
+    parser.add_argument("--chunk-pages", type=int, default=pdf_chunker.DEFAULT_CHUNK_PAGES, help="Pages per chunk")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Columnar (Parquet / Arrow IPC) output of parsed lab results.
+
+Typed records from lab_records are written as a dataset partitioned by
+patient and test year, one file per partition:
+
+    results_parquet/Patient=M122/Year=2024/part-0.parquet
+
+Every upload adds to the same dataset. A write rewrites the partitions of
+the patients it has results for, keeping their other documents; each row
+carries its document's hash (Sha256), so a document written again
+replaces its earlier rows. Reports that named no patient go under
+Patient=__HIVE_DEFAULT_PARTITION__.
+
+Test names, units, flags and comparators are stored dictionary-encoded,
+so a test name is written once per file rather than once per row. Notebooks can then load only what they ask for:
+
+    read_results("processed/results_parquet", filter=(ds.field("Patient") == "M122") & (ds.field("Year") >= 2020))
+
+Parquet files skip non-matching partitions and row groups; Arrow IPC
+files are memory-mapped instead of parsed.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+
+from lab_records import CATEGORY_COLUMNS, RECORD_COLUMNS, add_patients
+
+# Output mode name -> pyarrow dataset format
+FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+PARTITION_COLUMNS = ["Patient", "Year"]
+# Per-document columns, written as plain strings rather than dictionaries
+PLAIN_COLUMNS = ["DocId", "Result", "DateLabel"]
+# Partition folder of a missing value (a report without a patient, a result without a date)
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# The app's job workers write to one dataset; they take turns
+_write_lock = threading.Lock()
+
+
+def _table(records: pd.DataFrame) -> pa.Table:
+    records = add_patients(records)
+    records["Year"] = records["Date"].dt.year.astype("Int16")
+    # Every partition file would carry the whole dictionary of these
+    # (thousands of documents and result strings); Parquet still
+    # dictionary-encodes them per file from the values actually present
+    for column in PLAIN_COLUMNS:
+        records[column] = records[column].astype(object)
+    # The other categoricals become dictionary arrays; the index is just 0..n
+    return pa.Table.from_pandas(records, preserve_index=False)
+
+
+def _stored(folder: str, fmt: str) -> Optional[pd.DataFrame]:
+    """The records (with Sha256) in one patient's folder, or None when it has none yet."""
+    if not os.path.isdir(folder):
+        return None
+    stored = ds.dataset(folder, format=fmt, partitioning="hive").to_table().to_pandas()
+    return stored[RECORD_COLUMNS + ["Sha256"]]
+
+
+def _replace_folder(target: str, written: str):
+    """Moves a freshly written folder to target, replacing what was there."""
+    old = None
+    if os.path.isdir(target):
+        old = f"{written}.old"
+        os.replace(target, old)
+    os.replace(written, target)
+    if old:
+        shutil.rmtree(old)
+
+
+def write_results(records: pd.DataFrame, root: str, hashes: Dict[str, str],
+                  output_format: str = "parquet") -> str:
+    """
+    Adds records to the dataset under root, partitioned by Patient and Year
+    (hive style). hashes maps every DocId to its document's hash: stored
+    rows of those documents are replaced, every other document is kept.
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown columnar format '{output_format}'; expected one of {sorted(FORMATS)}")
+    fmt = FORMATS[output_format]
+    extension = "parquet" if fmt == "parquet" else "arrow"
+    doc_ids = records["DocId"].astype(object)
+    missing = sorted({str(doc_id) for doc_id in doc_ids.unique() if not hashes.get(doc_id)})
+    if missing:
+        raise ValueError(f"No document hash for {', '.join(missing)}")
+    records = records[RECORD_COLUMNS].assign(Sha256=doc_ids.map(hashes).to_numpy())
+    patients = add_patients(records)["Patient"].astype(object)
+
+    os.makedirs(root, exist_ok=True)
+    with _write_lock:
+        for patient, new in records.groupby(patients.fillna(NULL_PARTITION).to_numpy(), sort=False):
+            # Partition values are URI-escaped in folder names, as pyarrow writes them
+            folder = f"Patient={patient if patient == NULL_PARTITION else quote(patient, safe='')}"
+            target = os.path.join(root, folder)
+            stored = _stored(target, fmt)
+            if stored is not None:
+                new = pd.concat([stored[~stored["Sha256"].isin(new["Sha256"])], new], ignore_index=True)
+            # A patient's files hold few documents, so the hashes are dictionary-encoded too
+            new = new.astype({column: "category" for column in CATEGORY_COLUMNS + ["Sha256"]})
+            # Written next to the dataset, then swapped in whole
+            with tempfile.TemporaryDirectory(dir=root, prefix=".write-") as tmp:
+                ds.write_dataset(
+                    _table(new),
+                    tmp,
+                    format=fmt,
+                    partitioning=PARTITION_COLUMNS,
+                    partitioning_flavor="hive",
+                    basename_template=f"part-{{i}}.{extension}",
+                )
+                _replace_folder(target, os.path.join(tmp, folder))
+    return root
+
+
+def read_results(root: str, output_format: str = "parquet", filter=None,
+                 columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Loads a dataset written by write_results. filter (a pyarrow.dataset
+    expression) is pushed down to partitions and row groups; dictionary
+    columns come back as pandas categoricals.
+    """
+    if not os.path.isdir(root):
+        raise FileNotFoundError(root)
+    # Arrow IPC files are mapped into memory rather than read
+    filesystem = fs.LocalFileSystem(use_mmap=output_format == "arrow")
+    dataset = ds.dataset(root, format=FORMATS[output_format], partitioning="hive", filesystem=filesystem)
+    return dataset.to_table(filter=filter, columns=columns).to_pandas()
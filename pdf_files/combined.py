@@ -1,8 +1,9 @@
 from typing import Optional, List
-from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
+from pdf_chunker import DEFAULT_CHUNK_PAGES, process_in_chunks
+from docai_entities import EntityRecord, extract_entities, write_debug_output
+from lab_parser import parse_output
 import pandas as pd
-import re
 import os
 
 def process_document_sample(
@@ -14,8 +15,9 @@ def process_document_sample(
     field_mask: Optional[str] = "entities",
     processor_version_id: Optional[str] = None,
     target_entities: Optional[List[str]] = None,  # Specify a list of target entities
-    output_file: str = "output.txt",  # Output file for saving results
-) -> str:
+    output_file: Optional[str] = None,  # Optional debug dump of the text and entities
+    chunk_pages: int = DEFAULT_CHUNK_PAGES,  # Max pages per Document AI request
+) -> List[EntityRecord]:
     """
     Processes a document with Google Document AI and extracts specified entities.
 
@@ -27,18 +29,16 @@ def process_document_sample(
     :param field_mask: Field mask for specific fields to extract.
     :param processor_version_id: Specific processor version to use (optional).
     :param target_entities: List of entities to extract (optional).
-    :param output_file: Path to the output text file for saving results.
-    :return: Path to the output text file.
+    :param output_file: If given, also write the old text dump here for debugging.
+    :param chunk_pages: Longer PDFs are split into chunks of this many pages.
+    :return: The extracted entities, in document order.
     """
     # Verify if file exists
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"The file '{file_path}' does not exist.")
 
-    # Configure API endpoint based on location
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-
-    # Initialize Document AI client
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    # Reuse the pooled Document AI client for this location
+    client = get_client(location)
 
     # Construct the processor path
     name = client.processor_path(project_id, location, processor_id)
@@ -47,87 +47,27 @@ def process_document_sample(
     with open(file_path, "rb") as document_file:
         document_content = document_file.read()
 
-    # Prepare raw document for processing
-    raw_document = documentai.RawDocument(content=document_content, mime_type=mime_type)
-
-    # Create the processing request
-    request = documentai.ProcessRequest(
-        name=name,
-        raw_document=raw_document,
+    # Long PDFs are split into page chunks, processed concurrently and stitched back together
+    document = process_in_chunks(
+        client,
+        name,
+        document_content,
+        mime_type=mime_type,
         field_mask=field_mask,
+        chunk_pages=chunk_pages,
     )
 
-    # Execute the request and get the response
-    result = client.process_document(request=request)
-    document = result.document
-
-    # Open the output file for writing
-    with open(output_file, "w") as output:
-        # Write the document text if available
-        if document.text:
-            output.write("Extracted Text:\n")
-            output.write(document.text + "\n\n")
-
-        # Check for and filter entities
-        if document.entities:
-            output.write("Extracted Entities:\n")
-            for entity in document.entities:
-                # Filter entities if target_entities is provided
-                if not target_entities or entity.type_ in target_entities:
-                    output.write(f"{entity.type_}: {entity.mention_text}\n")
-        else:
-            output.write("No entities found in the document.\n")
-
-    print(f"Document AI output saved to: {output_file}")
-    return output_file
-
-def parse_output(file_path):
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    data = []
-    current_date = None
-
-    # Extract the date from the last lines
-    for line in reversed(lines):
-        if line.startswith("dateoftest:"):
-            current_date = line.split(":")[1].strip()
-            break
-
-    for i, line in enumerate(lines):
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":", 1)[1].strip()  # Extract test type
-            result = ""
-
-            # Check if the test type itself contains the result
-            embedded_result = re.search(r"(\d+(?:\.\d+)?\s*(?:High|Low))", test_type)
-            if embedded_result:
-                result = embedded_result.group(0)
-                test_type = test_type.replace(result, "").strip()
-
-            # Collect the subsequent lines until the next "TestTypeandResult:" or "dateoftest:"
-            for j in range(i + 1, len(lines)):
-                next_line = lines[j].strip()
-                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
-                    break
-
-                # Handle results on the next lines
-                if re.match(r"High|Low", next_line):
-                    if re.search(r"\d+", next_line):
-                        result = next_line
-                    elif j + 1 < len(lines) and re.match(r"^[<>]?\d+(\.\d+)?", lines[j + 1].strip()):
-                        result = f"{next_line} {lines[j + 1].strip()}"
-                    break
-                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
-                    result = next_line
-                    break
-
-            data.append((test_type, result, current_date))
-
-    return data
-
-def convert_to_csv(output_text_file, output_csv_file):
-    data = parse_output(output_text_file)
+    entities = extract_entities(document, target_entities)
+
+    # The text dump is only a debug aid now; the parser works on the records directly
+    if output_file:
+        write_debug_output(document, output_file, target_entities)
+        print(f"Document AI output saved to: {output_file}")
+
+    return entities
+
+def convert_to_csv(source, output_csv_file):
+    data = parse_output(source)
     structured_data = [{"TestType": test_type, "Result": result} for test_type, result, date in data]
 
     # Convert to DataFrame
@@ -149,22 +89,20 @@ def main():
     processor_id = "dc982698f289d9e4"
     input_pdf = r"C:\Users\joyjp\Downloads\M122_2024.07.18 - CBC, Inova"
     mime_type = "application/pdf"
-    output_text_file = "output.txt"
     output_csv_file = "output_converted10.csv"
 
     # Step 1: Process the document and extract data
-    processed_file = process_document_sample(
+    entities = process_document_sample(
         project_id=project_id,
         location=location,
         processor_id=processor_id,
         file_path=input_pdf,
         mime_type=mime_type,
-        output_file=output_text_file,
         target_entities=["dateoftest", "TestTypeandResult"],
     )
 
-    # Step 2: Convert the extracted data to CSV
-    convert_to_csv(processed_file, output_csv_file)
+    # Step 2: Convert the extracted entities to CSV
+    convert_to_csv(entities, output_csv_file)
 
 # Run the combined workflow
 if __name__ == "__main__":
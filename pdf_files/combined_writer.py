@@ -0,0 +1,75 @@
+"""
+Append-only combined CSV that parsed rows stream into.
+
+The staged pipeline wrote processed/<name>.csv for every PDF and then read
+them all back to build final_combined.csv. Here each document's rows are
+appended to the combined file as soon as it is parsed, in long layout
+(the header is fixed, so nothing has to be rewritten at the end):
+
+    Source,TestType,Result,Date
+    report_1.pdf,Sodium,Low 133,"Mar 17, 2020"
+
+Per-file CSVs in the convert_to_csv layout are still written when a
+per_file_dir is given.
+
+    with CombinedCsvWriter(COMBINED_CSV) as writer:
+        for name, rows in parsed_documents:
+            writer.add(name, rows)
+"""
+import csv
+import os
+import threading
+from typing import Iterable, Optional, Tuple
+
+COLUMNS = ["Source", "TestType", "Result", "Date"]
+
+
+class CombinedCsvWriter:
+    """Streams (test_type, result, date) rows of many documents into one CSV."""
+
+    def __init__(self, output_file: str, per_file_dir: Optional[str] = None):
+        self.output_file = output_file
+        self.per_file_dir = per_file_dir
+        self.documents = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._file = open(output_file, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def add(self, source: str, rows: Iterable[Tuple[str, str, Optional[str]]]) -> int:
+        """Appends one document's rows and returns how many were written."""
+        rows = [(source, test_type, result, date) for test_type, result, date in rows]
+        if not rows:
+            print(f"Warning: No data found for {source}.")
+            return 0
+        with self._lock:
+            self._writer.writerows(rows)
+            # Readers (and a crash) see every finished document
+            self._file.flush()
+            self.documents += 1
+            self.rows += len(rows)
+        if self.per_file_dir:
+            self._write_per_file(source, rows)
+        return len(rows)
+
+    def _write_per_file(self, source: str, rows):
+        date = rows[0][3]
+        path = os.path.join(self.per_file_dir, f"{source}.csv")
+        # source may sit in a patient folder ("M122/labs.pdf")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["TestType", date if date is not None else "Result"])
+            writer.writerows((test_type, result) for _, test_type, result, _ in rows)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
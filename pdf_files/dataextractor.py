@@ -2,6 +2,7 @@ import os
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from google.cloud import documentai_v1 as documentai
+from docai_client import get_client
 from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
 
 # Authenticate and initialize Google APIs
@@ -27,7 +28,7 @@ def download_file(drive_service, file_id, file_name):
 
 # 3. Process document using Document AI
 def process_document_ai(project_id, file_path, location='us'):
-    client = documentai.DocumentProcessorServiceClient()
+    client = get_client(location)
     with open(file_path, 'rb') as image:
         image_content = image.read()
     
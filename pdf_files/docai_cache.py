@@ -0,0 +1,133 @@
+"""
+On-disk cache of Document AI results.
+
+Entries are keyed by the SHA-256 of the PDF bytes plus the processor name,
+processor version and field mask, and hold the serialized Document proto.
+A hit skips the network round trip entirely. The least recently used entries
+are evicted once the cache grows past its byte budget.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from google.cloud import documentai
+
+DEFAULT_CACHE_DIR = os.environ.get("DOCAI_CACHE_DIR", ".docai_cache")
+DEFAULT_MAX_BYTES = int(os.environ.get("DOCAI_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def cache_key(
+    content: bytes,
+    processor_name: str,
+    processor_version_id: Optional[str] = None,
+    field_mask: Optional[str] = None,
+) -> str:
+    """SHA-256 over the document bytes and everything that changes the response."""
+    digest = hashlib.sha256(content).hexdigest()
+    parts = [digest, processor_name, processor_version_id or "", field_mask or ""]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class DocumentCache:
+    """LRU cache of serialized Document protos stored as <key>.pb files."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, oldest first
+        self._bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pb")
+
+    def _load_index(self):
+        """Rebuilds the LRU order from file modification times."""
+        found = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".pb"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                found.append((stat.st_mtime, filename[:-3], stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+
+    def get(self, key: str) -> Optional[documentai.Document]:
+        """Returns the cached Document, or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Removed behind our back; treat it as a miss.
+            with self._lock:
+                self._bytes -= self._entries.pop(key, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+        return documentai.Document.deserialize(data)
+
+    def put(self, key: str, document: documentai.Document):
+        """Stores a Document and evicts old entries past the byte budget."""
+        data = documentai.Document.serialize(document)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._bytes += len(data)
+
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache() -> DocumentCache:
+    """Process-wide cache configured by DOCAI_CACHE_DIR / DOCAI_CACHE_MAX_BYTES."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = DocumentCache()
+        return _default_cache
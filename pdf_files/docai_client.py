@@ -0,0 +1,158 @@
+"""
+Shared Document AI client registry.
+
+Creating a DocumentProcessorServiceClient opens a new gRPC channel, performs a
+TLS handshake and loads credentials. Every entry point goes through get_client()
+so one warm client is kept per (location, endpoint, credentials/api key) and
+shared across calls and threads.
+
+Setting DOCUMENT_AI_ENDPOINT (e.g. "localhost:50051", or "http://localhost:8080"
+for REST) redirects every client that is not given an explicit endpoint, which
+is how the pipelines are pointed at docai_standin.py.
+"""
+import os
+import threading
+from typing import Optional
+
+import grpc
+from google.cloud import documentai
+from google.api_core.client_options import ClientOptions
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.documentai_v1.services.document_processor_service.transports import (
+    DocumentProcessorServiceGrpcAsyncIOTransport,
+    DocumentProcessorServiceGrpcTransport,
+    DocumentProcessorServiceRestTransport,
+)
+
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "[::1]"}
+ENDPOINT_ENV = "DOCUMENT_AI_ENDPOINT"
+
+_lock = threading.Lock()
+_clients = {}
+_stats = {"created": 0, "reused": 0}
+
+
+def default_endpoint(location: str) -> str:
+    """Regional Document AI endpoint, e.g. "us-documentai.googleapis.com"."""
+    return f"{location}-documentai.googleapis.com"
+
+
+def resolve_endpoint(location: str, endpoint: Optional[str] = None) -> str:
+    """Explicit endpoint, else $DOCUMENT_AI_ENDPOINT, else the regional endpoint."""
+    return endpoint or os.environ.get(ENDPOINT_ENV) or default_endpoint(location)
+
+
+def is_rest_endpoint(endpoint: str) -> bool:
+    """Endpoints given as URLs ("http://localhost:8080") use the REST transport."""
+    return endpoint.startswith(("http://", "https://"))
+
+
+def is_local_endpoint(endpoint: str) -> bool:
+    """True for endpoints like "localhost:50051" that need no TLS or auth."""
+    host = endpoint.split("://", 1)[-1].rsplit(":", 1)[0]
+    return host in LOCAL_HOSTS
+
+
+def create_client(
+    location: str,
+    endpoint: Optional[str] = None,
+    api_key: Optional[str] = None,
+    credentials=None,
+) -> documentai.DocumentProcessorServiceClient:
+    """
+    Builds a new, unpooled client. Prefer get_client() unless a private
+    channel is really needed.
+    """
+    endpoint = resolve_endpoint(location, endpoint)
+
+    if is_rest_endpoint(endpoint):
+        if is_local_endpoint(endpoint):
+            credentials = AnonymousCredentials()
+        transport = DocumentProcessorServiceRestTransport(host=endpoint, credentials=credentials)
+        return documentai.DocumentProcessorServiceClient(transport=transport)
+
+    if is_local_endpoint(endpoint):
+        # Local stand-ins have no TLS and no auth.
+        transport = DocumentProcessorServiceGrpcTransport(channel=grpc.insecure_channel(endpoint))
+        return documentai.DocumentProcessorServiceClient(transport=transport)
+
+    if api_key:
+        opts = ClientOptions(api_endpoint=endpoint, api_key=api_key)
+        return documentai.DocumentProcessorServiceClient(client_options=opts)
+
+    opts = ClientOptions(api_endpoint=endpoint)
+    return documentai.DocumentProcessorServiceClient(client_options=opts, credentials=credentials)
+
+
+def create_async_client(
+    location: str,
+    endpoint: Optional[str] = None,
+    api_key: Optional[str] = None,
+    credentials=None,
+) -> documentai.DocumentProcessorServiceAsyncClient:
+    """
+    Builds an asyncio client. Async channels are bound to the running event
+    loop, so these are not pooled; create one per loop and reuse it there.
+    """
+    endpoint = resolve_endpoint(location, endpoint)
+    if is_rest_endpoint(endpoint):
+        raise ValueError(f"The async client only speaks gRPC; got REST endpoint '{endpoint}'")
+
+    if is_local_endpoint(endpoint):
+        channel = grpc.aio.insecure_channel(endpoint)
+        transport = DocumentProcessorServiceGrpcAsyncIOTransport(channel=channel)
+        return documentai.DocumentProcessorServiceAsyncClient(transport=transport)
+
+    if api_key:
+        opts = ClientOptions(api_endpoint=endpoint, api_key=api_key)
+        return documentai.DocumentProcessorServiceAsyncClient(client_options=opts)
+
+    opts = ClientOptions(api_endpoint=endpoint)
+    return documentai.DocumentProcessorServiceAsyncClient(client_options=opts, credentials=credentials)
+
+
+def get_client(
+    location: str,
+    endpoint: Optional[str] = None,
+    api_key: Optional[str] = None,
+    credentials=None,
+) -> documentai.DocumentProcessorServiceClient:
+    """
+    Returns the shared client for (location, endpoint, credentials/api key),
+    creating it on first use. Clients are thread-safe, so the same instance is
+    handed to every caller.
+    """
+    endpoint = resolve_endpoint(location, endpoint)
+    key = (location, endpoint, api_key, id(credentials) if credentials is not None else None)
+
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _stats["reused"] += 1
+            return client
+
+        client = create_client(location, endpoint, api_key=api_key, credentials=credentials)
+        _clients[key] = client
+        _stats["created"] += 1
+        return client
+
+
+def pool_stats() -> dict:
+    """Snapshot of the registry: live clients and created/reused counters."""
+    with _lock:
+        return {
+            "clients": len(_clients),
+            "created": _stats["created"],
+            "reused": _stats["reused"],
+            "endpoints": sorted({key[1] for key in _clients}),
+        }
+
+
+def close_all():
+    """Closes every pooled channel and resets the counters."""
+    with _lock:
+        for client in _clients.values():
+            client.transport.close()
+        _clients.clear()
+        _stats["created"] = 0
+        _stats["reused"] = 0
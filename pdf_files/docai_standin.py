@@ -0,0 +1,468 @@
+"""
+Local stand-in for the Document AI ProcessDocument RPC.
+
+Serves plaintext gRPC (and optionally the REST :process method) on localhost
+so the pipelines can be exercised and load-tested offline. Every entry point
+goes through docai_client, so pointing them at the stand-in only takes
+
+    DOCUMENT_AI_ENDPOINT=localhost:50051          # gRPC
+    DOCUMENT_AI_ENDPOINT=http://localhost:8080    # REST
+
+Responses are built from fixtures, picked deterministically from the PDF
+bytes. Latency distributions, quota errors, timeouts and unavailability can
+be injected, and real responses can be recorded once and replayed:
+
+    python docai_standin.py --port 50051 --latency 0.2 --distribution lognormal --jitter 0.5
+    python docai_standin.py --quota-error-rate 0.05 --timeout-rate 0.01
+    python docai_standin.py --record captured/ --upstream us-documentai.googleapis.com
+    python docai_standin.py --replay captured/
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+from google.cloud import documentai
+
+from docai_cache import DocumentCache, cache_key
+
+SERVICE_NAME = "google.cloud.documentai.v1.DocumentProcessorService"
+PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![s\w])")
+# The formats client.processor_path / processor_version_path produce
+PROCESSOR_PATH = re.compile(
+    r"^projects/(?P<project>[^/]+)/locations/(?P<location>[^/]+)/processors/(?P<processor>[^/]+)"
+    r"(?:/processorVersions/(?P<version>[^/]+))?$"
+)
+REST_PATH = re.compile(r"^/v1/(?P<name>.+):process$")
+DISTRIBUTIONS = ("constant", "uniform", "exponential", "lognormal")
+
+# Status codes the REST surface answers with, as Google's HTTP mapping does
+HTTP_STATUS = {
+    grpc.StatusCode.INVALID_ARGUMENT: 400,
+    grpc.StatusCode.NOT_FOUND: 404,
+    grpc.StatusCode.RESOURCE_EXHAUSTED: 429,
+    grpc.StatusCode.INTERNAL: 500,
+    grpc.StatusCode.UNAVAILABLE: 503,
+    grpc.StatusCode.DEADLINE_EXCEEDED: 504,
+}
+
+# A short CBC-style report, in the shape our custom extractor returns.
+FIXTURE_ENTITIES = [
+    ("TestTypeandResult", "WBC\n6.1"),
+    ("TestTypeandResult", "RBC\n4.05 Low"),
+    ("TestTypeandResult", "Hemoglobin\n12.9"),
+    ("TestTypeandResult", "Sodium\nLow\n133"),
+    ("TestTypeandResult", "Glucose\nNormal"),
+    ("dateoftest", "07/18/2024"),
+]
+
+
+class StandinError(Exception):
+    """An RPC failure, reported as a gRPC status or the matching HTTP error."""
+
+    def __init__(self, code: grpc.StatusCode, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def count_pages(content: bytes) -> int:
+    """Cheap page count from the raw PDF page objects (at least 1)."""
+    return max(1, len(PAGE_PATTERN.findall(content)))
+
+
+def load_fixtures(path: str):
+    """
+    Reads fixture reports from a JSON file shaped like
+
+        [{"entities": [["TestTypeandResult", "WBC\\n6.1"], ["dateoftest", "07/18/2024"]]}, ...]
+
+    :return: List of entity lists, one per report.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        reports = json.load(f)
+    return [[(type_, mention) for type_, mention in report["entities"]] for report in reports]
+
+
+def build_document(entities=FIXTURE_ENTITIES, pages: int = 1) -> documentai.Document:
+    """
+    Builds a Document whose text and entities come from (type, mention)
+    pairs, with text anchors and page anchors spread over the pages.
+    """
+    text_parts = []
+    doc_entities = []
+    offset = 0
+    for index, (type_, mention) in enumerate(entities):
+        page = index * pages // len(entities)
+        doc_entities.append(
+            documentai.Document.Entity(
+                type_=type_,
+                mention_text=mention,
+                confidence=0.99,
+                text_anchor={"text_segments": [{"start_index": offset, "end_index": offset + len(mention)}]},
+                page_anchor={"page_refs": [{"page": page}]},
+            )
+        )
+        text_parts.append(mention)
+        offset += len(mention) + 1
+
+    return documentai.Document(text="\n".join(text_parts) + "\n", entities=doc_entities)
+
+
+def apply_field_mask(document: documentai.Document, field_mask) -> documentai.Document:
+    """Keeps only the top-level Document fields named in the mask, like the real service."""
+    paths = [path.split(".")[0] for path in (field_mask.paths if field_mask else [])]
+    if not paths:
+        return document
+    source = documentai.Document.pb(document)
+    masked = type(source)()
+    for path in paths:
+        if path in source.DESCRIPTOR.fields_by_name:
+            value = getattr(source, path)
+            if isinstance(value, (str, bytes, int, float)):
+                setattr(masked, path, value)
+            elif hasattr(value, "extend"):
+                getattr(masked, path).extend(value)
+            else:
+                getattr(masked, path).CopyFrom(value)
+    return documentai.Document.wrap(masked)
+
+
+class StandinServicer:
+    """
+    Answers ProcessDocument with a fixture document after a delay of
+    latency + per_page_latency * pages + per_mb_latency * MB uploaded.
+
+    The base latency is drawn from `distribution`: "constant", "uniform"
+    (latency +/- jitter), "exponential" (mean latency) or "lognormal"
+    (median latency, sigma jitter). With capacity set, requests beyond that
+    many concurrent calls fail with RESOURCE_EXHAUSTED like a quota; the
+    *_rate settings inject the same errors at random.
+
+    In record mode every request is forwarded to `upstream` and the real
+    response stored under record_dir; in replay mode stored responses are
+    served instead of fixtures.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        per_page_latency: float = 0.0,
+        capacity: int = None,
+        per_mb_latency: float = 0.0,
+        distribution: str = "constant",
+        jitter: float = 0.0,
+        quota_error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        unavailable_rate: float = 0.0,
+        timeout_after: float = 0.0,
+        fixtures=None,
+        record_dir: str = None,
+        replay_dir: str = None,
+        upstream: str = None,
+        seed: int = None,
+    ):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{distribution}'; expected one of {DISTRIBUTIONS}")
+        if record_dir and replay_dir:
+            raise ValueError("Record and replay modes are mutually exclusive")
+
+        self.latency = latency
+        self.per_page_latency = per_page_latency
+        self.per_mb_latency = per_mb_latency
+        self.distribution = distribution
+        self.jitter = jitter
+        self.capacity = capacity
+        self.quota_error_rate = quota_error_rate
+        self.timeout_rate = timeout_rate
+        self.unavailable_rate = unavailable_rate
+        self.timeout_after = timeout_after
+        self.fixtures = fixtures or [FIXTURE_ENTITIES]
+        self.upstream = upstream
+        recordings_dir = record_dir or replay_dir
+        self.recordings = DocumentCache(recordings_dir, max_bytes=float("inf")) if recordings_dir else None
+        self.recording = bool(record_dir)
+
+        self.calls = 0
+        self.rejected = 0
+        self.injected = 0
+        self.replayed = 0
+        self.recorded = 0
+        self.in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            if self.distribution == "uniform":
+                value = self._random.uniform(self.latency - self.jitter, self.latency + self.jitter)
+            elif self.distribution == "exponential":
+                value = self._random.expovariate(1.0 / self.latency) if self.latency > 0 else 0.0
+            elif self.distribution == "lognormal":
+                value = self.latency * self._random.lognormvariate(0.0, self.jitter) if self.latency > 0 else 0.0
+            else:
+                value = self.latency
+        return max(0.0, value)
+
+    def _injected_error(self):
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.quota_error_rate:
+            return grpc.StatusCode.RESOURCE_EXHAUSTED
+        roll -= self.quota_error_rate
+        if roll < self.timeout_rate:
+            return grpc.StatusCode.DEADLINE_EXCEEDED
+        roll -= self.timeout_rate
+        if roll < self.unavailable_rate:
+            return grpc.StatusCode.UNAVAILABLE
+        return None
+
+    def _fixture_document(self, content: bytes, pages: int) -> documentai.Document:
+        # Same bytes, same fixture: results are reproducible across runs
+        index = int.from_bytes(hashlib.sha256(content).digest()[:4], "big") % len(self.fixtures)
+        return build_document(self.fixtures[index], pages=pages)
+
+    def _forward(self, request) -> documentai.Document:
+        import docai_client
+
+        location = PROCESSOR_PATH.match(request.name).group("location")
+        client = docai_client.get_client(location, endpoint=self.upstream or docai_client.default_endpoint(location))
+        return client.process_document(request=request).document
+
+    def handle(self, request, time_remaining=None) -> documentai.ProcessResponse:
+        """
+        Shared gRPC/REST logic.
+
+        :raises StandinError: For quota, timeout, unavailable, bad-name and replay-miss errors.
+        """
+        match = PROCESSOR_PATH.match(request.name)
+        if not match:
+            raise StandinError(grpc.StatusCode.INVALID_ARGUMENT, f"Invalid processor name '{request.name}'")
+
+        with self._lock:
+            self.calls += 1
+            over_quota = self.capacity is not None and self.in_flight >= self.capacity
+            if over_quota:
+                self.rejected += 1
+            else:
+                self.in_flight += 1
+        if over_quota:
+            raise StandinError(grpc.StatusCode.RESOURCE_EXHAUSTED, "Quota exceeded for online processing requests")
+
+        try:
+            content = request.raw_document.content
+            pages = count_pages(content)
+            error = self._injected_error()
+            if error is not None:
+                with self._lock:
+                    self.injected += 1
+                if error == grpc.StatusCode.DEADLINE_EXCEEDED:
+                    # Hang until the client's deadline passes, or timeout_after if that is sooner
+                    hold = self.timeout_after
+                    remaining = time_remaining() if time_remaining else None
+                    if remaining is not None:
+                        hold = min(hold, remaining) if hold else remaining
+                    time.sleep(hold)
+                raise StandinError(error, f"Injected {error.name} from the Document AI stand-in")
+
+            key = cache_key(
+                content,
+                request.name,
+                field_mask=",".join(request.field_mask.paths) if request.field_mask else None,
+            )
+            if self.recording:
+                document = self._forward(request)
+                self.recordings.put(key, document)
+                with self._lock:
+                    self.recorded += 1
+                return documentai.ProcessResponse(document=document)
+
+            if self.recordings is not None:
+                document = self.recordings.get(key)
+                if document is None:
+                    raise StandinError(grpc.StatusCode.NOT_FOUND, "No recorded response for this document")
+                with self._lock:
+                    self.replayed += 1
+            else:
+                document = apply_field_mask(self._fixture_document(content, pages), request.field_mask)
+
+            delay = self.sample_latency() + self.per_page_latency * pages + self.per_mb_latency * len(content) / 1e6
+            if delay:
+                time.sleep(delay)
+            return documentai.ProcessResponse(document=document)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def process_document(self, request, context):
+        """gRPC handler."""
+        try:
+            return self.handle(request, time_remaining=context.time_remaining)
+        except StandinError as e:
+            context.abort(e.code, e.message)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "injected": self.injected,
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "in_flight": self.in_flight,
+            }
+
+
+def _rest_handler(servicer: StandinServicer):
+    class ProcessHandler(BaseHTTPRequestHandler):
+        """POST /v1/{name}:process with a JSON ProcessRequest body."""
+
+        def _reply(self, status: int, body: str):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            match = REST_PATH.match(self.path.split("?", 1)[0])
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("utf-8") if length else "{}"
+            if not match:
+                self._reply(404, json.dumps({"error": {"code": 404, "message": f"Unknown path {self.path}"}}))
+                return
+
+            try:
+                request = documentai.ProcessRequest.from_json(body, ignore_unknown_fields=True)
+                request.name = match.group("name")
+                response = servicer.handle(request)
+            except StandinError as e:
+                status = HTTP_STATUS.get(e.code, 500)
+                error = {"code": status, "message": e.message, "status": e.code.name}
+                self._reply(status, json.dumps({"error": error}))
+                return
+            self._reply(200, documentai.ProcessResponse.to_json(response))
+
+        def log_message(self, format, *args):
+            pass
+
+    return ProcessHandler
+
+
+def serve(
+    port: int = 0,
+    latency: float = 0.0,
+    per_page_latency: float = 0.0,
+    capacity: int = None,
+    per_mb_latency: float = 0.0,
+    max_workers: int = 32,
+    rest_port: int = None,
+    **options,
+):
+    """
+    Starts the stand-in in a background thread pool. Extra keyword options
+    (distribution, jitter, *_rate, fixtures, record_dir, replay_dir, ...) go
+    to StandinServicer. With rest_port set (0 picks a free port), the REST
+    surface is served too and exposed as server.rest_port.
+
+    :return: (server, port, servicer). Call server.stop(None) when done.
+    """
+    servicer = StandinServicer(
+        latency=latency,
+        per_page_latency=per_page_latency,
+        capacity=capacity,
+        per_mb_latency=per_mb_latency,
+        **options,
+    )
+    handler = grpc.method_handlers_generic_handler(
+        SERVICE_NAME,
+        {
+            "ProcessDocument": grpc.unary_unary_rpc_method_handler(
+                servicer.process_document,
+                request_deserializer=documentai.ProcessRequest.deserialize,
+                response_serializer=documentai.ProcessResponse.serialize,
+            )
+        },
+    )
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers),
+        options=[("grpc.max_receive_message_length", 64 * 1024 * 1024)],
+    )
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port(f"localhost:{port}")
+    server.start()
+
+    server.rest_port = None
+    if rest_port is not None:
+        http_server = ThreadingHTTPServer(("localhost", rest_port), _rest_handler(servicer))
+        http_server.daemon_threads = True
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        server.rest_port = http_server.server_address[1]
+
+        grpc_stop = server.stop
+
+        def stop(grace):
+            http_server.shutdown()
+            http_server.server_close()
+            return grpc_stop(grace)
+
+        server.stop = stop
+
+    return server, port, servicer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Document AI stand-in")
+    parser.add_argument("--port", type=int, default=50051, help="gRPC port")
+    parser.add_argument("--rest-port", type=int, default=None, help="Also serve REST on this port")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep per request")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="constant")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform spread (s) or lognormal sigma")
+    parser.add_argument("--per-page-latency", type=float, default=0.0, help="Extra seconds per PDF page")
+    parser.add_argument("--per-mb-latency", type=float, default=0.0, help="Extra seconds per MB uploaded")
+    parser.add_argument("--capacity", type=int, default=None, help="Concurrent calls before RESOURCE_EXHAUSTED")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--unavailable-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-after", type=float, default=30.0, help="How long an injected timeout hangs")
+    parser.add_argument("--fixtures", default=None, help="JSON file of fixture reports")
+    parser.add_argument("--record", default=None, help="Forward to --upstream and store responses here")
+    parser.add_argument("--replay", default=None, help="Serve responses stored by --record")
+    parser.add_argument("--upstream", default=None, help="Real endpoint for --record (default: regional)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server, port, _ = serve(
+        port=args.port,
+        rest_port=args.rest_port,
+        latency=args.latency,
+        per_page_latency=args.per_page_latency,
+        per_mb_latency=args.per_mb_latency,
+        capacity=args.capacity,
+        distribution=args.distribution,
+        jitter=args.jitter,
+        quota_error_rate=args.quota_error_rate,
+        timeout_rate=args.timeout_rate,
+        unavailable_rate=args.unavailable_rate,
+        timeout_after=args.timeout_after,
+        fixtures=load_fixtures(args.fixtures) if args.fixtures else None,
+        record_dir=args.record,
+        replay_dir=args.replay,
+        upstream=args.upstream,
+        seed=args.seed,
+    )
+    print(f"Document AI stand-in listening on localhost:{port} (gRPC)")
+    if server.rest_port:
+        print(f"REST surface on http://localhost:{server.rest_port}")
+    server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from typing import Optional
 from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
 
 def process_document_sample(
     project_id: str,
@@ -12,9 +12,7 @@ def process_document_sample(
     processor_version_id: Optional[str] = None,
     target_entities: Optional[list] = None,  # Add this parameter
 ) -> None:
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    client = get_client(location)
 
     # Set up the full processor path
     name = client.processor_path(project_id, location, processor_id)
@@ -0,0 +1,139 @@
+"""
+Per-page routing between local text extraction and Document AI.
+
+Many Labcorp/Inova PDFs carry a real text layer. Pages with enough
+extractable text are parsed locally with PyMuPDF; only image-only (scanned)
+pages are sent to Document AI. Both paths produce EntityRecords in the
+same "TestTypeandResult" / "dateoftest" shape, merged back in page order,
+so parse_output cannot tell them apart.
+"""
+import os
+import re
+from typing import Callable, List, Optional
+
+import fitz  # PyMuPDF
+
+from docai_entities import EntityRecord, extract_entities
+from pdf_chunker import pdf_bytes
+
+# Pages with fewer extractable characters than this are treated as scans
+MIN_TEXT_CHARS = int(os.environ.get("DOCAI_MIN_TEXT_CHARS", 200))
+
+DATE_PATTERN = re.compile(
+    r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.? \d{1,2}, \d{4}|\d{1,2}/\d{1,2}/\d{4}"
+)
+VALUE_PATTERN = re.compile(r"^[<>]?\d+(?:\.\d+)?(?:\s+(?:High|Low))?$")
+FLAG_PATTERN = re.compile(r"^(?:High|Low)$")
+# Column headings and status words that sit between a test name and its value
+LABEL_LINES = {"value", "new", "result", "results", "final", "flag", "units"}
+
+
+def classify_pages(doc, min_chars: int = MIN_TEXT_CHARS):
+    """
+    :return: (page texts, indexes of pages with a usable text layer,
+              indexes of image-only pages)
+    """
+    texts = [page.get_text() for page in doc]
+    text_pages = [i for i, text in enumerate(texts) if len(text.strip()) >= min_chars]
+    image_pages = [i for i, text in enumerate(texts) if len(text.strip()) < min_chars]
+    return texts, text_pages, image_pages
+
+
+def _is_test_name(line: str) -> bool:
+    return (
+        bool(re.search(r"[A-Za-z]", line))
+        and ":" not in line
+        and len(line) <= 60
+        and not line.lower().startswith("http")
+        and line.lower() not in LABEL_LINES
+        and not VALUE_PATTERN.match(line)
+    )
+
+
+def extract_text_entities(text: str, page: int) -> List[EntityRecord]:
+    """
+    Finds test results and the collection date in a page's text layer.
+
+    A test name line opens a block; the last plain value in the block (chart
+    axis labels come first in MyChart exports) plus any High/Low flag
+    becomes the result.
+    """
+    records = []
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    name, value, flag = None, None, None
+
+    def close_block():
+        if name and value:
+            result = f"{value} {flag}" if flag and not value.endswith(flag) else value
+            records.append(EntityRecord("TestTypeandResult", f"{name}\n{result}", 1.0, page))
+
+    for line in lines:
+        if VALUE_PATTERN.match(line):
+            value = line
+        elif FLAG_PATTERN.match(line):
+            flag = line
+        elif _is_test_name(line):
+            close_block()
+            name, value, flag = line, None, None
+    close_block()
+
+    # Like the Document AI extractor, the date entity follows the results
+    collection_lines = [line for line in lines if "collect" in line.lower()]
+    for line in collection_lines + lines:
+        match = DATE_PATTERN.search(line)
+        if match:
+            records.append(EntityRecord("dateoftest", match.group(0), 1.0, page))
+            break
+
+    return records
+
+
+def _select_pages(doc, pages: List[int]) -> bytes:
+    with fitz.open() as part:
+        for index in pages:
+            part.insert_pdf(doc, from_page=index, to_page=index)
+        return pdf_bytes(part)
+
+
+def route_document(
+    content: bytes,
+    process_pdf: Callable[[bytes], object],
+    target_entities: Optional[List[str]] = None,
+    min_chars: int = MIN_TEXT_CHARS,
+    label: str = "document",
+) -> List[EntityRecord]:
+    """
+    Extracts entities from a PDF, parsing text pages locally and sending
+    only image-only pages (as one smaller PDF) to process_pdf, which must
+    return a Document AI Document for the bytes it is given.
+    """
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        texts, text_pages, image_pages = classify_pages(doc, min_chars)
+        print(
+            f"Routing {label}: {len(text_pages)} of {len(texts)} pages parsed locally, "
+            f"{len(image_pages)} sent to Document AI"
+        )
+
+        if not text_pages:
+            return extract_entities(process_pdf(content), target_entities)
+
+        scanned_bytes = _select_pages(doc, image_pages) if image_pages else None
+
+    records = []
+    for index in text_pages:
+        records.extend(extract_text_entities(texts[index], index))
+
+    if scanned_bytes:
+        remote = extract_entities(process_pdf(scanned_bytes), target_entities)
+
+        def original_page(page):
+            # Page anchors refer to the reduced PDF; map them back to the original pages
+            return image_pages[page] if page is not None and page < len(image_pages) else None
+
+        records.extend(record._replace(page=original_page(record.page)) for record in remote)
+
+    if target_entities:
+        records = [record for record in records if record.type_ in target_entities]
+
+    # Stable sort keeps entity order within each page
+    return sorted(records, key=lambda record: record.page if record.page is not None else len(texts))
@@ -0,0 +1,467 @@
+"""
+Background processing of uploads, with job state kept in SQLite.
+
+/upload only saves the files and enqueues a job; worker threads pick jobs
+up one at a time each, and every file's state, timings and output are
+recorded as it goes through the pipeline:
+
+    queue = get_job_queue(handler, "processed/jobs.db", workers=2)
+    job_id = queue.submit([("uploads/<id>/a.pdf", "a.pdf")], mode="stream")
+    queue.store.get(job_id)   # {"state": "running", "mode": "stream", "files": [...], ...}
+
+Jobs go queued -> running -> done / failed, and each file queued ->
+processing -> done / failed. mode is the handler's to define and is kept
+with the job, so a job runs (and is read back) the way it was submitted.
+
+handler(job_id, files) runs one job over its (path, name) files, reports
+per-file progress with store.update_file and returns the job's result
+path (None when nothing came out of it).
+
+Several processes can share one store. A worker claims a queued job by
+stamping it with its queue's owner id, and the queue renews a heartbeat
+on its running jobs every lease / 4 seconds. Queued jobs, and running
+jobs whose heartbeat is older than lease (their process stopped), are
+queued again when a queue starts, from their saved uploads; running
+queues also take over stale jobs as they find them.
+
+queue.events carries what happens to each job as it happens, for clients
+that follow a job over one long-lived connection instead of polling:
+
+    for event_id, event, data in queue.events.follow(job_id):
+        ...   # ("job", {"state": "running"}), ("file", {...}), ("rows", {...})
+
+Events are only seen by the process that runs the job. queue.follow also
+ends when another process sharing the store finishes it: it checks the
+store whenever no event came for a while, and sends the stored outcome.
+"""
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Iterator, List, Optional, Tuple
+
+DEFAULT_WORKERS = 2
+# Seconds without a heartbeat after which a running job counts as abandoned
+DEFAULT_LEASE = 30.0
+# Finished jobs whose events are kept for late or reconnecting followers
+DEFAULT_EVENT_JOBS = 32
+FILE_STATES = ["queued", "processing", "done", "failed"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    mode TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner TEXT,  -- the queue running it
+    heartbeat REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL REFERENCES jobs (id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    started REAL,
+    finished REAL,
+    rows INTEGER,
+    output TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+"""
+FILE_FIELDS = ["rows", "output", "error"]
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def new_owner_id() -> str:
+    """Identifies one queue (process) among those sharing a store: host, pid and a random part."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _timestamp(seconds: Optional[float]) -> Optional[str]:
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec="milliseconds")
+
+
+def _timings(started: Optional[float], finished: Optional[float]) -> dict:
+    """ISO start / finish times plus elapsed seconds (so far, while still running)."""
+    elapsed = None
+    if started is not None:
+        elapsed = round((finished or time.time()) - started, 3)
+    return {"started": _timestamp(started), "finished": _timestamp(finished), "seconds": elapsed}
+
+
+class JobStore:
+    """Jobs and their files in one SQLite file, shared by the app's threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def create(self, job_id: str, files: List[Tuple[str, str]], mode: Optional[str] = None):
+        """Records a queued job over (path, name) files."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, state, mode, created) VALUES (?, 'queued', ?, ?)", (job_id, mode, time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO job_files (job_id, position, name, path, state) VALUES (?, ?, ?, ?, 'queued')",
+                [(job_id, position, name, path) for position, (path, name) in enumerate(files)],
+            )
+
+    def files(self, job_id: str) -> List[Tuple[str, str]]:
+        """A job's (path, name) files, in upload order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, name FROM job_files WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        """Starts a queued job for owner; False if it is not queued (another queue got it first)."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = 'running', started = ?, owner = ?, heartbeat = ? WHERE id = ? AND state = 'queued'",
+                (now, owner, now, job_id),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, owner: str):
+        """Renews the lease on owner's running jobs."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND state = 'running'", (time.time(), owner)
+            )
+
+    def finish_job(self, job_id: str, result: Optional[str] = None, error: Optional[str] = None,
+                   owner: Optional[str] = None) -> bool:
+        """
+        Marks a job done with its result path, or failed with error. With
+        owner, only while that owner still holds it; returns whether it did.
+        """
+        state = "failed" if error else "done"
+        sql, params = "UPDATE jobs SET state = ?, finished = ?, result = ?, error = ? WHERE id = ?", [
+            state, time.time(), result, error, job_id
+        ]
+        if owner is not None:
+            sql += " AND owner = ? AND state = 'running'"
+            params.append(owner)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(sql, params)
+        return cursor.rowcount == 1
+
+    def update_file(self, job_id: str, position: int, state: str, **fields):
+        """
+        Moves one file to state ("processing" stamps its start, "done" and
+        "failed" its finish); fields may set rows, output and error.
+        """
+        if state not in FILE_STATES:
+            raise ValueError(f"Unknown file state '{state}'; expected one of {FILE_STATES}")
+        unknown = set(fields) - set(FILE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown file fields: {', '.join(sorted(unknown))}")
+        assignments, params = ["state = ?"], [state]
+        if state == "processing":
+            assignments.append("started = ?")
+            params.append(time.time())
+        elif state in ("done", "failed"):
+            assignments.append("finished = ?")
+            params.append(time.time())
+        for field, value in fields.items():
+            assignments.append(f"{field} = ?")
+            params.append(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE job_files SET {', '.join(assignments)} WHERE job_id = ? AND position = ?",
+                params + [job_id, position],
+            )
+
+    def requeue_stale(self, lease: float) -> List[str]:
+        """
+        Puts running jobs without a heartbeat for lease seconds back to
+        queued, with their files' progress cleared; returns their ids.
+        """
+        expired = time.time() - lease
+        with self._lock, self._conn:
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE state = 'running' AND (heartbeat IS NULL OR heartbeat < ?) ORDER BY created",
+                (expired,),
+            )]
+            for job_id in stale:
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'queued', started = NULL, finished = NULL, owner = NULL, heartbeat = NULL,"
+                    " result = NULL, error = NULL WHERE id = ?", (job_id,),
+                )
+                self._conn.execute(
+                    "UPDATE job_files SET state = 'queued', started = NULL, finished = NULL, rows = NULL,"
+                    " output = NULL, error = NULL WHERE job_id = ?", (job_id,),
+                )
+        return stale
+
+    def queued(self) -> List[str]:
+        """Ids of queued jobs, oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY created").fetchall()
+        return [row[0] for row in rows]
+
+    def unfinished(self) -> List[str]:
+        """Ids of queued and running jobs, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE state IN ('queued', 'running') ORDER BY created"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def latest(self, state: str = "done") -> Optional[str]:
+        """Id of the most recently finished (or created) job in state."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE state = ? ORDER BY COALESCE(finished, created) DESC LIMIT 1", (state,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """A job's state, mode, timings, result and files, or None for an unknown id."""
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT state, mode, created, started, finished, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            files = self._conn.execute(
+                "SELECT name, state, started, finished, rows, output, error FROM job_files"
+                " WHERE job_id = ? ORDER BY position", (job_id,),
+            ).fetchall()
+        state, mode, created, started, finished, result, error = job
+        counts = {file_state: 0 for file_state in FILE_STATES}
+        for file in files:
+            counts[file[1]] += 1
+        return {
+            "id": job_id,
+            "state": state,
+            "mode": mode,
+            "created": _timestamp(created),
+            **_timings(started, finished),
+            "result": result,
+            "error": error,
+            "counts": counts,
+            "files": [
+                {"name": name, "state": file_state, **_timings(file_started, file_finished),
+                 "rows": rows, "output": output, "error": file_error}
+                for name, file_state, file_started, file_finished, rows, output, file_error in files
+            ],
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobEvents:
+    """
+    Events of recent jobs in memory, numbered per job from 1. A job's
+    history stays until DEFAULT_EVENT_JOBS newer jobs have finished.
+    """
+
+    def __init__(self, max_jobs: int = DEFAULT_EVENT_JOBS):
+        self.max_jobs = max_jobs
+        self._events: "OrderedDict[str, list]" = OrderedDict()
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._condition = threading.Condition()
+
+    def publish(self, job_id: str, event: str, data: dict, final: bool = False):
+        """Adds an event to a job's history and wakes its followers; final marks the job's last one."""
+        with self._condition:
+            events = self._events.setdefault(job_id, [])
+            events.append((len(events) + 1, event, data))
+            if final:
+                self._finished[job_id] = None
+                while len(self._finished) > self.max_jobs:
+                    oldest, _ = self._finished.popitem(last=False)
+                    self._events.pop(oldest, None)
+            self._condition.notify_all()
+
+    def known(self, job_id: str) -> bool:
+        """Whether the job's history is still here (it is lost on restart and for old jobs)."""
+        with self._condition:
+            return job_id in self._events
+
+    def last(self, job_id: str) -> Optional[tuple]:
+        """The job's latest (id, event, data), or None."""
+        with self._condition:
+            events = self._events.get(job_id)
+            return events[-1] if events else None
+
+    def follow(self, job_id: str, after: int = 0, timeout: float = 15.0) -> Iterator[Optional[tuple]]:
+        """
+        Yields the job's (id, event, data) after event id after, then each
+        new one as it is published, until its final event. Yields None
+        whenever timeout seconds pass without one (time for a keep-alive).
+        """
+        while True:
+            with self._condition:
+                if len(self._events.get(job_id, ())) <= after and job_id not in self._finished:
+                    self._condition.wait(timeout)
+                events = self._events.get(job_id, [])
+                new = events[after:]
+                finished = job_id in self._finished or (after and job_id not in self._events)
+            if not new and not finished:
+                yield None
+            for item in new:
+                yield item
+                after = item[0]
+            if finished:
+                return
+
+
+class JobQueue:
+    """Worker threads running stored jobs through handler; their progress is published on events."""
+
+    def __init__(self, store: JobStore, handler: Callable, workers: int = DEFAULT_WORKERS,
+                 lease: float = DEFAULT_LEASE):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.lease = lease
+        self.owner = new_owner_id()
+        self.events = JobEvents()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """
+        Queues the store's queued jobs and its stale running ones, then
+        starts the workers and the heartbeat (once). Jobs another live
+        queue is running are left to it.
+        """
+        with self._start_lock:
+            if self._threads:
+                return
+            for job_id in self.store.requeue_stale(self.lease):
+                self.events.publish(job_id, "job", {"state": "queued"})
+            for job_id in self.store.queued():
+                self._queue.put(job_id)
+            for target in [self._work] * self.workers + [self._beat]:
+                thread = threading.Thread(target=target, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, files: List[Tuple[str, str]], job_id: Optional[str] = None, mode: Optional[str] = None) -> str:
+        """Stores a job over (path, name) files and queues it; returns its id."""
+        job_id = job_id or new_job_id()
+        self.store.create(job_id, files, mode)
+        self.events.publish(job_id, "job", {"state": "queued"})
+        self._queue.put(job_id)
+        return job_id
+
+    def pending(self) -> int:
+        """Jobs waiting for a worker."""
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            self._run(self._queue.get())
+
+    def _beat(self):
+        """Renews this queue's leases, and takes over jobs whose queue stopped renewing theirs."""
+        while True:
+            time.sleep(self.lease / 4)
+            self.store.heartbeat(self.owner)
+            for job_id in self.store.requeue_stale(self.lease):
+                self.events.publish(job_id, "job", {"state": "queued"})
+                self._queue.put(job_id)
+
+    def outcome(self, job_id: str) -> Optional[dict]:
+        """The stored job's last "job" event data once it is done or failed, else None."""
+        job = self.store.get(job_id)
+        if job is None or job["state"] not in ("done", "failed"):
+            return None
+        return {"state": job["state"], "result": job["result"], "error": job["error"]}
+
+    def follow(self, job_id: str, after: int = 0, timeout: float = 15.0) -> Iterator[Optional[tuple]]:
+        """
+        events.follow, ending as well when another queue sharing the store
+        finishes the job (it ran it, or took it over from this one): on
+        every keep-alive the store is checked, and its outcome is sent as a
+        last "job" event without an id.
+        """
+        for item in self.events.follow(job_id, after, timeout):
+            if item is None:
+                outcome = self.outcome(job_id)
+                if outcome is not None:
+                    yield None, "job", outcome
+                    return
+            yield item
+        last = self.events.last(job_id)
+        if last is not None and last[1] == "job" and last[2]["state"] in ("done", "failed"):
+            return
+        # The history here stops short of the outcome (the job moved, or the history was dropped)
+        while True:
+            outcome = self.outcome(job_id)
+            if outcome is not None:
+                yield None, "job", outcome
+                return
+            time.sleep(timeout)
+            yield None
+
+    def _moved(self, job_id: str):
+        """Ends the job's history here; another queue runs it, and follow() picks its outcome up from the store."""
+        self.events.publish(job_id, "job", {"state": "moved"}, final=True)
+
+    def _run(self, job_id: str):
+        if not self.store.claim(job_id, self.owner):
+            # Another queue sharing the store got to it first
+            self._moved(job_id)
+            return
+        self.events.publish(job_id, "job", {"state": "running"})
+        try:
+            result = self.handler(job_id, self.store.files(job_id))
+            error = None if result else "No rows parsed; no CSV generated."
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            result, error = None, str(e) or type(e).__name__
+        if not self.store.finish_job(job_id, result=result, error=error, owner=self.owner):
+            print(f"Job {job_id} was taken over by another queue; its outcome here is dropped")
+            self._moved(job_id)
+            return
+        self.events.publish(
+            job_id, "job", {"state": "failed" if error else "done", "result": result, "error": error}, final=True
+        )
+
+
+_default_queue = None
+_default_lock = threading.Lock()
+
+
+def get_job_queue(handler: Optional[Callable] = None, path: Optional[str] = None,
+                  workers: int = DEFAULT_WORKERS, lease: float = DEFAULT_LEASE) -> JobQueue:
+    """Process-wide job queue; created and started on first use, which needs handler and path."""
+    global _default_queue
+    with _default_lock:
+        if _default_queue is None:
+            if handler is None or path is None:
+                raise ValueError("The job queue needs a handler and a store path on first use")
+            _default_queue = JobQueue(JobStore(path), handler, workers, lease)
+            _default_queue.start()
+        return _default_queue
@@ -0,0 +1,203 @@
+"""
+Single-pass rules engine for Document AI lab result output.
+
+Every entry point parses through here. Each line is looked at once, by a
+small state machine driven by a compiled rule set (see lab_rules.py), so
+input can be streamed from a file or straight from the entity records.
+
+The output is a list of (test_type, result, date) tuples. With the default
+rules:
+
+- the date is the last "dateoftest:" value and applies to every row
+- "12.3 High" inside the test type line is pulled out as the result
+- after a test type line, the first line that starts with High/Low wins:
+  as is if it has a digit, otherwise joined with a numeric line right
+  after it; failing that, the first line that starts with a number
+  (optionally < or >) or "Normal"
+- the search stops at the next test type or date line
+
+test_ranges() reads the "Normal Range:" line some reports print in a test
+mention, one per parsed row, for reference_ranges to flag results with.
+"""
+import itertools
+import os
+import re
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from docai_entities import NEWLINE, EntityRecord, entity_lines
+from lab_rules import DEFAULT_RULE_SET, VENDOR_RULES
+from reference_ranges import RANGE_LABEL, join_broken_ranges
+
+TEST_PREFIX = "TestTypeandResult:"
+DATE_PREFIX = "dateoftest:"
+DIGIT = re.compile(r"\d")
+# "Normal Range:" as MyChart and Labcorp print it
+RANGE_LINE = re.compile(r"(?i)normal range:")
+
+# Parser states
+IDLE, SEARCHING, AFTER_FLAG = range(3)
+
+
+class RuleSet(NamedTuple):
+    """A rule set from lab_rules.py with its patterns compiled."""
+
+    name: str
+    description: str
+    value: re.Pattern
+    flag: re.Pattern
+    number: re.Pattern
+    embedded: re.Pattern
+    hints: Optional[Tuple[str, ...]]
+    skip: Optional[re.Pattern]
+    take_last: bool
+
+
+def compile_rules(name: str, spec: dict) -> RuleSet:
+    return RuleSet(
+        name=name,
+        description=spec.get("description", ""),
+        value=re.compile(spec["value"]),
+        flag=re.compile(spec["flag"]),
+        number=re.compile(spec["number"]),
+        embedded=re.compile(spec["embedded"]),
+        hints=tuple(spec["hints"]) if spec.get("hints") else None,
+        skip=re.compile(spec["skip"]) if spec.get("skip") else None,
+        take_last=bool(spec.get("take_last", False)),
+    )
+
+
+RULE_SETS = {name: compile_rules(name, spec) for name, spec in VENDOR_RULES.items()}
+
+
+def get_rules(rules: Union[str, RuleSet, None] = None) -> RuleSet:
+    """Looks up a rule set by name; None means $DOCAI_LAB_RULES or the default."""
+    if isinstance(rules, RuleSet):
+        return rules
+    name = rules or os.environ.get("DOCAI_LAB_RULES", DEFAULT_RULE_SET)
+    if name not in RULE_SETS:
+        raise ValueError(f"Unknown lab rule set '{name}'; expected one of {sorted(RULE_SETS)}")
+    return RULE_SETS[name]
+
+
+def parse_lines(lines: Iterable[str], rules: Union[str, RuleSet, None] = None) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Parses "type: mention" lines from any iterable, in one pass.
+
+    At most one test is open at a time; finished (test_type, result) pairs
+    are kept until the end, when the date is known.
+    """
+    rules = get_rules(rules)
+    rows = []
+    date = None
+    state = IDLE
+    test_type, result, flag = None, "", None
+
+    stop_prefixes = (TEST_PREFIX, DATE_PREFIX)
+    match_number, match_flag, match_value = rules.number.match, rules.flag.match, rules.value.match
+    search_embedded, hints = rules.embedded.search, rules.hints
+    match_skip = rules.skip.match if rules.skip else None
+    take_last = rules.take_last
+    search_digit = DIGIT.search
+    append = rows.append
+
+    for line in lines:
+        if state:
+            stripped = line.strip()
+            if state == AFTER_FLAG:
+                # A bare High/Low takes the number on the following line, if there is one
+                if match_number(stripped):
+                    result = f"{flag} {stripped}"
+                    stripped = ""  # consumed
+                elif take_last and result:
+                    # Flags printed after the value belong to it
+                    result = f"{result} {flag}"
+                if take_last:
+                    state = SEARCHING
+                else:
+                    append((test_type, result))
+                    state = IDLE
+
+            if state == SEARCHING:
+                if stripped.startswith(stop_prefixes):
+                    append((test_type, result))
+                    state = IDLE
+                elif match_skip is not None and match_skip(stripped):
+                    pass
+                elif match_flag(stripped):
+                    if search_digit(stripped):
+                        result = stripped
+                        if not take_last:
+                            append((test_type, result))
+                            state = IDLE
+                    else:
+                        flag = stripped
+                        state = AFTER_FLAG
+                elif match_value(stripped):
+                    result = stripped
+                    if not take_last:
+                        append((test_type, result))
+                        state = IDLE
+
+        if line.startswith(DATE_PREFIX):
+            date = line.split(":", 1)[1].strip()
+        elif line.startswith(TEST_PREFIX):
+            test_type = line.split(":", 1)[1].strip()
+            result = ""
+            # The unanchored search is the costliest step; hints skip it for most names
+            if hints is None or any(hint in test_type for hint in hints):
+                embedded = search_embedded(test_type)
+                if embedded:
+                    result = embedded.group(0)
+                    test_type = test_type.replace(result, "").strip()
+            state = SEARCHING
+
+    if state == AFTER_FLAG and take_last and result:
+        result = f"{result} {flag}"
+    if state:
+        append((test_type, result))
+    return [(test_type, result, date) for test_type, result in rows]
+
+
+def parse_entities(records: Iterable[EntityRecord], rules=None) -> List[Tuple[str, str, Optional[str]]]:
+    return parse_lines(entity_lines(records), rules)
+
+
+def parse_file(file_path: str, rules=None) -> List[Tuple[str, str, Optional[str]]]:
+    """Streams a text dump written by write_debug_output without loading it whole."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        return parse_lines(f, rules)
+
+
+def test_ranges(records: Iterable[EntityRecord]) -> List[Optional[str]]:
+    """
+    The reference range printed in each test mention ("136 - 145 mmol/L"),
+    None where there is none. parse_output gives one row per test mention,
+    so the list lines up with its rows.
+    """
+    ranges = []
+    for record in records:
+        if f"{record.type_}:" != TEST_PREFIX:
+            continue
+        lines = join_broken_ranges(NEWLINE.split(RANGE_LINE.sub(RANGE_LABEL, record.mention_text)))
+        printed = next((line.split(RANGE_LABEL, 1)[1].strip() for line in lines if RANGE_LABEL in line), None)
+        ranges.append(printed or None)
+    return ranges
+
+
+def parse_output(source, rules=None) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Parses a text dump path, an iterable of EntityRecords or an iterable
+    of already split lines, with the named rule set (default: $DOCAI_LAB_RULES
+    or "default").
+    """
+    if isinstance(source, str):
+        return parse_file(source, rules)
+
+    items = iter(source)
+    first = next(items, None)
+    if first is None:
+        return []
+    items = itertools.chain([first], items)
+    if isinstance(first, str):
+        return parse_lines(items, rules)
+    return parse_entities(items, rules)
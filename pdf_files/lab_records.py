@@ -0,0 +1,197 @@
+"""
+Typed, compact lab result records.
+
+convert_to_csv output keeps a result like "133 mmol/L Low" as one opaque
+string and the test date in the column header. Here every result is one
+row with typed columns:
+
+    DocId       category   the document (per-file CSV name) it came from
+    TestType    category
+    Result      category   the raw result text, kept for the CSV layouts
+    Date        datetime64 NaT when the report had no (readable) date
+    DateLabel   category   the date as printed, used as the CSV column header
+    Comparator  category   "<" / ">" or missing
+    Value       float32
+    Unit        category
+    Flag        category   High / Low / H / L / Normal or missing
+
+Test names, units and flags repeat across thousands of reports, so the
+categorical columns cost a byte or two per row instead of a Python string,
+and filters like abnormal() run on integer codes.
+"""
+import csv
+import os
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from batch_parser import split_results
+
+RECORD_COLUMNS = ["DocId", "TestType", "Result", "Date", "DateLabel", "Comparator", "Value", "Unit", "Flag"]
+CATEGORY_COLUMNS = ["DocId", "TestType", "Result", "DateLabel", "Comparator", "Unit", "Flag"]
+ABNORMAL_FLAGS = ["High", "Low", "H", "L"]
+# Header of the result column in a per-file CSV when the report had no date
+NO_DATE_LABEL = "Result"
+
+
+def parse_dates(labels: pd.Series) -> np.ndarray:
+    """datetime64 values for date strings; each distinct string is parsed once."""
+    codes, uniques = pd.factorize(labels)
+    if not len(uniques):
+        return np.full(len(labels), np.datetime64("NaT"), dtype="datetime64[ns]")
+    parsed = pd.to_datetime(pd.Index(uniques, dtype=object), format="mixed", errors="coerce").to_numpy()
+    # factorize gives -1 for missing labels
+    return np.append(parsed, np.datetime64("NaT"))[codes]
+
+
+def to_records(long: pd.DataFrame) -> pd.DataFrame:
+    """
+    Typed records from a long frame with DocId, TestType, Result and Date
+    (as from batch_parser.parse_batch). Comparator, Value, Unit and Flag are
+    split out of Result unless the frame already has them.
+    """
+    if long.empty:
+        return empty_records()
+    long = long.reset_index(drop=True)
+    if "Value" not in long:
+        long = pd.concat([long, split_results(long["Result"])], axis=1)
+
+    records = pd.DataFrame(
+        {
+            "DocId": long["DocId"],
+            "TestType": long["TestType"],
+            "Result": long["Result"],
+            "Date": parse_dates(long["Date"]),
+            "DateLabel": long["Date"],
+            "Comparator": long["Comparator"],
+            "Value": pd.to_numeric(long["Value"], errors="coerce").astype("float32"),
+            "Unit": long["Unit"],
+            "Flag": long["Flag"],
+        }
+    )
+    return records.astype({column: "category" for column in CATEGORY_COLUMNS})
+
+
+def empty_records() -> pd.DataFrame:
+    records = pd.DataFrame({column: pd.Series(dtype=object) for column in RECORD_COLUMNS})
+    return records.astype(
+        {**{column: "category" for column in CATEGORY_COLUMNS}, "Date": "datetime64[ns]", "Value": "float32"}
+    )
+
+
+def _read_result_rows(csv_file: str):
+    """(date label or None, test types, results) of a per-file CSV, cells as text and "" as None."""
+    with open(csv_file, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = [(row + ["", ""])[:2] for row in reader]
+    label = header[1] if len(header) > 1 else NO_DATE_LABEL
+    test_types = [test_type or None for test_type, _ in rows]
+    results = [result or None for _, result in rows]
+    return (None if label == NO_DATE_LABEL else label), test_types, results
+
+
+def _long_frame(batches) -> pd.DataFrame:
+    """One untyped long frame from (doc id, date label, test types, results) batches."""
+    doc_ids, test_types, results, dates = [], [], [], []
+    for doc_id, label, batch_types, batch_results in batches:
+        doc_ids.extend([doc_id] * len(batch_types))
+        dates.extend([label] * len(batch_types))
+        test_types.extend(batch_types)
+        results.extend(batch_results)
+    return pd.DataFrame({"DocId": doc_ids, "TestType": test_types, "Result": results, "Date": dates}, dtype=object)
+
+
+def read_result_csv(csv_file: str, doc_id: Optional[str] = None) -> pd.DataFrame:
+    """
+    A per-file CSV (TestType plus one result column headed by the date) as
+    an untyped long frame. Cells are read as text, so "7.20" stays "7.20".
+    """
+    return _long_frame([(doc_id or os.path.basename(csv_file), *_read_result_rows(csv_file))])
+
+
+def load_results(csv_files: Iterable[str], root: Optional[str] = None) -> pd.DataFrame:
+    """
+    Typed records for many per-file CSVs. Rows are collected as plain
+    lists and become one frame at the end, so the cost grows linearly
+    with the number of files. DocId is each file's path relative to root
+    (default: its name), so a patient folder ("M122/labs.pdf.csv") stays
+    part of it.
+    """
+    def doc_id(csv_file):
+        return os.path.relpath(csv_file, root).replace(os.sep, "/") if root else os.path.basename(csv_file)
+
+    return to_records(_long_frame((doc_id(csv_file), *_read_result_rows(csv_file)) for csv_file in csv_files))
+
+
+def read_combined_csv(csv_file: str) -> pd.DataFrame:
+    """Typed records from a long combined CSV (Source, TestType, Result, Date) written by CombinedCsvWriter."""
+    long = pd.read_csv(csv_file, dtype=str, keep_default_na=False).replace("", None)
+    return to_records(long.rename(columns={"Source": "DocId"}))
+
+
+def write_wide_csv(records: pd.DataFrame, output_file: str, separators: bool = True):
+    """
+    Writes records in the merge_csv_files layout: TestType, one column per
+    date label (in order of appearance), and a blank row between documents
+    unless separators is False. Rows are streamed out, so no wide frame is
+    built.
+    """
+    labels = records["DateLabel"].astype(object).fillna(NO_DATE_LABEL).to_numpy()
+    header = list(dict.fromkeys(labels))
+    position = {label: i + 1 for i, label in enumerate(header)}
+    width = len(header) + 1
+
+    doc_ids = records["DocId"].to_numpy()
+    test_types = records["TestType"].astype(object).fillna("").to_numpy()
+    results = records["Result"].astype(object).fillna("").to_numpy()
+
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["TestType"] + header)
+        previous = None
+        for doc_id, test_type, label, result in zip(doc_ids, test_types, labels, results):
+            if separators and previous is not None and doc_id != previous:
+                writer.writerow([""] * width)
+            previous = doc_id
+            row = [""] * width
+            row[0] = test_type
+            row[position[label]] = result
+            writer.writerow(row)
+
+
+def patient_id(source: str) -> Optional[str]:
+    """
+    The patient a report belongs to: the folder of its doc id ("M122/labs.pdf"),
+    which uploads take from the patient form field or the report's folder in
+    a ZIP. None when it has none; file names are not guessed from, since
+    "2024.07.18 CBC.pdf" says nothing about whose report it is.
+    """
+    return os.path.basename(os.path.dirname(source)) or None
+
+
+def add_patients(records: pd.DataFrame) -> pd.DataFrame:
+    """records with a categorical Patient column derived from DocId (once per document), missing if unknown."""
+    doc_ids = records["DocId"].astype("category")
+    patients = [patient_id(str(doc_id)) for doc_id in doc_ids.cat.categories]
+    records = records.copy()
+    records["Patient"] = pd.Categorical(
+        np.array(patients + [None], dtype=object)[doc_ids.cat.codes.to_numpy()]
+    )
+    return records
+
+
+def abnormal(records: pd.DataFrame, flags: List[str] = ABNORMAL_FLAGS) -> pd.DataFrame:
+    """Rows flagged High/Low (or H/L)."""
+    return records[records["Flag"].isin(flags)]
+
+
+def between(records: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+    """Rows with a test date in [start, end]; either bound may be omitted."""
+    mask = records["Date"].notna()
+    if start is not None:
+        mask &= records["Date"] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= records["Date"] <= pd.Timestamp(end)
+    return records[mask]
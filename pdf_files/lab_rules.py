@@ -0,0 +1,57 @@
+"""
+Declarative extraction rules per lab report source.
+
+Each rule set is plain data: regex strings plus a couple of switches. They
+are compiled once, at import time, by lab_parser. To support a new vendor
+add an entry here and run `python benchmarks.py rules` to check it does not
+slow the parser down.
+
+Keys:
+    description  what the rule set is for
+    value        a line that is a result (matched at the start of the line)
+    flag         a High/Low style flag line (matched at the start)
+    number       a numeric line that completes a bare flag line
+    embedded     a "value flag" result inside the test name itself
+    hints        substrings the test name must contain before `embedded` is
+                 tried (a cheap prefilter), or None to always try it
+    skip         lines ignored while looking for the result (or None)
+    take_last    keep the last matching line of the block instead of the first
+"""
+
+DEFAULT_RULE_SET = "default"
+
+VENDOR_RULES = {
+    "default": {
+        "description": "Custom Document AI extractor output (Labcorp style reports)",
+        "value": r"[<>]?\d+(\.\d+)?|Normal",
+        "flag": r"High|Low",
+        "number": r"[<>]?\d+(\.\d+)?",
+        "embedded": r"(\d+(?:\.\d+)?\s*(?:High|Low))",
+        "hints": ["High", "Low"],
+        "skip": None,
+        "take_last": False,
+    },
+    "mychart": {
+        # Inova MyChart exports list the normal range and the chart axis
+        # labels before the value, e.g. "Normal range: 3.10 - 9.50", "3.1", "9.5", "8.85"
+        "description": "MyChart test detail pages",
+        "value": r"[<>]?\d+(\.\d+)?",
+        "flag": r"High|Low",
+        "number": r"[<>]?\d+(\.\d+)?",
+        "embedded": r"(\d+(?:\.\d+)?\s*(?:High|Low))",
+        "hints": ["High", "Low"],
+        "skip": r"(?i)normal range:",
+        "take_last": True,
+    },
+    "quest": {
+        # Quest prints single-letter flags after the value ("133 L", "7.2 H")
+        "description": "Quest Diagnostics reports with H/L flag letters",
+        "value": r"[<>]?\d+(\.\d+)?|Normal|Negative|Positive",
+        "flag": r"(?:High|Low|H|L)\b",
+        "number": r"[<>]?\d+(\.\d+)?",
+        "embedded": r"(\d+(?:\.\d+)?\s*(?:High|Low|H|L)\b)",
+        "hints": None,
+        "skip": None,
+        "take_last": False,
+    },
+}
@@ -1,6 +1,7 @@
 from typing import Optional, List
 from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
+import lab_parser
 import os
 import pandas as pd
 import streamlit as st
@@ -30,11 +31,10 @@ def process_document_sample(
         return None
 
     print(f"📂 Processing file: {file_path}")
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
 
     try:
-        # Initialize Document AI client
-        client = documentai.DocumentProcessorServiceClient(client_options=opts)
+        # Reuse the pooled Document AI client
+        client = get_client(location)
         name = client.processor_path(project_id, location, processor_id)
 
         # Read document content
@@ -81,45 +81,7 @@ def parse_output(file_path: str):
         print("❌ Error: Output file does not exist.")
         return []
 
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-
-    data = []
-    current_date = None
-
-    for line in reversed(lines):
-        if line.startswith("dateoftest:"):
-            current_date = line.split(":", 1)[1].strip()
-            break
-
-    for i, line in enumerate(lines):
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":", 1)[1].strip()
-            result = ""
-
-            embedded_result = re.search(r"(\d+(?:\.\d+)?\s*(?:High|Low))", test_type)
-            if embedded_result:
-                result = embedded_result.group(0)
-                test_type = test_type.replace(result, "").strip()
-
-            for j in range(i + 1, len(lines)):
-                next_line = lines[j].strip()
-                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
-                    break
-
-                if re.match(r"High|Low", next_line):
-                    if re.search(r"\d+", next_line):
-                        result = next_line
-                    elif j + 1 < len(lines) and re.match(r"^[<>]?\d+(\.\d+)?", lines[j + 1].strip()):
-                        result = f"{next_line} {lines[j + 1].strip()}"
-                    break
-                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
-                    result = next_line
-                    break
-
-            data.append((test_type, result, current_date))
-
-    return data
+    return lab_parser.parse_file(file_path)
 
 
 def convert_to_csv(output_text_file: str, output_csv_file: str):
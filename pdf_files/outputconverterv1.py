@@ -1,38 +1,14 @@
 import pandas as pd
-import re
-
-def parse_output(file_path):
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    data = []
-    current_date = None
-
-    # Extract the date from the last two lines
-    if lines[-2].startswith("dateoftest:"):
-        current_date = lines[-2].split(":")[1].strip()
-    elif lines[-1].startswith("dateoftest:"):
-        current_date = lines[-1].split(":")[1].strip()
-
-    for i, line in enumerate(lines[:-2]):  # Exclude the last two lines
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":")[1].strip()
-            if i + 1 < len(lines) and not lines[i + 1].startswith("TestTypeandResult:") and not lines[i + 1].startswith("dateoftest:"):
-                result = lines[i + 1].strip()
-            else:
-                result = ""
-            data.append((test_type, result, current_date))
-
-    return data
+from lab_parser import parse_output
 
 def write_to_sheet(data, sheet):
-    # Set the header for the results column as the date
+    # Rows are appended rather than set cell by cell, so this also works on
+    # write-only (streaming) worksheets; see xlsx_export for whole histories
     if data:
-        sheet['B1'] = data[0][2]  # Use the date from the first entry
+        sheet.append([None, data[0][2]])  # Use the date from the first entry as the results header
 
-    for row, (test_type, result, date) in enumerate(data, start=2):
-        sheet[f'A{row}'] = test_type
-        sheet[f'B{row}'] = result
+    for test_type, result, date in data:
+        sheet.append([test_type, result])
 
 def convert_text_to_csv(input_file, output_file):
     data = parse_output(input_file)
@@ -0,0 +1,136 @@
+"""
+Page-range splitting for long PDFs.
+
+Document AI's synchronous ProcessDocument call has a page limit, and latency
+grows with page count. Long multi-year lab histories are cut into chunks of
+chunk_pages pages, the chunks are sent concurrently, and the partial results
+are stitched back into one logical Document (text offsets and page anchors
+shifted) so parse_output sees a single document.
+"""
+import os
+from typing import List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from google.cloud import documentai
+
+from batch_runner import run_ordered
+
+# Sync processing accepts up to 15 pages per request for most processors
+DEFAULT_CHUNK_PAGES = int(os.environ.get("DOCAI_CHUNK_PAGES", 15))
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+def page_count(content: bytes) -> int:
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        return len(doc)
+
+
+def pdf_bytes(doc) -> bytes:
+    """
+    Serializes a PDF the same way every time: no fresh random trailer /ID,
+    so the bytes (and the cache keys and recorded requests built on them)
+    match from one run to the next.
+    """
+    return doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+
+
+def split_pdf(content: bytes, chunk_pages: int = DEFAULT_CHUNK_PAGES) -> List[Tuple[int, bytes]]:
+    """
+    Cuts a PDF into consecutive page ranges.
+
+    :return: List of (first page index, chunk PDF bytes).
+    """
+    chunks = []
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        for start in range(0, len(doc), chunk_pages):
+            end = min(start + chunk_pages, len(doc)) - 1
+            with fitz.open() as part:
+                part.insert_pdf(doc, from_page=start, to_page=end)
+                chunks.append((start, pdf_bytes(part)))
+    return chunks
+
+
+def _shift_text_anchor(anchor, text_offset: int):
+    for segment in anchor.text_segments:
+        segment.start_index = int(segment.start_index) + text_offset
+        segment.end_index = int(segment.end_index) + text_offset
+
+
+def _shift_entity(entity, text_offset: int, page_offset: int):
+    if entity.text_anchor:
+        _shift_text_anchor(entity.text_anchor, text_offset)
+    if entity.page_anchor:
+        for ref in entity.page_anchor.page_refs:
+            ref.page = int(ref.page) + page_offset
+    for prop in entity.properties:
+        _shift_entity(prop, text_offset, page_offset)
+
+
+def merge_documents(parts: List[Tuple[int, documentai.Document]]) -> documentai.Document:
+    """
+    Reassembles chunk results into one Document. parts holds
+    (first page index, Document) in page order.
+    """
+    merged = documentai.Document()
+    texts = []
+    text_offset = 0
+
+    for page_offset, part in parts:
+        for entity in part.entities:
+            _shift_entity(entity, text_offset, page_offset)
+            merged.entities.append(entity)
+
+        for page in part.pages:
+            page.page_number = int(page.page_number) + page_offset
+            if page.layout and page.layout.text_anchor:
+                _shift_text_anchor(page.layout.text_anchor, text_offset)
+            merged.pages.append(page)
+
+        texts.append(part.text)
+        text_offset += len(part.text)
+
+    merged.text = "".join(texts)
+    if parts:
+        merged.mime_type = parts[0][1].mime_type
+    return merged
+
+
+def process_in_chunks(
+    client,
+    name: str,
+    content: bytes,
+    mime_type: str = "application/pdf",
+    field_mask: Optional[str] = "entities",
+    chunk_pages: int = DEFAULT_CHUNK_PAGES,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    rate_limiter=None,
+    controller=None,
+) -> documentai.Document:
+    """
+    Sends a PDF to Document AI, splitting it first if it is longer than
+    chunk_pages. Short documents go through as a single request.
+    rate_limiter.acquire(), if given, is called before every request, and
+    controller (an AdaptiveConcurrency) wraps each request with its window
+    and throttle retries.
+    """
+    pace = rate_limiter.acquire if rate_limiter is not None else None
+
+    def send(raw_content: bytes) -> documentai.Document:
+        raw_document = documentai.RawDocument(content=raw_content, mime_type=mime_type)
+        request = documentai.ProcessRequest(name=name, raw_document=raw_document, field_mask=field_mask)
+        return client.process_document(request=request).document
+
+    def process(raw_content: bytes) -> documentai.Document:
+        if controller is not None:
+            # Paced before a window slot is taken, on every retry too
+            return controller.call(send, raw_content, pace=pace)
+        if pace is not None:
+            pace()
+        return send(raw_content)
+
+    if mime_type != "application/pdf" or page_count(content) <= chunk_pages:
+        return process(content)
+
+    chunks = split_pdf(content, chunk_pages)
+    documents = run_ordered([chunk for _, chunk in chunks], process, max_in_flight=max_in_flight)
+    return merge_documents([(start, document) for (start, _), document in zip(chunks, documents)])
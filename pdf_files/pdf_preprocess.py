@@ -0,0 +1,114 @@
+"""
+Pre-upload compression for scanned PDFs.
+
+Scanned lab reports are often 10-30 MB of 300+ DPI colour page images.
+Document AI does not need that: the embedded images are re-encoded here as
+grayscale JPEGs at a target DPI before the RawDocument is built. The JPEG
+quality never drops below a configurable floor, and the original bytes are
+kept whenever re-encoding would not make the file smaller.
+"""
+import io
+import os
+from typing import NamedTuple, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from pdf_chunker import pdf_bytes
+
+DEFAULT_TARGET_DPI = int(os.environ.get("DOCAI_TARGET_DPI", 200))
+DEFAULT_JPEG_QUALITY = int(os.environ.get("DOCAI_JPEG_QUALITY", 75))
+QUALITY_FLOOR = int(os.environ.get("DOCAI_JPEG_QUALITY_FLOOR", 50))
+# Images smaller than this are logos and icons, not page scans
+MIN_IMAGE_BYTES = 32 * 1024
+
+
+class CompressionReport(NamedTuple):
+    original_bytes: int
+    compressed_bytes: int
+    images_reencoded: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.compressed_bytes
+
+
+def _effective_dpi(page, xref: int, width_px: int) -> float:
+    """Resolution the image is displayed at on the page (72 points per inch)."""
+    rects = page.get_image_rects(xref)
+    if not rects or rects[0].width <= 0:
+        return 0.0
+    return width_px / (rects[0].width / 72.0)
+
+
+def _reencode(pixmap, scale: float, quality: int) -> Tuple[bytes, int, int]:
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+    if pixmap.colorspace is None or pixmap.colorspace.n != 1:
+        pixmap = fitz.Pixmap(fitz.csGRAY, pixmap)
+
+    image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    if scale < 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue(), image.width, image.height
+
+
+def _replace_image_stream(doc, xref: int, jpeg: bytes, width: int, height: int):
+    """Swaps the image data in place, so every page using the xref sees the new image."""
+    doc.update_stream(xref, jpeg, compress=0)
+    doc.xref_set_key(xref, "Filter", "/DCTDecode")
+    doc.xref_set_key(xref, "DecodeParms", "null")
+    doc.xref_set_key(xref, "Decode", "null")
+    doc.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+    doc.xref_set_key(xref, "Width", str(width))
+    doc.xref_set_key(xref, "Height", str(height))
+
+
+def compress_pdf(
+    content: bytes,
+    target_dpi: int = DEFAULT_TARGET_DPI,
+    quality: int = DEFAULT_JPEG_QUALITY,
+    quality_floor: int = QUALITY_FLOOR,
+) -> Tuple[bytes, CompressionReport]:
+    """
+    Downsamples embedded page images to target_dpi as grayscale JPEGs.
+
+    :return: (PDF bytes to upload, CompressionReport). The original content
+             is returned unchanged if nothing got smaller.
+    """
+    quality = max(quality, quality_floor)
+    reencoded = 0
+
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        seen = set()
+        for page in doc:
+            for info in page.get_images(full=True):
+                xref, width_px, bits = info[0], info[2], info[4]
+                # Stencil masks (1 bit) are already as small as they get
+                if xref in seen or bits == 1:
+                    continue
+                seen.add(xref)
+
+                original = doc.xref_stream_raw(xref)
+                if original is None or len(original) < MIN_IMAGE_BYTES:
+                    continue
+
+                dpi = _effective_dpi(page, xref, width_px)
+                scale = target_dpi / dpi if dpi > target_dpi else 1.0
+                jpeg, width, height = _reencode(fitz.Pixmap(doc, xref), scale, quality)
+                if len(jpeg) < len(original):
+                    _replace_image_stream(doc, xref, jpeg, width, height)
+                    reencoded += 1
+
+        if not reencoded:
+            return content, CompressionReport(len(content), len(content), 0)
+        compressed = pdf_bytes(doc)
+
+    if len(compressed) >= len(content):
+        return content, CompressionReport(len(content), len(content), 0)
+    return compressed, CompressionReport(len(content), len(compressed), reencoded)
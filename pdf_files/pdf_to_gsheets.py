@@ -3,6 +3,8 @@ import tabula
 import pandas as pd
 import re
 
+from reference_ranges import join_broken_ranges, parse_ranges
+
 
 def extract_dates(pdf_path):
     doc = fitz.open(pdf_path)
@@ -52,7 +54,8 @@ def extract_test_results(pdf_path):
     return results
 
 def extract_test_types_and_normal_range(text):
-    lines = text.splitlines()
+    # "Normal Range: 136 -" / "145 mmol/L" back on one line
+    lines = join_broken_ranges(text.splitlines())
     test_types = []
     normal_ranges = []
     capture = False
@@ -121,8 +124,9 @@ data_reordered = {
     'Result': results + [''] * (max_len - len(results))
 }
 
-# Convert to DataFrame
+# Convert to DataFrame, with the ranges as numbers alongside the raw text
 df_reordered = pd.DataFrame(data_reordered)
+df_reordered = pd.concat([df_reordered, parse_ranges(df_reordered['Normal Range'])], axis=1)
 
 # Save to CSV with the correct column order
 csv_reordered_path = r'C:\Users\joyjp\Desktop\Carte Clinics Project\pdf_to_sheet_project\pdf_files\test_results2.csv'
@@ -0,0 +1,266 @@
+"""
+Per-patient wide tables: one row per component, one column per test date.
+
+This is the layout of converted2.csv, built from parsed results instead
+of scraped from one report:
+
+    Component,"Mar 17, 2020","Sep 23, 2020","Aug 22, 2022"
+    Sodium,133 mmol/L Low,139 mmol/L,135 mmol/L Low
+
+Each new document is applied to its patient's table as an update (new
+cells, and a new column or row only where needed) rather than by pivoting
+the whole history again. Only tables that changed are written out:
+
+    pivots = get_pivots()
+    pivots.apply_rows("M122/2024.07.18.pdf", parse_output(entities), document=file_hash(pdf_path))
+    pivots.flush("processed/pivots", formats=["csv", "parquet"])
+
+Columns run chronologically; undated results go to a "No date" column at
+the end. A component printed twice in one report gets two rows. Documents
+are keyed by the hash of their PDF, like in the results store: applying
+the same document again replaces its earlier cells, and two reports that
+share a file name are both kept.
+
+The tables live in one process. When several processes write the same
+folder, pass flush() the stored history, so each table is rebuilt from it
+before it is written; writes are serialized by a lock file in the folder.
+"""
+import bisect
+import contextlib
+import csv
+import os
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from lab_records import parse_dates, patient_id
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within the process
+    fcntl = None
+
+COMPONENT_COLUMN = "Component"
+NO_DATE_COLUMN = "No date"
+PIVOT_FORMATS = ["csv", "parquet"]
+LOCK_FILE = ".lock"
+
+
+def _column_key(date, label: Optional[str]) -> tuple:
+    """Sort key of a date column: dated columns by date, then undated ones by label."""
+    if date is not None and not pd.isna(date):
+        return 0, pd.Timestamp(date).normalize().value, ""
+    return 1, 0, label or NO_DATE_COLUMN
+
+
+class PatientPivot:
+    """One patient's wide table, updated one document at a time."""
+
+    def __init__(self, patient: str):
+        self.patient = patient
+        self.row_names: List[str] = []
+        self._rows: Dict[Tuple[str, int], int] = {}  # (component, occurrence in a report) -> row
+        self._order: List[tuple] = []  # column keys, chronological
+        self._labels: Dict[tuple, str] = {}  # column key -> header, as first printed
+        self._cells: Dict[tuple, Dict[int, Tuple[str, str]]] = {}  # column key -> {row: (result, document)}
+        self._documents: Dict[str, List[Tuple[tuple, int]]] = {}  # document -> its cells
+
+    @property
+    def labels(self) -> List[str]:
+        return [self._labels[key] for key in self._order]
+
+    def _column(self, date, label: Optional[str]) -> tuple:
+        key = _column_key(date, label)
+        if key not in self._cells:
+            bisect.insort(self._order, key)
+            self._cells[key] = {}
+            dated = key[0] == 0
+            self._labels[key] = (label or pd.Timestamp(key[1]).strftime("%Y-%m-%d")) if dated else key[2]
+        return key
+
+    def _row(self, component: str, occurrence: int) -> int:
+        row = self._rows.get((component, occurrence))
+        if row is None:
+            row = self._rows[(component, occurrence)] = len(self.row_names)
+            self.row_names.append(component)
+        return row
+
+    def remove(self, document: str):
+        """Drops the cells a document wrote (unless a later document has overwritten them)."""
+        for key, row in self._documents.pop(document, []):
+            column = self._cells[key]
+            if row in column and column[row][1] == document:
+                del column[row]
+            if not column:
+                del self._cells[key], self._labels[key]
+                self._order.pop(bisect.bisect_left(self._order, key))
+
+    def apply(self, document: str, rows: Iterable[Tuple[str, Optional[str], object, Optional[str]]]):
+        """
+        Adds one document's (component, result, date, date label) rows,
+        replacing what the same document wrote before.
+        """
+        self.remove(document)
+        written = []
+        seen = Counter()
+        for component, result, date, label in rows:
+            if not component:
+                continue
+            key = self._column(date, label)
+            occurrence = seen[(component, key)]
+            seen[(component, key)] += 1
+            row = self._row(component, occurrence)
+            self._cells[key][row] = (result or "", document)
+            written.append((key, row))
+        self._documents[document] = written
+
+    def iter_rows(self) -> Iterable[List[str]]:
+        """Header, then one list of cells per component row (rows left empty by a replaced document are skipped)."""
+        columns = [self._cells[key] for key in self._order]
+        yield [COMPONENT_COLUMN] + self.labels
+        for row, component in enumerate(self.row_names):
+            cells = [column[row][0] if row in column else "" for column in columns]
+            if any(cells):
+                yield [component] + cells
+
+    def to_frame(self) -> pd.DataFrame:
+        rows = self.iter_rows()
+        header = next(rows)
+        return pd.DataFrame(list(rows), columns=header, dtype=object)
+
+    def write_csv(self, path: str):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(self.iter_rows())
+
+    def write_parquet(self, path: str):
+        # pandas hands this to pyarrow, which is only needed for this format
+        self.to_frame().replace("", None).to_parquet(path, index=False)
+
+
+class PivotBuilder:
+    """Wide tables of every patient; documents are applied as they are parsed."""
+
+    def __init__(self):
+        self.pivots: Dict[str, PatientPivot] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _apply(self, source: str, rows, document: Optional[str] = None):
+        patient = patient_id(source)
+        if patient is None:
+            # Whose table it belongs in is unknown; it is not pooled with other reports
+            return
+        pivot = self.pivots.get(patient)
+        if pivot is None:
+            pivot = self.pivots[patient] = PatientPivot(patient)
+        pivot.apply(document or source, rows)
+        self._dirty.add(patient)
+
+    def apply_rows(self, source: str, rows: List[Tuple[str, str, Optional[str]]], document: Optional[str] = None):
+        """One document's (test type, result, date label) rows, as from parse_output; document is its hash."""
+        labels = pd.Series([date for _, _, date in rows], dtype=object)
+        dates = parse_dates(labels)
+        with self._lock:
+            self._apply(source, [
+                (test_type, result, date, label)
+                for (test_type, result, label), date in zip(rows, dates)
+            ], document)
+
+    def _apply_records(self, records: pd.DataFrame, hashes: Optional[Dict[str, str]] = None):
+        if records.empty:
+            return
+        columns = [
+            records[column].astype(object).where(records[column].notna(), None).to_numpy()
+            for column in ["TestType", "Result", "Date", "DateLabel"]
+        ]
+        doc_ids = records["DocId"].astype(object)
+        if "Sha256" in records:
+            documents = records["Sha256"].astype(object)
+        else:
+            documents = doc_ids.map(hashes or {})
+            documents = documents.where(documents.notna(), doc_ids)
+        codes, keys = pd.factorize(documents)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+        doc_ids = doc_ids.to_numpy()
+        for code, document in enumerate(keys):
+            positions = order[bounds[code]:bounds[code + 1]]
+            rows = [tuple(column[i] for column in columns) for i in positions]
+            self._apply(str(doc_ids[positions[0]]), rows, str(document))
+
+    def apply_records(self, records: pd.DataFrame, hashes: Optional[Dict[str, str]] = None):
+        """
+        Typed records (lab_records) of any number of documents, applied
+        document by document. Documents are keyed by the records' Sha256
+        column, else by hashes (DocId -> hash), else by DocId.
+        """
+        with self._lock:
+            self._apply_records(records, hashes)
+
+    def table(self, patient: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            pivot = self.pivots.get(patient)
+            return pivot.to_frame() if pivot else None
+
+    def flush(self, folder: str, formats: Iterable[str] = ("csv",),
+              history: Optional[Callable[[str], pd.DataFrame]] = None) -> List[str]:
+        """
+        Writes <folder>/<patient>.csv (and .parquet) for every table changed
+        since the last flush. history(patient), when given, returns the
+        patient's stored records (with a Sha256 column); the table is rebuilt
+        from them first, so reports other processes stored are kept.
+        """
+        formats = list(formats)
+        for output_format in formats:
+            if output_format not in PIVOT_FORMATS:
+                raise ValueError(f"Unknown pivot format '{output_format}'; expected one of {PIVOT_FORMATS}")
+        os.makedirs(folder, exist_ok=True)
+        written = []
+        with self._lock, _folder_lock(folder):
+            for patient in sorted(self._dirty):
+                if history is not None:
+                    self.pivots[patient] = PatientPivot(patient)
+                    self._apply_records(history(patient))
+                pivot = self.pivots[patient]
+                for output_format in formats:
+                    path = os.path.join(folder, f"{patient}.{output_format}")
+                    # Readers (the download route) never see a half-written table
+                    partial = f"{path}.{os.getpid()}.tmp"
+                    if output_format == "csv":
+                        pivot.write_csv(partial)
+                    else:
+                        pivot.write_parquet(partial)
+                    os.replace(partial, path)
+                    written.append(path)
+            self._dirty.clear()
+        return written
+
+
+@contextlib.contextmanager
+def _folder_lock(folder: str):
+    """Holds the folder's lock file, so one process at a time rebuilds and writes its tables."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(folder, LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_default_pivots = None
+_default_lock = threading.Lock()
+
+
+def get_pivots() -> PivotBuilder:
+    """Process-wide pivot tables."""
+    global _default_pivots
+    with _default_lock:
+        if _default_pivots is None:
+            _default_pivots = PivotBuilder()
+        return _default_pivots
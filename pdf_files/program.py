@@ -1,12 +1,12 @@
 import streamlit as st
 import pandas as pd
 import base64
-import re
 import os
 
 # Google Cloud Document AI
 from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
+from lab_parser import parse_output
 
 
 # -----------------------------
@@ -29,8 +29,7 @@ def process_document_sample(
         raise FileNotFoundError(f"The file '{file_path}' does not exist.")
 
     # Configure API endpoint
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    client = get_client(location)
 
     # Construct the processor name
     name = client.processor_path(project_id, location, processor_id)
@@ -69,55 +68,6 @@ def process_document_sample(
     return output_file
 
 
-def parse_output(file_path: str):
-    """
-    Parse the text file to extract 'dateoftest' and 'TestTypeandResult' data.
-    """
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-
-    data = []
-    current_date = None
-
-    # Find date from reversed lines
-    for line in reversed(lines):
-        if line.startswith("dateoftest:"):
-            current_date = line.split(":", 1)[1].strip()
-            break
-
-    # Collect test info
-    for i, line in enumerate(lines):
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":", 1)[1].strip()
-            result = ""
-
-            # Check if there's an embedded numeric + High/Low
-            embedded_result = re.search(r"(\d+(?:\.\d+)?\s*(?:High|Low))", test_type)
-            if embedded_result:
-                result = embedded_result.group(0)
-                test_type = test_type.replace(result, "").strip()
-
-            # Look ahead for result
-            for j in range(i + 1, len(lines)):
-                next_line = lines[j].strip()
-                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
-                    break
-
-                if re.match(r"High|Low", next_line):
-                    if re.search(r"\d+", next_line):
-                        result = next_line
-                    elif j + 1 < len(lines) and re.match(r"^[<>]?\d+(\.\d+)?", lines[j + 1].strip()):
-                        result = f"{next_line} {lines[j + 1].strip()}"
-                    break
-                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
-                    result = next_line
-                    break
-
-            data.append((test_type, result, current_date))
-
-    return data
-
-
 def convert_to_csv(output_text_file: str, output_csv_file: str):
     """
     Convert parsed text data to CSV.
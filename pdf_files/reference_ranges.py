@@ -0,0 +1,172 @@
+"""
+Reference ("Normal Range:") parsing and out-of-range flagging.
+
+PDF text puts ranges on lines of their own and often breaks them:
+
+    Normal Range: 136 -        Normal Range: <1.1 mg/       Normal Range: 5.8 - 7.6
+    145 mmol/L                 dL                           g/dL
+
+join_broken_ranges() stitches such lines back together. parse_ranges()
+turns range strings into RangeLow / RangeHigh floats and a unit, each
+distinct string once, and flag_results() compares a whole lab_records
+table against its ranges in one vectorized pass:
+
+    table = attach_ranges(records, ranges)   # adds RangeLow/High/Unit/Flag
+    out_of_range(table)
+
+The upload pipeline uses fill_flags(), which gives results the report
+printed without a High/Low flag the one their range implies.
+"""
+import re
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+RANGE_LABEL = "Normal Range:"
+NUMBER = r"-?\d+(?:\.\d+)?"
+RANGE_PATTERN = re.compile(
+    rf"^\s*(?:(?P<low>{NUMBER})\s*-\s*(?P<high>{NUMBER})|(?P<op><=|>=|<|>|≤|≥)\s*(?P<bound>{NUMBER}))"
+    r"\s*(?P<unit>\S.*?)?\s*$"
+)
+# A line holding nothing but a unit ("g/dL", "U/L", "%"), printed under a range that had none
+UNIT_LINE = re.compile(r"^(?:[A-Za-zµ0-9^*]*/[A-Za-z0-9.^]+|%|fL|pg|sec)$")
+RANGE_FLAGS = ["Low", "High", "Normal"]
+
+
+def _incomplete(range_text: str) -> bool:
+    return range_text.endswith(("-", "/")) or not range_text
+
+
+def join_broken_ranges(lines: Iterable[str]) -> List[str]:
+    """
+    Lines with each "Normal Range:" line completed by the line(s) it was
+    broken across: a missing upper bound, the rest of a unit, or a unit
+    printed on its own line. Other lines pass through unchanged.
+    """
+    joined = []
+    pending = None
+    for line in lines:
+        stripped = line.strip()
+        if pending is not None:
+            range_text = pending.split(RANGE_LABEL, 1)[1].strip()
+            if _incomplete(range_text) and stripped and RANGE_LABEL not in stripped:
+                pending = f"{pending}{stripped}" if range_text.endswith("/") else f"{pending} {stripped}"
+                continue
+            parsed = RANGE_PATTERN.match(range_text)
+            if parsed and not parsed.group("unit") and UNIT_LINE.match(stripped):
+                joined.append(f"{pending} {stripped}")
+                pending = None
+                continue
+            joined.append(pending)
+            pending = None
+        if RANGE_LABEL in stripped:
+            pending = stripped
+        else:
+            joined.append(line)
+    if pending is not None:
+        joined.append(pending)
+    return joined
+
+
+def parse_range(range_text: str):
+    """(low, high, unit) for "136 - 145 mmol/L", "<1.1 mg/dL" or ">59"; NaN bounds when absent."""
+    found = RANGE_PATTERN.match(range_text) if isinstance(range_text, str) else None
+    if found is None:
+        return np.nan, np.nan, None
+    if found.group("op") is None:
+        return float(found.group("low")), float(found.group("high")), found.group("unit")
+    bound = float(found.group("bound"))
+    if found.group("op") in ("<", "<=", "≤"):
+        return np.nan, bound, found.group("unit")
+    return bound, np.nan, found.group("unit")
+
+
+def parse_ranges(ranges: pd.Series) -> pd.DataFrame:
+    """RangeLow, RangeHigh and RangeUnit columns; each distinct range string is parsed once."""
+    codes, uniques = pd.factorize(ranges)
+    parsed = [parse_range(range_text) for range_text in uniques] + [(np.nan, np.nan, None)]
+    low, high, unit = (np.array(column) for column in zip(*parsed))
+    return pd.DataFrame(
+        {
+            "RangeLow": low.astype("float32")[codes],
+            "RangeHigh": high.astype("float32")[codes],
+            "RangeUnit": pd.Categorical(unit.astype(object)[codes]),
+        },
+        index=ranges.index,
+    )
+
+
+def flag_results(table: pd.DataFrame) -> pd.Categorical:
+    """
+    Low / High / Normal for every row with a Value and at least one range
+    bound, missing when that cannot be told. A "<5" result is only a
+    bound: it is Low when 5 is at or below the lower limit, Normal when the
+    range has no lower limit and 5 is at or below the upper one, and
+    unknown otherwise (">" likewise).
+    """
+    value = table["Value"].to_numpy(dtype="float64", na_value=np.nan)
+    low = table["RangeLow"].to_numpy(dtype="float64", na_value=np.nan)
+    high = table["RangeHigh"].to_numpy(dtype="float64", na_value=np.nan)
+    comparator = (
+        table["Comparator"].astype(object).to_numpy() if "Comparator" in table else np.full(len(table), None)
+    )
+    less_than = comparator == "<"
+    more_than = comparator == ">"
+    exact = ~less_than & ~more_than
+
+    # Comparisons with NaN are False, so a missing bound never decides anything
+    below = np.where(less_than, value <= low, exact & (value < low))
+    above = np.where(more_than, value >= high, exact & (value > high))
+    has_range = ~np.isnan(low) | ~np.isnan(high)
+    normal = np.select(
+        [less_than, more_than],
+        [np.isnan(low) & (value <= high), np.isnan(high) & (value >= low)],
+        default=has_range & ~np.isnan(value),
+    ) & ~below & ~above
+
+    codes = np.full(len(table), -1, dtype="int8")
+    codes[normal] = RANGE_FLAGS.index("Normal")
+    codes[below] = RANGE_FLAGS.index("Low")
+    codes[above] = RANGE_FLAGS.index("High")
+    return pd.Categorical.from_codes(codes, categories=RANGE_FLAGS)
+
+
+def attach_ranges(records: pd.DataFrame, ranges: pd.DataFrame) -> pd.DataFrame:
+    """
+    records (from lab_records) with RangeLow, RangeHigh, RangeUnit and
+    RangeFlag columns. ranges has TestType and Range, plus DocId when
+    ranges differ per report; every row is matched with one join.
+    """
+    keys = ["DocId", "TestType"] if "DocId" in ranges else ["TestType"]
+    ranges = ranges.drop_duplicates(keys, keep="last")
+    ranges = pd.concat([ranges[keys].reset_index(drop=True), parse_ranges(ranges["Range"]).reset_index(drop=True)], axis=1)
+    for key in keys:
+        # Join on plain values; the categories of the two sides rarely match
+        ranges[key] = ranges[key].astype(object)
+    left = records[keys].astype(object)
+    matched = left.merge(ranges, how="left", on=keys, sort=False)
+    table = records.copy()
+    for column in ["RangeLow", "RangeHigh", "RangeUnit"]:
+        table[column] = matched[column].to_numpy()
+    table["RangeUnit"] = table["RangeUnit"].astype("category")
+    table["RangeFlag"] = flag_results(table)
+    return table
+
+
+def out_of_range(table: pd.DataFrame) -> pd.DataFrame:
+    """Rows of an attach_ranges table outside their reference range."""
+    return table[table["RangeFlag"].isin(["Low", "High"])]
+
+
+def fill_flags(records: pd.DataFrame, ranges: pd.DataFrame) -> pd.DataFrame:
+    """
+    records with a Low / High / Normal Flag from their range (see
+    attach_ranges) where the report printed none; printed flags are kept.
+    """
+    if ranges.empty or records.empty:
+        return records
+    table = attach_ranges(records, ranges)
+    flags = records["Flag"].astype(object)
+    flags = flags.where(flags.notna(), table["RangeFlag"].astype(object))
+    return records.assign(Flag=flags.astype("category"))
@@ -0,0 +1,237 @@
+"""
+SQLite store of every parsed lab result, for longitudinal queries.
+
+The CSVs hold one upload each; here all of them accumulate in one file
+(processed/results.db by default) with two indexes:
+
+    results (patient, analyte, date)   "every Sodium for M122 since 2020"
+    documents (sha256)                 has this report been stored already?
+
+Documents are keyed by the hash of their PDF (or per-file CSV), so
+re-processing a report replaces its rows instead of duplicating them,
+and two reports that share a file name are both kept.
+Rows are inserted with executemany in batched transactions:
+
+    store = get_store()
+    store.add_records(records, hashes={"M122/labs.pdf": file_hash(pdf_path)})
+    store.query(patient="M122", analyte="Sodium", since="2020-01-01")
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from lab_records import ABNORMAL_FLAGS, add_patients
+
+DEFAULT_DB_PATH = os.environ.get("DOCAI_RESULTS_DB", os.path.join("processed", "results.db"))
+# Result rows per transaction
+BATCH_ROWS = 50_000
+QUERY_COLUMNS = ["Source", "Patient", "TestType", "Result", "Date", "DateLabel", "Comparator", "Value", "Unit", "Flag"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    source TEXT NOT NULL,
+    patient TEXT,  -- NULL when the report named no patient
+    added TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256);
+
+CREATE TABLE IF NOT EXISTS results (
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    patient TEXT,
+    analyte TEXT COLLATE NOCASE,
+    date TEXT,  -- yyyy-mm-dd, NULL when the report had no readable date
+    date_label TEXT,
+    result TEXT,
+    comparator TEXT,
+    value REAL,
+    unit TEXT,
+    flag TEXT
+);
+CREATE INDEX IF NOT EXISTS results_patient_analyte_date ON results (patient, analyte, date);
+CREATE INDEX IF NOT EXISTS results_document ON results (document_id);
+"""
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file's bytes, the identity of a stored document."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cells(series: pd.Series) -> list:
+    """Column values as Python objects for sqlite3, None where missing."""
+    return np.where(series.isna().to_numpy(), None, series.astype(object).to_numpy()).tolist()
+
+
+class ResultsStore:
+    """Results of many uploads in one SQLite file, shared by the app's threads."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Readers (the other app, a notebook) are not blocked by inserts
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _rows(self, records: pd.DataFrame) -> List[tuple]:
+        records = add_patients(records)
+        values = records["Value"].to_numpy()
+        return list(zip(
+            _cells(records["Patient"]),
+            _cells(records["TestType"]),
+            _cells(records["Date"].dt.strftime("%Y-%m-%d")),
+            _cells(records["DateLabel"]),
+            _cells(records["Result"]),
+            _cells(records["Comparator"]),
+            # via the float32 repr, so 4.1 is stored as 4.1
+            _cells(pd.Series(values.astype(str).astype("float64"))),
+            _cells(records["Unit"]),
+            _cells(records["Flag"]),
+        ))
+
+    def _write_batch(self, documents: List[tuple]):
+        """Replaces the stored rows of (sha256, source, rows) documents in one transaction."""
+        added = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            for sha256, source, rows in documents:
+                patient = rows[0][0]
+                found = self._conn.execute("SELECT id FROM documents WHERE sha256 = ?", (sha256,)).fetchone()
+                if found:
+                    document_id = found[0]
+                    self._conn.execute("DELETE FROM results WHERE document_id = ?", (document_id,))
+                    self._conn.execute(
+                        "UPDATE documents SET source = ?, patient = ?, added = ? WHERE id = ?",
+                        (source, patient, added, document_id),
+                    )
+                else:
+                    document_id = self._conn.execute(
+                        "INSERT INTO documents (sha256, source, patient, added) VALUES (?, ?, ?, ?)",
+                        (sha256, source, patient, added),
+                    ).lastrowid
+                self._conn.executemany(
+                    "INSERT INTO results (document_id, patient, analyte, date, date_label, result,"
+                    " comparator, value, unit, flag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(document_id, *row) for row in rows],
+                )
+
+    def add_records(self, records: pd.DataFrame, hashes: Dict[str, str]) -> int:
+        """
+        Stores typed records (lab_records) and returns how many rows were
+        written. hashes maps every DocId to the hash of the document's
+        content (file_hash); a document stored before is replaced.
+        """
+        if records.empty:
+            return 0
+        codes, doc_ids = pd.factorize(records["DocId"].astype(object))
+        missing = [str(doc_id) for doc_id in doc_ids if not hashes.get(doc_id)]
+        if missing:
+            raise ValueError(f"No document hash for {', '.join(missing)}")
+        rows = self._rows(records)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(doc_ids) + 1))
+
+        batch, batch_rows = [], 0
+        for code, doc_id in enumerate(doc_ids):
+            positions = order[bounds[code]:bounds[code + 1]]
+            batch.append((hashes[doc_id], str(doc_id), [rows[i] for i in positions]))
+            batch_rows += len(positions)
+            if batch_rows >= BATCH_ROWS:
+                self._write_batch(batch)
+                batch, batch_rows = [], 0
+        if batch:
+            self._write_batch(batch)
+        return len(rows)
+
+    def query(self, patient: Optional[str] = None, analyte: Optional[str] = None,
+              since=None, until=None, abnormal: bool = False, with_hash: bool = False) -> pd.DataFrame:
+        """
+        Stored results, oldest first (in report order within a report),
+        filtered by patient, analyte (any case) and test date range; a
+        bound excludes undated results. abnormal keeps only High / Low
+        flagged results; with_hash adds each report's Sha256.
+        """
+        conditions, params = [], []
+        if patient is not None:
+            conditions.append("r.patient = ?")
+            params.append(patient)
+        if analyte is not None:
+            conditions.append("r.analyte = ?")
+            params.append(analyte)
+        if since is not None:
+            conditions.append("r.date >= ?")
+            params.append(pd.Timestamp(since).strftime("%Y-%m-%d"))
+        if until is not None:
+            conditions.append("r.date <= ?")
+            params.append(pd.Timestamp(until).strftime("%Y-%m-%d"))
+        if abnormal:
+            conditions.append(f"r.flag IN ({', '.join('?' * len(ABNORMAL_FLAGS))})")
+            params.extend(ABNORMAL_FLAGS)
+        sql = (
+            "SELECT d.source, r.patient, r.analyte, r.result, r.date, r.date_label, r.comparator, r.value, r.unit, r.flag"
+            + (", d.sha256" if with_hash else "")
+            + " FROM results r JOIN documents d ON d.id = r.document_id"
+        )
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY r.date, d.id, r.rowid"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        frame = pd.DataFrame(rows, columns=QUERY_COLUMNS + (["Sha256"] if with_hash else []))
+        frame["Date"] = pd.to_datetime(frame["Date"], format="%Y-%m-%d")
+        return frame
+
+    def patients(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT patient FROM documents WHERE patient IS NOT NULL ORDER BY patient")]
+
+    def analytes(self, patient: Optional[str] = None) -> List[str]:
+        """Distinct analytes, for one patient when given."""
+        sql = "SELECT DISTINCT analyte FROM results WHERE analyte IS NOT NULL"
+        params = []
+        if patient is not None:
+            sql += " AND patient = ?"
+            params.append(patient)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql + " ORDER BY analyte", params)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            results = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"path": self.path, "documents": documents, "results": results}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: Optional[str] = None) -> Optional[ResultsStore]:
+    """One shared store per database file (default DOCAI_RESULTS_DB or processed/results.db); None when set empty."""
+    path = DEFAULT_DB_PATH if path is None else path
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ResultsStore(path)
+        return _stores[path]
@@ -0,0 +1,243 @@
+"""
+Local stand-in for the Google Sheets API calls sheets_writer makes.
+
+Serves plain HTTP on localhost and keeps spreadsheets in memory, creating
+one on first use of its id. Every request and byte received is counted so
+writers can be compared by how much traffic they generate:
+
+    python sheets_standin.py --port 8090 --latency 0.05
+    SHEETS_API_ENDPOINT=http://localhost:8090 DOCAI_SHEETS_SPREADSHEET=local python totalprogramv2.py
+
+Supported:
+
+    GET  /v4/spreadsheets/{id}                    tab titles
+    POST /v4/spreadsheets/{id}:batchUpdate        addSheet requests
+    POST /v4/spreadsheets/{id}/values:batchUpdate
+    POST /v4/spreadsheets/{id}/values:batchClear
+    PUT  /v4/spreadsheets/{id}/values/{range}     single-range update
+
+Bodies over --max-request-bytes are refused with 413, and --error-rate
+answers a share of requests with 429 to exercise retries.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import unquote
+
+SPREADSHEET_PATH = re.compile(r"^/v4/spreadsheets/(?P<id>[^/:]+)(?P<rest>.*)$")
+# 'Tab name'!B5, Tab!A1 or just a tab
+A1_RANGE = re.compile(r"^(?:'(?P<quoted>(?:[^']|'')+)'|(?P<plain>[^'!]+))(?:!(?P<column>[A-Z]+)(?P<row>\d+))?")
+
+
+class StandinError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+class SheetsStandin:
+    """In-memory spreadsheets plus request counters."""
+
+    def __init__(self, latency: float = 0.0, max_request_bytes: Optional[int] = None,
+                 error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.max_request_bytes = max_request_bytes
+        self.error_rate = error_rate
+        # spreadsheet id -> tab title -> {row number: cells}
+        self.spreadsheets: Dict[str, Dict[str, Dict[int, list]]] = {}
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.cells_written = 0
+        self.rejected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _tabs(self, spreadsheet_id: str) -> Dict[str, Dict[int, list]]:
+        return self.spreadsheets.setdefault(spreadsheet_id, {"Sheet1": {}})
+
+    def _parse_range(self, tabs, range_text: str):
+        found = A1_RANGE.match(range_text)
+        title = None
+        if found:
+            title = found.group("quoted").replace("''", "'") if found.group("quoted") else found.group("plain")
+        if title not in tabs:
+            raise StandinError(400, f"Unable to parse range: {range_text}")
+        row = int(found.group("row") or 1)
+        column = _column_index(found.group("column") or "A")
+        return tabs[title], row, column
+
+    def _write(self, tabs, range_text: str, values: List[list]) -> int:
+        grid, row, column = self._parse_range(tabs, range_text)
+        cells = 0
+        for offset, values_row in enumerate(values):
+            line = grid.setdefault(row + offset, [])
+            if len(line) < column + len(values_row):
+                line.extend([""] * (column + len(values_row) - len(line)))
+            line[column:column + len(values_row)] = values_row
+            cells += len(values_row)
+        self.cells_written += cells
+        return cells
+
+    def handle(self, method: str, path: str, body: bytes) -> dict:
+        """Answers one request; raises StandinError for HTTP errors."""
+        with self._lock:
+            self.bytes_received += len(body)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.rejected += 1
+                raise StandinError(429, "Quota exceeded (injected)")
+            if self.max_request_bytes and len(body) > self.max_request_bytes:
+                self.rejected += 1
+                raise StandinError(413, f"Request body of {len(body)} bytes is over the limit")
+        if self.latency:
+            time.sleep(self.latency)
+
+        found = SPREADSHEET_PATH.match(path.split("?", 1)[0])
+        if not found:
+            raise StandinError(404, f"Unknown path {path}")
+        spreadsheet_id, rest = unquote(found.group("id")), found.group("rest")
+        payload = json.loads(body) if body else {}
+
+        with self._lock:
+            tabs = self._tabs(spreadsheet_id)
+            if method == "GET" and rest == "":
+                self.requests["get"] += 1
+                return {
+                    "spreadsheetId": spreadsheet_id,
+                    "sheets": [{"properties": {"title": title, "sheetId": i}} for i, title in enumerate(tabs)],
+                }
+            if method == "POST" and rest == ":batchUpdate":
+                self.requests["batchUpdate"] += 1
+                replies = []
+                for request in payload.get("requests", []):
+                    title = request.get("addSheet", {}).get("properties", {}).get("title")
+                    if title is None:
+                        raise StandinError(400, "Only addSheet requests are supported")
+                    if title in tabs:
+                        raise StandinError(400, f"A sheet with the name \"{title}\" already exists.")
+                    tabs[title] = {}
+                    replies.append({"addSheet": {"properties": {"title": title, "sheetId": len(tabs) - 1}}})
+                return {"spreadsheetId": spreadsheet_id, "replies": replies}
+            if method == "POST" and rest == "/values:batchUpdate":
+                self.requests["values.batchUpdate"] += 1
+                cells = sum(self._write(tabs, entry["range"], entry.get("values", [])) for entry in payload.get("data", []))
+                return {"spreadsheetId": spreadsheet_id, "totalUpdatedCells": cells}
+            if method == "POST" and rest == "/values:batchClear":
+                self.requests["values.batchClear"] += 1
+                for range_text in payload.get("ranges", []):
+                    self._parse_range(tabs, range_text)[0].clear()
+                return {"spreadsheetId": spreadsheet_id, "clearedRanges": payload.get("ranges", [])}
+            if method == "PUT" and rest.startswith("/values/"):
+                self.requests["values.update"] += 1
+                range_text = unquote(rest[len("/values/"):])
+                cells = self._write(tabs, range_text, payload.get("values", []))
+                return {"spreadsheetId": spreadsheet_id, "updatedRange": range_text, "updatedCells": cells}
+        raise StandinError(404, f"Unsupported call {method} {path}")
+
+    def values(self, spreadsheet_id: str, title: str) -> List[list]:
+        """A tab's rows, from row 1 to the last written one."""
+        with self._lock:
+            grid = self.spreadsheets.get(spreadsheet_id, {}).get(title, {})
+            return [grid.get(row, []) for row in range(1, max(grid, default=0) + 1)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": sum(self.requests.values()),
+                "by_method": dict(self.requests),
+                "bytes_received": self.bytes_received,
+                "cells_written": self.cells_written,
+                "rejected": self.rejected,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_received = self.cells_written = self.rejected = 0
+
+
+def _handler(standin: SheetsStandin):
+    class SheetsHandler(BaseHTTPRequestHandler):
+        # Keep-alive, so a shared session reuses its connections
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status: int, payload: dict):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _dispatch(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+            try:
+                self._reply(200, standin.handle(self.command, self.path, body))
+            except StandinError as e:
+                self._reply(e.status, {"error": {"code": e.status, "message": e.message}})
+            except (ValueError, KeyError) as e:
+                self._reply(400, {"error": {"code": 400, "message": f"Invalid request: {e}"}})
+
+        do_GET = do_POST = do_PUT = _dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    return SheetsHandler
+
+
+def serve(port: int = 0, **options):
+    """
+    Starts the stand-in in a background thread. Keyword options go to
+    SheetsStandin.
+
+    :return: (server, port, standin). Call server.shutdown() when done.
+    """
+    standin = SheetsStandin(**options)
+    server = ThreadingHTTPServer(("localhost", port), _handler(standin))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1], standin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Google Sheets API stand-in")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep per request")
+    parser.add_argument("--max-request-bytes", type=int, default=None, help="Refuse larger bodies with 413")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server, port, standin = serve(
+        port=args.port,
+        latency=args.latency,
+        max_request_bytes=args.max_request_bytes,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"Sheets stand-in listening on http://localhost:{port}")
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(standin.stats()))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
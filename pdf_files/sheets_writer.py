@@ -0,0 +1,229 @@
+"""
+Google Sheets sink for parsed lab results.
+
+Results are written with a handful of calls per spreadsheet instead of a
+request (or cell assignment) per value:
+
+    GET   spreadsheets/{id}                   which tabs exist
+    POST  spreadsheets/{id}:batchUpdate       add the missing tabs (once)
+    POST  spreadsheets/{id}/values:batchClear clear the tabs being written
+    POST  spreadsheets/{id}/values:batchUpdate all rows, split at max_request_bytes
+
+Tabs are laid out like the XLSX export (one per patient, per test date or
+a single one). Values are sent RAW, so a result such as "=1+1" or "1/2"
+is stored as the text it is, never run as a formula or read as a date;
+test dates go in as yyyy-mm-dd text. Every call goes through one shared
+authorized HTTP session, and several spreadsheets can be written
+concurrently:
+
+    writer = SheetsWriter()
+    writer.write_many({"1AbC...": records_a, "9XyZ...": records_b})
+
+Setting SHEETS_API_ENDPOINT (e.g. "http://localhost:8090") points the
+writer at sheets_standin.py, which needs no credentials.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from xlsx_export import COLUMNS, SHEET_LAYOUTS, cell_columns, sheet_groups, sheet_name
+
+ENDPOINT_ENV = "SHEETS_API_ENDPOINT"
+DEFAULT_ENDPOINT = "https://sheets.googleapis.com"
+SHEETS_SCOPE = "https://www.googleapis.com/auth/spreadsheets"
+# Google suggests keeping request bodies to about 2 MB
+DEFAULT_MAX_REQUEST_BYTES = 2 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 4
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 4
+
+
+def resolve_endpoint(endpoint: Optional[str] = None) -> str:
+    """Explicit endpoint, else $SHEETS_API_ENDPOINT, else the public API."""
+    return (endpoint or os.environ.get(ENDPOINT_ENV) or DEFAULT_ENDPOINT).rstrip("/")
+
+
+def is_local_endpoint(endpoint: str) -> bool:
+    host = endpoint.split("://", 1)[-1].split("/", 1)[0].rsplit(":", 1)[0]
+    return host in {"localhost", "127.0.0.1", "[::1]"}
+
+
+def create_session(endpoint: str, credentials=None, pool_size: int = DEFAULT_MAX_WORKERS) -> requests.Session:
+    """
+    An HTTP session for endpoint with a connection pool of pool_size.
+    Local stand-ins get a plain session; the real API an AuthorizedSession
+    (application default credentials unless credentials are given).
+    """
+    if is_local_endpoint(endpoint):
+        session = requests.Session()
+    else:
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+
+        if credentials is None:
+            credentials, _ = google.auth.default(scopes=[SHEETS_SCOPE])
+        session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(endpoint: Optional[str] = None, pool_size: int = DEFAULT_MAX_WORKERS) -> requests.Session:
+    """One warm session per endpoint, shared by every writer and thread."""
+    endpoint = resolve_endpoint(endpoint)
+    with _sessions_lock:
+        if endpoint not in _sessions:
+            _sessions[endpoint] = create_session(endpoint, pool_size=pool_size)
+        return _sessions[endpoint]
+
+
+def _cell(value):
+    """A JSON value for the API: dates as yyyy-mm-dd text (kept as text with RAW input), missing as ""."""
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _quoted(title: str) -> str:
+    """A tab title as an A1 sheet reference ("'M122'", "'Bob''s'")."""
+    return "'{}'".format(title.replace("'", "''"))
+
+
+def _a1(title: str, row: int) -> str:
+    """A1 range starting at column A of a row ("'M122'!A5")."""
+    return f"{_quoted(title)}!A{row}"
+
+
+def tab_rows(records: pd.DataFrame, sheets: str = "patient") -> Dict[str, List[list]]:
+    """Rows (header first) for each tab, in the layout of xlsx_export."""
+    columns = cell_columns(records)
+    tabs = {}
+    used = {}
+    for label, positions in sheet_groups(records, sheets):
+        rows = [COLUMNS]
+        rows.extend([_cell(column[i]) for column in columns] for i in positions)
+        tabs[sheet_name(label, used)] = rows
+    return tabs
+
+
+def _entry(title: str, start: int, rows: List[bytes]) -> bytes:
+    head = '{{"range":{},"majorDimension":"ROWS","values":['.format(json.dumps(_a1(title, start)))
+    return head.encode("utf-8") + b",".join(rows) + b"]}"
+
+
+def _body(entries: List[bytes]) -> bytes:
+    return b'{"valueInputOption":"RAW","data":[' + b",".join(entries) + b"]}"
+
+
+def value_update_bodies(tabs: Dict[str, List[list]], max_request_bytes: int = DEFAULT_MAX_REQUEST_BYTES) -> List[bytes]:
+    """
+    values:batchUpdate request bodies covering every row of tabs, each at
+    most max_request_bytes (a single row larger than that gets a body of
+    its own). Rows are serialized once and the bodies assembled as bytes.
+    """
+    bodies = []
+    entries: List[bytes] = []
+    size = len(_body([]))
+    for title, rows in tabs.items():
+        # Wrapper of one range entry, with room for any row number
+        wrapper = len(_entry(title, 10 ** 9, [])) + 1
+        chunk: List[bytes] = []
+        start = 1
+        for number, row in enumerate(rows, start=1):
+            encoded = json.dumps(row, ensure_ascii=False, default=str).encode("utf-8")
+            needed = len(encoded) + 1 + (0 if chunk else wrapper)
+            if size + needed > max_request_bytes and (chunk or entries):
+                if chunk:
+                    entries.append(_entry(title, start, chunk))
+                bodies.append(_body(entries))
+                entries, chunk, start = [], [], number
+                size = len(_body([]))
+                needed = len(encoded) + 1 + wrapper
+            chunk.append(encoded)
+            size += needed
+        if chunk:
+            entries.append(_entry(title, start, chunk))
+    if entries:
+        bodies.append(_body(entries))
+    return bodies
+
+
+class SheetsWriter:
+    """Writes lab results into spreadsheets with batched value updates."""
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        endpoint: Optional[str] = None,
+        max_request_bytes: int = DEFAULT_MAX_REQUEST_BYTES,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        self.endpoint = resolve_endpoint(endpoint)
+        self.session = session or get_session(self.endpoint, pool_size=max_workers)
+        self.max_request_bytes = max_request_bytes
+        self.max_workers = max_workers
+
+    def _url(self, spreadsheet_id: str, suffix: str = "") -> str:
+        return f"{self.endpoint}/v4/spreadsheets/{quote(spreadsheet_id, safe='')}{suffix}"
+
+    def _call(self, method: str, url: str, stats: dict, body: Optional[bytes] = None, **kwargs) -> dict:
+        """One API call; rate-limit and server errors are retried with backoff."""
+        headers = {"Content-Type": "application/json"} if body is not None else None
+        for attempt in range(MAX_RETRIES + 1):
+            response = self.session.request(method, url, data=body, headers=headers, timeout=60, **kwargs)
+            stats["requests"] += 1
+            stats["bytes_sent"] += len(body or b"")
+            if response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                break
+            time.sleep(min(2 ** attempt * 0.5, 8.0))
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def write(self, spreadsheet_id: str, records: pd.DataFrame, sheets: str = "patient") -> dict:
+        """
+        Replaces the contents of one tab per patient / date (see
+        xlsx_export) in a spreadsheet. Returns request, byte and row counts.
+        """
+        if sheets not in SHEET_LAYOUTS:
+            raise ValueError(f"Unknown sheet layout '{sheets}'; expected one of {SHEET_LAYOUTS}")
+        stats = {"spreadsheet": spreadsheet_id, "requests": 0, "bytes_sent": 0, "rows": len(records), "tabs": 0}
+        tabs = tab_rows(records, sheets)
+        stats["tabs"] = len(tabs)
+
+        existing = self._call(
+            "GET", self._url(spreadsheet_id), stats, params={"fields": "sheets.properties.title"}
+        )
+        titles = {sheet["properties"]["title"] for sheet in existing.get("sheets", [])}
+        missing = [title for title in tabs if title not in titles]
+        if missing:
+            body = {"requests": [{"addSheet": {"properties": {"title": title}}} for title in missing]}
+            self._call("POST", self._url(spreadsheet_id, ":batchUpdate"), stats, json.dumps(body).encode("utf-8"))
+        present = [title for title in tabs if title in titles]
+        if present:
+            body = {"ranges": [_quoted(title) for title in present]}
+            self._call("POST", self._url(spreadsheet_id, "/values:batchClear"), stats, json.dumps(body).encode("utf-8"))
+
+        for body in value_update_bodies(tabs, self.max_request_bytes):
+            self._call("POST", self._url(spreadsheet_id, "/values:batchUpdate"), stats, body)
+        return stats
+
+    def write_many(self, jobs: Dict[str, pd.DataFrame], sheets: str = "patient") -> List[dict]:
+        """Writes {spreadsheet id: records} with up to max_workers spreadsheets at once."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = [pool.submit(self.write, spreadsheet_id, records, sheets) for spreadsheet_id, records in jobs.items()]
+            return [future.result() for future in running]
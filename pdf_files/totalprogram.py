@@ -1,9 +1,9 @@
 from flask import Flask, request, render_template, send_file
 import os
 import pandas as pd
-import re
 from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
+from lab_parser import parse_output
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
@@ -32,8 +32,7 @@ def process_document_sample(file_path):
     mime_type = "application/pdf"
     output_file = os.path.join(app.config["PROCESSED_FOLDER"], "output.txt")
 
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    client = get_client(location)
     name = client.processor_path(project_id, location, processor_id)
 
     with open(file_path, "rb") as document_file:
@@ -60,48 +59,6 @@ def process_document_sample(file_path):
     return output_file
 
 
-def parse_output(file_path):
-    with open(file_path, "r") as file:
-        lines = file.readlines()
-
-    data = []
-    current_date = None
-
-    for line in reversed(lines):
-        if line.startswith("dateoftest:"):
-            current_date = line.split(":")[1].strip()
-            break
-
-    for i, line in enumerate(lines):
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":", 1)[1].strip()
-            result = ""
-
-            embedded_result = re.search(r"(\d+(?:\.\d+)?\s*(?:High|Low))", test_type)
-            if embedded_result:
-                result = embedded_result.group(0)
-                test_type = test_type.replace(result, "").strip()
-
-            for j in range(i + 1, len(lines)):
-                next_line = lines[j].strip()
-                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
-                    break
-
-                if re.match(r"High|Low", next_line):
-                    if re.search(r"\d+", next_line):
-                        result = next_line
-                    elif j + 1 < len(lines) and re.match(r"^[<>]?\d+(\.\d+)?", lines[j + 1].strip()):
-                        result = f"{next_line} {lines[j + 1].strip()}"
-                    break
-                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
-                    result = next_line
-                    break
-
-            data.append((test_type, result, current_date))
-
-    return data
-
-
 def convert_to_csv(output_text_file, output_csv_file):
     data = parse_output(output_text_file)
     structured_data = [{"TestType": test_type, "Result": result} for test_type, result, date in data]
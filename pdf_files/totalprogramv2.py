@@ -1,11 +1,31 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify
+import json
 import os
-import re
 import pandas as pd
+import shutil
 import zipfile
+import requests
+from google.auth.exceptions import GoogleAuthError
 from werkzeug.utils import secure_filename
-from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
+from docai_client import get_client
+from docai_cache import cache_key, get_cache
+from batch_runner import DEFAULT_MAX_IN_FLIGHT, get_rate_limiter, iter_ordered, run_ordered
+from pdf_chunker import DEFAULT_CHUNK_PAGES, process_in_chunks
+from adaptive_limiter import AdaptiveConcurrency
+from docai_entities import extract_entities, write_debug_output, write_entity_dump
+from hybrid_router import route_document
+from pdf_preprocess import compress_pdf
+from lab_parser import parse_output, test_ranges
+from batch_parser import parse_batch, write_per_file_csvs
+from lab_records import add_patients, load_results, read_combined_csv, write_wide_csv
+from analyte_index import canonicalize_rows, get_index
+from combined_writer import CombinedCsvWriter
+from reference_ranges import fill_flags
+from xlsx_export import SHEET_LAYOUTS, XLSX_MIMETYPE, write_xlsx
+from results_store import file_hash, get_store
+from pivot_builder import get_pivots
+from sheets_writer import SheetsWriter
+from job_queue import get_job_queue, new_job_id
 
 app = Flask(__name__)
 
@@ -17,13 +37,49 @@ ALLOWED_EXTENSIONS = {"pdf", "zip"}
 
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["PROCESSED_FOLDER"] = PROCESSED_FOLDER
+# How many PDFs may be with Document AI at once, and the per-processor request rate cap
+app.config["MAX_IN_FLIGHT"] = int(os.environ.get("DOCAI_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT))
+app.config["PROCESSOR_QPS"] = float(os.environ.get("DOCAI_PROCESSOR_QPS", 0)) or None
+app.config["CHUNK_PAGES"] = DEFAULT_CHUNK_PAGES
+# Write the old <name>.txt entity dumps next to the CSVs for debugging
+app.config["DEBUG_OUTPUT"] = os.environ.get("DOCAI_DEBUG_OUTPUT", "") == "1"
+# Parse text-layer pages locally and only send scanned pages to Document AI (opt-in: the local
+# parser does not read every layout the custom extractor does)
+app.config["HYBRID_ROUTING"] = os.environ.get("DOCAI_HYBRID_ROUTING", "") == "1"
+# Downsample scanned page images to grayscale JPEG before upload
+app.config["COMPRESS_SCANS"] = os.environ.get("DOCAI_COMPRESS_SCANS", "1") == "1"
+# Map test names to the canonical names in analytes.py ("PROTEIN, TOTAL" -> "Total Protein")
+app.config["CANONICAL_NAMES"] = os.environ.get("DOCAI_CANONICAL_NAMES", "1") == "1"
+# Append rows to the combined CSV (long layout) as each PDF finishes, instead of staging per-file CSVs
+app.config["STREAM_COMBINED"] = os.environ.get("DOCAI_STREAM_COMBINED", "1") == "1"
+# Also write processed/<name>.csv per PDF when streaming
+app.config["PER_FILE_CSVS"] = os.environ.get("DOCAI_PER_FILE_CSVS", "") == "1"
+# "parquet" or "arrow": also write the results as a columnar dataset partitioned by patient and year
+app.config["COLUMNAR_FORMAT"] = os.environ.get("DOCAI_COLUMNAR_FORMAT", "")
+app.config["COLUMNAR_FOLDER"] = os.path.join(PROCESSED_FOLDER, f"results_{app.config['COLUMNAR_FORMAT'] or 'parquet'}")
+# SQLite file every upload's results accumulate in; empty to turn the store off
+app.config["RESULTS_DB"] = os.environ.get("DOCAI_RESULTS_DB", os.path.join(PROCESSED_FOLDER, "results.db"))
+# Per-patient wide tables (component x test date) kept up to date per document: "csv", "csv,parquet" or empty
+app.config["PIVOT_FORMATS"] = [f for f in os.environ.get("DOCAI_PIVOT_FORMATS", "csv").split(",") if f]
+app.config["PIVOT_FOLDER"] = os.path.join(PROCESSED_FOLDER, "pivots")
+# Google Sheets spreadsheet id to write each upload's patients to (one tab per patient); empty to skip
+app.config["SHEETS_SPREADSHEET"] = os.environ.get("DOCAI_SHEETS_SPREADSHEET", "")
+# Uploads are processed in the background: job state lives in JOBS_DB, outputs under processed/jobs/<id>/
+app.config["JOBS_DB"] = os.environ.get("DOCAI_JOBS_DB", os.path.join(PROCESSED_FOLDER, "jobs.db"))
+app.config["JOBS_FOLDER"] = os.path.join(PROCESSED_FOLDER, "jobs")
+app.config["JOB_WORKERS"] = int(os.environ.get("DOCAI_JOB_WORKERS", 2))
+# Seconds a running job's heartbeat may lag before another process (or a restart) takes the job over
+app.config["JOB_LEASE"] = float(os.environ.get("DOCAI_JOB_LEASE", 30))
+
+# Grows concurrent Document AI calls while healthy, backs off and retries on quota/deadline errors
+docai_controller = AdaptiveConcurrency(
+    initial_window=min(4, app.config["MAX_IN_FLIGHT"]),
+    max_window=app.config["MAX_IN_FLIGHT"],
+)
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
-# Track processing progress in a global variable
-processing_complete = False
-
 
 def allowed_file(filename):
     """Check if the file has an allowed extension (PDF or ZIP)."""
@@ -32,134 +88,197 @@ def allowed_file(filename):
 
 def process_document_sample(file_path):
     """
-    Processes a single PDF file with Document AI and extracts text.
+    Processes a single PDF file with Document AI and returns its entities.
     Using gcloud auth application-default login for credentials.
+    The text dump is only written when DEBUG_OUTPUT is enabled.
     """
-    global processing_complete
-    processing_complete = False  # Reset processing flag at the start
-
     # Replace these with your own GCP info
     project_id = "dataformatter-437611"
     location = "us"
     processor_id = "3fde13115fa0076f"
     mime_type = "application/pdf"
 
-    output_txt = os.path.join(PROCESSED_FOLDER, f"{os.path.basename(file_path)}.txt")
-
     try:
         # Use Application Default Credentials (requires `gcloud auth application-default login`)
-        opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-        client = documentai.DocumentProcessorServiceClient(client_options=opts)
+        client = get_client(location)
         name = client.processor_path(project_id, location, processor_id)
 
         with open(file_path, "rb") as f:
             document_content = f.read()
 
-        raw_document = documentai.RawDocument(content=document_content, mime_type=mime_type)
-        request = documentai.ProcessRequest(name=name, raw_document=raw_document, field_mask="entities")
-
-        result = client.process_document(request=request)
-        document = result.document
-
-        with open(output_txt, "w", encoding="utf-8") as output:
-            if document.text:
-                output.write("Extracted Text:\n")
-                output.write(document.text + "\n\n")
-
-            if document.entities:
-                output.write("Extracted Entities:\n")
-                for entity in document.entities:
-                    output.write(f"{entity.type_}: {entity.mention_text}\n")
+        def fetch_document(content):
+            # PDFs seen before (e.g. re-sent inside a ZIP) come from the local cache
+            cache = get_cache()
+            key = cache_key(content, name, field_mask="entities")
+            document = cache.get(key)
+            if document is None:
+                if app.config["COMPRESS_SCANS"]:
+                    # Re-encode oversized scan images before upload
+                    content, report = compress_pdf(content)
+                    if report.images_reencoded:
+                        print(
+                            f"Compressed {os.path.basename(file_path)}: {report.original_bytes} -> "
+                            f"{report.compressed_bytes} bytes ({report.images_reencoded} images)"
+                        )
+
+                # Long PDFs are split into page chunks that go out concurrently
+                document = process_in_chunks(
+                    client,
+                    name,
+                    content,
+                    mime_type=mime_type,
+                    field_mask="entities",
+                    chunk_pages=app.config["CHUNK_PAGES"],
+                    rate_limiter=get_rate_limiter(name, app.config["PROCESSOR_QPS"]),
+                    controller=docai_controller,
+                )
+                cache.put(key, document)
+            return document
+
+        document = None
+        if app.config["HYBRID_ROUTING"]:
+            # Pages with a text layer are parsed locally; only scanned pages go to Document AI
+            entities = route_document(document_content, fetch_document, label=os.path.basename(file_path))
+        else:
+            document = fetch_document(document_content)
+            entities = extract_entities(document)
+
+        if app.config["DEBUG_OUTPUT"]:
+            output_txt = os.path.join(PROCESSED_FOLDER, f"{os.path.basename(file_path)}.txt")
+            if document is not None:
+                write_debug_output(document, output_txt)
             else:
-                output.write("No entities found in the document.\n")
+                write_entity_dump(entities, output_txt)
 
-        processing_complete = True
-        return output_txt
+        return entities
     except Exception as e:
         print(f"Error processing document: {e}")
-        processing_complete = False
         return None
 
 
-def parse_output(file_path):
-    """Parses extracted text from Document AI output to structure the data."""
-    with open(file_path, "r", encoding="utf-8") as file:
-        lines = file.readlines()
+def write_columnar(records, hashes):
+    """
+    Adds records to the Parquet / Arrow dataset when COLUMNAR_FORMAT is set;
+    hashes maps DocId to the PDF's hash, which names (and replaces) its files.
+    """
+    if not app.config["COLUMNAR_FORMAT"]:
+        return None
+    # pyarrow is only needed for this output mode
+    from columnar_output import write_results
 
-    data = []
-    current_date = None
+    return write_results(records, app.config["COLUMNAR_FOLDER"], hashes, app.config["COLUMNAR_FORMAT"])
 
-    # Attempt to find a date in reverse
-    for line in reversed(lines):
-        if line.startswith("dateoftest:"):
-            current_date = line.split(":", 1)[1].strip()
-            break
 
-    # Find test types & results
-    for i, line in enumerate(lines):
-        if line.startswith("TestTypeandResult:"):
-            test_type = line.split(":", 1)[1].strip()
-            result = ""
+def store_results(records, hashes):
+    """Adds records to the SQLite results store, keyed by document hash (see results_store)."""
+    if not app.config["RESULTS_DB"]:
+        return 0
+    return get_store(app.config["RESULTS_DB"]).add_records(records, hashes)
 
-            # Check subsequent lines for a result
-            for j in range(i + 1, len(lines)):
-                next_line = lines[j].strip()
-                if next_line.startswith("TestTypeandResult:") or next_line.startswith("dateoftest:"):
-                    break
 
-                if re.match(r"High|Low", next_line):
-                    if re.search(r"\d+", next_line):
-                        result = next_line
-                    break
-                elif re.match(r"^[<>]?\d+(\.\d+)?|Normal", next_line):
-                    result = next_line
-                    break
+def printed_ranges(name, test_types, entities):
+    """(DocId, TestType, Range) for the tests of one report that print a reference range."""
+    ranges = test_ranges(entities)
+    if len(ranges) != len(test_types):
+        # Rows and mentions out of step: no flags rather than wrong ones
+        return []
+    return [(name, test_type, range_text) for test_type, range_text in zip(test_types, ranges) if range_text]
 
-            data.append((test_type, result, current_date))
 
-    return data
+def flag_from_ranges(records, ranges):
+    """Flags results the reports printed without High/Low by their printed reference range."""
+    if not ranges:
+        return records
+    flagged = fill_flags(records, pd.DataFrame(ranges, columns=["DocId", "TestType", "Range"]))
+    added = int((flagged["Flag"].isin(["Low", "High"]) & records["Flag"].isna()).sum())
+    print(f"Flagged {added} results outside their printed reference range")
+    return flagged
 
 
-def convert_to_csv(output_text_file, output_csv_file):
-    """Converts structured parsed output into a CSV."""
-    data = parse_output(output_text_file)
+def stored_history(patient):
+    """A patient's stored results as typed records keyed by report hash, to rebuild their pivot table from."""
+    history = get_store(app.config["RESULTS_DB"]).query(patient=patient, with_hash=True)
+    return history.rename(columns={"Source": "DocId"})
 
-    # If no data, skip CSV creation
-    if not data:
-        print(f"Warning: No data found in {output_text_file}.")
-        return None
 
-    structured_data = [{"TestType": test_type, "Result": result} for (test_type, result, date) in data]
-    df = pd.DataFrame(structured_data)
+def update_pivots(records=None, hashes=None):
+    """
+    Applies records (if given; hashes maps their DocIds to report hashes) to
+    the pivot tables and rewrites the tables that changed. With the results
+    store on, each of those tables is rebuilt from the store first, so it
+    keeps earlier uploads and the ones other workers processed.
+    """
+    if not app.config["PIVOT_FORMATS"]:
+        return []
+    pivots = get_pivots()
+    if records is not None:
+        pivots.apply_records(records, hashes)
+    history = stored_history if app.config["RESULTS_DB"] else None
+    return pivots.flush(app.config["PIVOT_FOLDER"], app.config["PIVOT_FORMATS"], history=history)
 
-    # Attempt to name columns based on discovered date
-    if data and len(data[0]) > 2 and data[0][2] is not None:
-        df.columns = ["TestType", data[0][2]]
 
-    df.to_csv(output_csv_file, index=False)
-    return output_csv_file
+def export_to_sheets(records):
+    """
+    Rewrites the tab of every patient in records in the SHEETS_SPREADSHEET
+    spreadsheet, with their whole stored history when the results store is on.
+    """
+    spreadsheet_id = app.config["SHEETS_SPREADSHEET"]
+    if not spreadsheet_id or records.empty:
+        return None
+    # Reports that named no patient get no tab
+    patients = add_patients(records)["Patient"]
+    records = records[patients.notna().to_numpy()]
+    if records.empty:
+        return None
+    if app.config["RESULTS_DB"]:
+        store = get_store(app.config["RESULTS_DB"])
+        records = pd.concat([store.query(patient=patient) for patient in patients.dropna().unique()], ignore_index=True)
+        records = records.rename(columns={"Source": "DocId"})
+    try:
+        stats = SheetsWriter().write(spreadsheet_id, records, sheets="patient")
+    except (requests.RequestException, GoogleAuthError) as e:
+        # No credentials, or they could not be refreshed: the job's other outputs still stand
+        print(f"Google Sheets export failed: {e}")
+        return None
+    print(f"Wrote {stats['rows']} rows to {stats['tabs']} tabs in {stats['requests']} Sheets API requests")
+    return stats
 
 
-def merge_csv_files(csv_files, output_file):
-    """Merges multiple CSV files into a single CSV with blank rows in between."""
+def merge_csv_files(csv_files, output_file, separators=True, hashes=None, ranges=None):
+    """
+    Merges multiple CSV files into a single CSV, with blank rows in between unless separators is False.
+    hashes maps CSV file names to their PDF's hash, which keys the document in the results
+    store and the columnar dataset (default: the CSV's own). ranges are the reports'
+    (PDF name, test type, printed range), to flag the stored results by.
+    """
     valid_csvs = [csv for csv in csv_files if csv is not None]
     if not valid_csvs:
         print("No valid CSVs found to merge.")
         return None
 
-    # Read each CSV and add blank rows in between
-    combined_df = pd.DataFrame()
-    for csv_file in valid_csvs:
-        df = pd.read_csv(csv_file)
-        # Add a blank row first for separation
-        if not combined_df.empty:
-            blank_row = pd.DataFrame([["", ""]])
-            combined_df = pd.concat([combined_df, blank_row], ignore_index=True)
+    # One typed, categorical frame for every result instead of a wide object frame;
+    # doc ids keep the patient folder ("M122/report.pdf.csv")
+    folder = os.path.dirname(output_file)
+    records = load_results(valid_csvs, root=folder)
+    write_wide_csv(records, output_file, separators=separators)
+    hashes = hashes or {}
+    # Stored under the PDF's name ("M122/report.pdf", not "M122/report.pdf.csv"), as when streaming
+    csv_names = {csv: os.path.relpath(csv, folder).replace(os.sep, "/") for csv in valid_csvs}
+    names = {csv_name: os.path.splitext(csv_name)[0] for csv_name in csv_names.values()}
+    records = records.assign(DocId=records["DocId"].map(names))
+    records = flag_from_ranges(records, ranges)
+    doc_hashes = {names[csv_name]: hashes.get(csv_name) or file_hash(csv) for csv, csv_name in csv_names.items()}
+    write_columnar(records, doc_hashes)
+    store_results(records, doc_hashes)
+    update_pivots(records, doc_hashes)
+    export_to_sheets(records)
+    return output_file
 
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
 
-    combined_df.to_csv(output_file, index=False)
-    return output_file
+def process_pdf_entities(job):
+    """Runs one (pdf_path, name) job through Document AI; parsing happens once for the whole batch."""
+    pdf_path, name = job
+    return process_document_sample(pdf_path)
 
 
 @app.route("/", methods=["GET"])
@@ -235,7 +354,7 @@ def index():
         #upload-btn:hover, #browse-btn:hover {
             background-color: #218838;
         }
-        #download-btn {
+        #download-btn, .xlsx-btn {
             display: none;
             margin-top: 20px;
             padding: 10px 20px;
@@ -244,9 +363,20 @@ def index():
             text-decoration: none;
             border-radius: 5px;
         }
-        #download-btn:hover {
+        #download-btn:hover, .xlsx-btn:hover {
             background-color: #0056b3;
         }
+        #results {
+            display: none;
+            border-collapse: collapse;
+            margin: 20px auto;
+            font-size: 14px;
+            text-align: left;
+        }
+        #results th, #results td {
+            border: 1px solid #ddd;
+            padding: 4px 8px;
+        }
     </style>
 </head>
 <body>
@@ -262,6 +392,9 @@ def index():
         <p>No files uploaded.</p>
     </div>
 
+    <!-- Whose reports these are; PDFs in a ZIP folder belong to the patient the folder is named after -->
+    <p><label>Patient ID <input type="text" id="patient-input" name="patient"></label></p>
+
     <!-- Upload Button -->
     <button id="upload-btn">Upload</button>
 
@@ -272,6 +405,14 @@ def index():
 
     <!-- Download Button -->
     <a id="download-btn" href="#" download="final_combined.csv">Download Processed CSV</a>
+    <a class="xlsx-btn" data-sheets="patient" href="/download?format=xlsx&sheets=patient">Download XLSX (sheet per patient)</a>
+    <a class="xlsx-btn" data-sheets="date" href="/download?format=xlsx&sheets=date">Download XLSX (sheet per date)</a>
+
+    <!-- Parsed results, filled in file by file as they are parsed -->
+    <table id="results">
+        <thead><tr><th>File</th><th>Test</th><th>Result</th><th>Date</th></tr></thead>
+        <tbody id="results-body"></tbody>
+    </table>
 
     <script>
     const dropZone = document.getElementById("drop-zone");
@@ -282,6 +423,8 @@ def index():
     const progressContainer = document.querySelector(".progress-container");
     const progressBar = document.getElementById("progress-bar");
     const downloadBtn = document.getElementById("download-btn");
+    const resultsTable = document.getElementById("results");
+    const resultsBody = document.getElementById("results-body");
 
     let uploadedFiles = [];
 
@@ -346,6 +489,7 @@ def index():
         uploadedFiles.forEach(file => {
             formData.append("file", file);
         });
+        formData.append("patient", document.getElementById("patient-input").value.trim());
 
         progressContainer.style.display = "block";
         progressBar.style.width = "0%";
@@ -362,8 +506,9 @@ def index():
         };
 
         xhr.onload = function () {
-            if (xhr.status === 200) {
-                startProcessingProgress(); // Switch to processing progress
+            if (xhr.status === 202) {
+                const job = JSON.parse(xhr.responseText);
+                followJob(job.job_id); // Switch to processing progress
             } else {
                 alert("Upload failed. Try again.");
             }
@@ -372,32 +517,71 @@ def index():
         xhr.send(formData);
     });
 
-    // Poll /progress to see if the backend is done
-    function startProcessingProgress() {
-        let progress = 50;
-        progressBar.style.width = "50%";
-
-        let processingInterval = setInterval(() => {
-            progress += 5;
-            if (progress >= 100) progress = 95; // Stop at 95% until CSV is ready
-            progressBar.style.width = progress + "%";
-        }, 1000);
-
-        fetch("/progress")
-        .then(response => response.json())
-        .then(data => {
-            if (data.complete) {
-                clearInterval(processingInterval);
+    // Follow /jobs/<id>/events: the second half of the bar is the share of files finished,
+    // and each file's rows are added to the table as soon as it is parsed
+    function followJob(jobId) {
+        const events = new EventSource(`/jobs/${jobId}/events`);
+        const finished = new Set();
+        const shown = new Set();
+        let total = 0;
+        resultsBody.innerHTML = "";
+
+        function showProgress() {
+            progressBar.style.width = 50 + 50 * finished.size / Math.max(total, 1) + "%";
+        }
+
+        events.addEventListener("snapshot", (e) => {
+            const job = JSON.parse(e.data);
+            total = job.files.length;
+            job.files.forEach((file, position) => {
+                if (file.state === "done" || file.state === "failed") finished.add(position);
+            });
+            showProgress();
+        });
+
+        events.addEventListener("file", (e) => {
+            const file = JSON.parse(e.data);
+            if (file.state === "done" || file.state === "failed") {
+                finished.add(file.position);
+                showProgress();
+            }
+        });
+
+        events.addEventListener("rows", (e) => {
+            const file = JSON.parse(e.data);
+            if (shown.has(file.position)) return;
+            shown.add(file.position);
+            file.rows.forEach(([test, result, date]) => {
+                const row = resultsBody.insertRow();
+                [file.name, test, result, date].forEach(value => {
+                    row.insertCell().textContent = value ?? "";
+                });
+            });
+            resultsTable.style.display = "table";
+        });
+
+        function showState(job) {
+            if (job.state === "done") {
+                events.close();
                 progressBar.style.width = "100%";
                 progressContainer.style.display = "none";
 
-                // Show download button
-                downloadBtn.href = "/download";
+                // Show download buttons for this job's results
+                const download = `/download?job=${jobId}`;
+                downloadBtn.href = download;
                 downloadBtn.style.display = "block";
-            } else {
-                setTimeout(startProcessingProgress, 2000);
+                document.querySelectorAll(".xlsx-btn").forEach(link => {
+                    link.href = `${download}&format=xlsx&sheets=${link.dataset.sheets}`;
+                    link.style.display = "block";
+                });
+            } else if (job.state === "failed") {
+                events.close();
+                progressContainer.style.display = "none";
+                alert(`Processing failed: ${job.error}`);
             }
-        });
+        }
+
+        events.addEventListener("job", (e) => showState(JSON.parse(e.data)));
     }
     </script>
 
@@ -406,77 +590,360 @@ def index():
     """
 
 
+def no_progress(position, state, **fields):
+    """
+    Default progress callback of the pipelines: (job position, file state,
+    rows/output/error, and results, the parsed rows of a finished file).
+    """
+
+
+def fetch_entities(pdf_jobs, progress):
+    """process_pdf_entities over job positions, reporting each file as it is sent and when it fails."""
+    def fetch(position):
+        progress(position, "processing")
+        entities = process_pdf_entities(pdf_jobs[position])
+        if entities is None:
+            progress(position, "failed", error="Document AI processing failed")
+        return entities
+
+    return fetch
+
+
+def stream_to_combined_csv(pdf_jobs, output_file=COMBINED_CSV, progress=no_progress):
+    """
+    Parses each PDF as soon as it (and every PDF before it) is back from
+    Document AI and appends its rows to the combined CSV, so only the
+    documents in flight are held in memory.
+    """
+    per_file_dir = os.path.dirname(output_file) if app.config["PER_FILE_CSVS"] else None
+    entity_lists = iter_ordered(
+        range(len(pdf_jobs)), fetch_entities(pdf_jobs, progress), max_in_flight=app.config["MAX_IN_FLIGHT"]
+    )
+    hashes, ranges = {}, []
+    with CombinedCsvWriter(output_file, per_file_dir) as writer:
+        for position, ((pdf_path, name), entities) in enumerate(zip(pdf_jobs, entity_lists)):
+            if entities is None:
+                continue
+            rows = parse_output(entities)
+            if app.config["CANONICAL_NAMES"]:
+                rows = canonicalize_rows(rows)
+            progress(position, "done", rows=writer.add(name, rows), results=rows)
+            hashes[name] = file_hash(pdf_path)
+            ranges += printed_ranges(name, [test_type for test_type, _, _ in rows], entities)
+            if app.config["PIVOT_FORMATS"] and rows:
+                # Each report updates its patient's table as it arrives; written out below
+                get_pivots().apply_rows(name, rows, document=hashes[name])
+
+    if not writer.rows:
+        os.remove(output_file)
+        print("No rows parsed; no combined CSV written.")
+        return None
+    if app.config["COLUMNAR_FORMAT"] or app.config["RESULTS_DB"] or app.config["SHEETS_SPREADSHEET"]:
+        records = flag_from_ranges(read_combined_csv(output_file), ranges)
+        write_columnar(records, hashes)
+        store_results(records, hashes)
+        export_to_sheets(records)
+    update_pivots()
+    return output_file
+
+
+def stage_and_merge(pdf_jobs, output_file=COMBINED_CSV, progress=no_progress):
+    """Writes <name>.csv for every PDF next to output_file, then merges them into the wide combined CSV."""
+    # Results come back in input order, so the merged CSV is deterministic
+    entity_lists = run_ordered(
+        range(len(pdf_jobs)), fetch_entities(pdf_jobs, progress), max_in_flight=app.config["MAX_IN_FLIGHT"]
+    )
+
+    # Parse every document in one frame; job positions are the doc ids, so repeated names stay apart
+    parsed = [(i, entities) for i, entities in enumerate(entity_lists) if entities is not None]
+    long = parse_batch(parsed)
+    if app.config["CANONICAL_NAMES"]:
+        long["TestType"] = get_index().canonicalize_series(long["TestType"])
+    folder = os.path.dirname(output_file)
+    paths = [(i, os.path.join(folder, f"{pdf_jobs[i][1]}.csv")) for i, _ in parsed]
+    # Reports of a known patient go in the patient's folder ("M122/labs.pdf.csv")
+    for _, path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    csv_files = write_per_file_csvs(long, paths)
+    results = {
+        i: rows.astype(object).where(rows.notna(), None).to_numpy().tolist()
+        for i, rows in long.groupby("DocId", sort=False)[["TestType", "Result", "Date"]]
+    }
+    for (i, _), csv_file in zip(parsed, csv_files):
+        progress(i, "done", rows=len(results.get(i, [])), output=csv_file, results=results.get(i))
+    hashes = {f"{name}.csv": file_hash(pdf_path) for pdf_path, name in pdf_jobs}
+    ranges = [
+        printed
+        for i, entities in parsed
+        for printed in printed_ranges(pdf_jobs[i][1], [row[0] for row in results.get(i, [])], entities)
+    ]
+    return merge_csv_files(csv_files, output_file, hashes=hashes, ranges=ranges)
+
+
+def run_upload_job(job_id, pdf_jobs):
+    """Processes one queued upload into processed/jobs/<job_id>/final_combined.csv."""
+    folder = os.path.join(app.config["JOBS_FOLDER"], job_id)
+    os.makedirs(folder, exist_ok=True)
+    output_file = os.path.join(folder, os.path.basename(COMBINED_CSV))
+    queue = job_queue()
+
+    def progress(position, state, results=None, **fields):
+        queue.store.update_file(job_id, position, state, **fields)
+        name = pdf_jobs[position][1]
+        queue.events.publish(job_id, "file", {"position": position, "name": name, "state": state, **fields})
+        if results:
+            # Followers get a file's rows as soon as it is parsed, not when the whole job is done
+            queue.events.publish(job_id, "rows", {"position": position, "name": name, "rows": [list(row) for row in results]})
+
+    # The pipeline the job was submitted for, even if STREAM_COMBINED changed since
+    if queue.store.get(job_id)["mode"] == "stream":
+        return stream_to_combined_csv(pdf_jobs, output_file, progress)
+    return stage_and_merge(pdf_jobs, output_file, progress)
+
+
+def job_queue():
+    """The upload job queue; the first call resumes queued jobs and takes over abandoned ones."""
+    return get_job_queue(run_upload_job, app.config["JOBS_DB"], workers=app.config["JOB_WORKERS"],
+                         lease=app.config["JOB_LEASE"])
+
+
+def patient_name(patient, filename):
+    """A report's name in a job: "<patient>/<file>" when the patient is known, else just the file."""
+    return f"{patient}/{filename}" if patient else filename
+
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
     """
-    POST route that actually handles the file(s) upload and processing.
+    Saves the uploaded PDFs (and the PDFs inside uploaded ZIPs) and queues
+    them as one job. Responds 202 with the job id right away; follow the
+    job at /jobs/<id>.
+
+    The "patient" form field names whose reports they are, and a PDF in a
+    folder of a ZIP belongs to the patient the folder is named after; the
+    job then names it "<patient>/<file>.pdf". Reports with neither are
+    processed but kept out of the per-patient tables and tabs.
     """
-    global processing_complete
-    processing_complete = False
-
     files = request.files.getlist("file")
     if not files or all(f.filename == "" for f in files):
         return "No files selected", 400
+    patient = secure_filename(request.form.get("patient", ""))
 
-    csv_files = []
-    # Create the folders if not present
-    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-    os.makedirs(app.config["PROCESSED_FOLDER"], exist_ok=True)
+    # Each job's files get their own folder, so they survive a restart and never mix with other uploads
+    job_id = new_job_id()
+    upload_folder = os.path.join(app.config["UPLOAD_FOLDER"], job_id)
+    os.makedirs(upload_folder, exist_ok=True)
 
+    # Collect every PDF first (in upload order) so they can be processed in parallel
+    pdf_jobs = []
     for file in files:
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+            file_path = os.path.join(upload_folder, filename)
             file.save(file_path)
 
             # If it's a ZIP, extract PDFs
             if filename.endswith(".zip"):
+                zip_folder = os.path.join(upload_folder, os.path.splitext(filename)[0])
                 with zipfile.ZipFile(file_path, "r") as zip_ref:
-                    zip_ref.extractall(app.config["UPLOAD_FOLDER"])
+                    zip_ref.extractall(zip_folder)
                 os.remove(file_path)
 
-                for extracted_file in os.listdir(app.config["UPLOAD_FOLDER"]):
-                    if extracted_file.endswith(".pdf"):
-                        pdf_path = os.path.join(app.config["UPLOAD_FOLDER"], extracted_file)
-                        output_txt = process_document_sample(pdf_path)
-                        if output_txt:
-                            output_csv = convert_to_csv(output_txt, os.path.join(app.config["PROCESSED_FOLDER"], f"{extracted_file}.csv"))
-                            if output_csv:
-                                csv_files.append(output_csv)
+                for folder, _, extracted_files in sorted(os.walk(zip_folder)):
+                    # "M122/labs.pdf" in the ZIP is M122's report
+                    relative = os.path.relpath(folder, zip_folder)
+                    owner = secure_filename(relative.split(os.sep)[0]) if relative != os.curdir else patient
+                    for extracted_file in sorted(extracted_files):
+                        if extracted_file.endswith(".pdf"):
+                            pdf_jobs.append((os.path.join(folder, extracted_file), patient_name(owner, extracted_file)))
             else:
-                # Process PDF directly
-                output_txt = process_document_sample(file_path)
-                if output_txt:
-                    output_csv = convert_to_csv(output_txt, os.path.join(app.config["PROCESSED_FOLDER"], f"{filename}.csv"))
-                    if output_csv:
-                        csv_files.append(output_csv)
+                pdf_jobs.append((file_path, patient_name(patient, filename)))
 
-    # Merge all CSVs
-    final_csv = merge_csv_files(csv_files, COMBINED_CSV)
-    if final_csv:
-        return "Files uploaded successfully", 200
-    else:
-        return "Processing failed. No CSV generated.", 500
+    if not pdf_jobs:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+        return "No PDF files found in the upload.", 400
+    job_queue().submit(pdf_jobs, job_id=job_id, mode="stream" if app.config["STREAM_COMBINED"] else "stage")
+    return jsonify({"job_id": job_id, "status": f"/jobs/{job_id}"}), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    A job's state, per-file states and timings, and where its results are:
+    "result" is the combined CSV on disk, "download" the URL serving it.
+    """
+    job = job_status(job_id)
+    if job is None:
+        return f"Unknown job {job_id}.", 404
+    return jsonify(job)
+
+
+def job_status(job_id):
+    """A job as stored (see JobStore.get), plus its download URL once done; None if unknown."""
+    job = job_queue().store.get(job_id)
+    if job is not None:
+        job["download"] = f"/download?job={job_id}" if job["state"] == "done" else None
+    return job
+
+
+def sse_message(event, data, event_id=None):
+    """One Server-Sent Events message with JSON data."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Server-Sent Events for one job, over a single long-lived connection:
+    a "snapshot" (the /jobs/<id> status) first, then as they happen "job"
+    (queued, running, done, failed), "file" (sent to Document AI, done or
+    failed, with its row count) and "rows" (a finished file's parsed rows).
+    A job run by another worker sharing jobs.db sends "moved" instead of
+    its progress, and its outcome once it is stored. The stream ends after
+    the job's last event; a client reconnecting with Last-Event-ID picks
+    up after it.
+    """
+    queue = job_queue()
+    job = job_status(job_id)
+    if job is None:
+        return f"Unknown job {job_id}.", 404
+    try:
+        after = int(request.headers.get("Last-Event-ID") or 0)
+    except ValueError:
+        after = 0
+
+    def stream():
+        if not after:
+            yield sse_message("snapshot", job)
+        # Finished before a restart (or long ago): no history to replay, just how it ended
+        if job["state"] in ("done", "failed") and not queue.events.known(job_id):
+            yield sse_message("job", {"state": job["state"], "result": job["result"], "error": job["error"]})
+            return
+        for item in queue.follow(job_id, after):
+            if item is None:
+                yield ": keep-alive\n\n"
+            else:
+                event_id, event, data = item
+                yield sse_message(event, data, event_id)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route("/progress", methods=["GET"])
 def get_progress():
     """
-    Indicates whether Document AI processing is complete.
-    The frontend polls this endpoint.
+    Whether a job (?job=<id>) is finished, or without one whether every
+    queued job is. Kept for old pages; /jobs/<id> has the details.
     """
-    return jsonify({"complete": processing_complete})
+    queue = job_queue()
+    job_id = request.args.get("job")
+    if job_id is None:
+        return jsonify({"complete": not queue.store.unfinished()})
+    job = queue.store.get(job_id)
+    if job is None:
+        return f"Unknown job {job_id}.", 404
+    return jsonify({"complete": job["state"] in ("done", "failed"), "state": job["state"]})
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Exposes the Document AI concurrency window, throttle events and cache counters.
+    """
+    return jsonify({
+        "concurrency": docai_controller.stats(),
+        "cache": get_cache().stats(),
+        "results_store": get_store(app.config["RESULTS_DB"]).stats() if app.config["RESULTS_DB"] else None,
+        "jobs": {"pending": job_queue().pending(), "unfinished": len(job_queue().store.unfinished())},
+    })
+
+
+@app.route("/pivot/<patient>", methods=["GET"])
+def download_pivot(patient):
+    """
+    One patient's wide table (component x test date) as CSV, or as Parquet
+    with ?format=parquet when DOCAI_PIVOT_FORMATS includes it.
+    """
+    output_format = request.args.get("format", "csv")
+    if output_format not in app.config["PIVOT_FORMATS"]:
+        return f"Pivot tables are written as: {', '.join(app.config['PIVOT_FORMATS']) or 'nothing'}.", 404
+    path = os.path.join(app.config["PIVOT_FOLDER"], f"{secure_filename(patient)}.{output_format}")
+    if not os.path.exists(path):
+        return f"No pivot table for patient {patient}.", 404
+    return send_file(path, as_attachment=True)
+
+
+@app.route("/results", methods=["GET"])
+def get_results():
+    """
+    Stored results across every upload, e.g.
+    /results?patient=M122&analyte=Sodium&since=2020-01-01 (all parameters optional);
+    &abnormal=1 keeps only results flagged High or Low, by the report or by its
+    printed reference range. Without a patient, also lists the stored patients.
+    """
+    if not app.config["RESULTS_DB"]:
+        return "The results store is turned off (DOCAI_RESULTS_DB).", 404
+    store = get_store(app.config["RESULTS_DB"])
+    try:
+        results = store.query(
+            patient=request.args.get("patient"),
+            analyte=request.args.get("analyte"),
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            abnormal=request.args.get("abnormal") == "1",
+        )
+    except ValueError:
+        return "since/until must be dates (YYYY-MM-DD).", 400
+    results["Date"] = results["Date"].dt.strftime("%Y-%m-%d")
+    rows = results.astype(object).where(results.notna(), None).to_dict(orient="records")
+    response = {"count": len(rows), "results": rows}
+    if request.args.get("patient") is None:
+        response["patients"] = store.patients()
+    return jsonify(response)
+
+
+def combined_records(job):
+    """Typed records behind a finished job's combined CSV, read as the job's mode wrote it."""
+    if job["mode"] == "stream":
+        return read_combined_csv(job["result"])
+    # The wide merged CSV no longer tells documents apart; read the per-file CSVs
+    outputs = [file["output"] for file in job["files"] if file["output"]]
+    return load_results(outputs, root=os.path.dirname(job["result"]))
+
+
+def export_xlsx(job, sheets):
+    """Writes final_combined_<sheets>.xlsx next to a job's combined CSV unless it is already up to date."""
+    output_file = os.path.join(os.path.dirname(job["result"]), f"final_combined_{sheets}.xlsx")
+    if not os.path.exists(output_file) or os.path.getmtime(output_file) < os.path.getmtime(job["result"]):
+        write_xlsx(combined_records(job), output_file, sheets=sheets)
+    return output_file
 
 
 @app.route("/download", methods=["GET"])
 def download_file():
     """
-    Allows users to download the final merged CSV.
+    Allows users to download a job's merged CSV (?job=<id>, default the
+    latest finished job), or its results as XLSX with
+    ?format=xlsx&sheets=patient|date|single.
     """
-    if os.path.exists(COMBINED_CSV):
-        return send_file(COMBINED_CSV, as_attachment=True)
-    return "No CSV file available for download.", 404
+    store = job_queue().store
+    job_id = request.args.get("job") or store.latest()
+    job = store.get(job_id) if job_id else None
+    if job is None or job["state"] != "done" or not os.path.exists(job["result"]):
+        return "No CSV file available for download.", 404
+    if request.args.get("format", "csv") == "xlsx":
+        sheets = request.args.get("sheets", "patient")
+        if sheets not in SHEET_LAYOUTS:
+            return f"Unknown sheet layout; expected one of {', '.join(SHEET_LAYOUTS)}.", 400
+        return send_file(export_xlsx(job, sheets), as_attachment=True, mimetype=XLSX_MIMETYPE)
+    return send_file(job["result"], as_attachment=True, download_name=os.path.basename(COMBINED_CSV))
 
 
 if __name__ == "__main__":
+    # Resume interrupted jobs at startup; with the reloader, only in the process that serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        job_queue()
     app.run(debug=True)
@@ -0,0 +1,116 @@
+"""
+Streaming XLSX export of parsed lab results.
+
+Rows go through openpyxl's write-only workbook, which serializes each row
+as it is appended instead of keeping a cell object per value, so memory
+stays flat however long the history is. Results can be split into one
+sheet per patient or one per test date:
+
+    write_xlsx(records, "processed/final_combined.xlsx", sheets="patient")
+
+records are typed records from lab_records (to_records, load_results,
+read_combined_csv).
+"""
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from lab_records import add_patients
+
+COLUMNS = ["Source", "TestType", "Result", "Date", "Value", "Unit", "Flag"]
+# One sheet per patient, per test date, or everything on a single sheet
+SHEET_LAYOUTS = ["patient", "date", "single"]
+SINGLE_SHEET = "Results"
+NO_DATE_SHEET = "No date"
+MAX_SHEET_NAME = 31
+INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _cells(series: pd.Series) -> np.ndarray:
+    """Values of a column as plain Python objects, None where missing."""
+    return np.where(series.isna().to_numpy(), None, series.astype(object).to_numpy())
+
+
+def cell_columns(records: pd.DataFrame) -> List[np.ndarray]:
+    """The COLUMNS of records as arrays of plain Python values (None where missing)."""
+    return [
+        _cells(records["DocId"]),
+        _cells(records["TestType"]),
+        _cells(records["Result"]),
+        # date objects get a date (not date-time) number format
+        _cells(records["Date"].dt.date),
+        # via the float32 repr, so 4.1 is written as 4.1 and not 4.099999904632568
+        _cells(pd.Series(records["Value"].to_numpy().astype(str).astype("float64"))),
+        _cells(records["Unit"]),
+        _cells(records["Flag"]),
+    ]
+
+
+def _sheet_keys(records: pd.DataFrame, sheets: str) -> Tuple[np.ndarray, Optional[pd.Series]]:
+    """Sheet label per row, plus the test dates that order the sheets (None: by name)."""
+    if sheets == "patient":
+        # A report that names no patient gets a sheet of its own rather than a shared one
+        patients = add_patients(records)["Patient"].astype(object)
+        labels = patients.where(patients.notna(), records["DocId"].astype(object)).to_numpy()
+        return labels, None
+    dates = records["Date"].dt.strftime("%Y-%m-%d").astype(object)
+    printed = records["DateLabel"].astype(object)
+    labels = dates.where(dates.notna(), printed).fillna(NO_DATE_SHEET).to_numpy()
+    return labels, records["Date"]
+
+
+def sheet_groups(records: pd.DataFrame, sheets: str) -> Iterator[Tuple[str, np.ndarray]]:
+    """(sheet label, row positions) in sheet order; rows keep their order within a sheet."""
+    if sheets not in SHEET_LAYOUTS:
+        raise ValueError(f"Unknown sheet layout '{sheets}'; expected one of {SHEET_LAYOUTS}")
+    if sheets == "single" or records.empty:
+        yield SINGLE_SHEET, np.arange(len(records))
+        return
+
+    labels, dates = _sheet_keys(records, sheets)
+    codes, uniques = pd.factorize(labels)
+    if dates is None:
+        order = np.argsort(np.array(uniques, dtype=str), kind="stable")
+    else:
+        # Chronological, with unreadable and missing dates last
+        first = pd.Series(dates.to_numpy()).groupby(codes).min().reindex(range(len(uniques)))
+        order = np.lexsort((np.array(uniques, dtype=str), first.to_numpy(), first.isna().to_numpy()))
+    rows = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[rows], np.arange(len(uniques) + 1))
+    for code in order:
+        yield uniques[code], rows[bounds[code]:bounds[code + 1]]
+
+
+def sheet_name(label: str, used: Dict[str, int]) -> str:
+    """A valid, unique worksheet title for label (31 characters, no []:*?/\\)."""
+    name = INVALID_SHEET_CHARS.sub("-", str(label)).strip("'") or "Sheet"
+    name = name[:MAX_SHEET_NAME]
+    key = name.lower()
+    if key in used:
+        used[key] += 1
+        suffix = f" ({used[key]})"
+        name = name[:MAX_SHEET_NAME - len(suffix)] + suffix
+        key = name.lower()
+    used[key] = 1
+    return name
+
+
+def write_xlsx(records: pd.DataFrame, output, sheets: str = "patient"):
+    """
+    Writes records to output (a path or binary file object) as XLSX, one
+    sheet per patient, per test date or a single sheet, rows streamed out.
+    """
+    workbook = Workbook(write_only=True)
+    columns = cell_columns(records)
+    used = {}
+    for label, positions in sheet_groups(records, sheets):
+        sheet = workbook.create_sheet(sheet_name(label, used))
+        sheet.append(COLUMNS)
+        for i in positions:
+            sheet.append([column[i] for column in columns])
+    workbook.save(output)
+    return output